@@ -22,7 +22,10 @@ CONFIG = {
     # 許可IPリスト
     "allowed_ips": [
         "127.0.0.1/32" # 必要に応じて自身のIPを追加してください
-    ]
+    ],
+
+    # 人気クエリのキャッシュ事前取得の間隔 (分)。0 で無効
+    "prewarm_interval_minutes": 0
 }
 
 # --- スタックの定義 ---
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+from concurrent.futures import BrokenExecutor, as_completed
+from typing import List
+
+from keyword_matcher import KeywordMatcher
+from metadata_parser import parse_metadata, select_parser
+
+# --- Batch Classifier ---
+# 大量の (title, artist, channel, result_type) をまとめて分類 (キーワード) と解析 (parse_metadata) にかける。
+# 行は使うパーサごとに並べて chunk_size 件ずつのチャンクにし、プロセスプールで並列に処理する。
+# ワーカーは main を import しない。起動時にキーワード構成だけを受け取り、自前の KeywordMatcher を作る。
+# 1行の結果は (index, flags, (title, artist, key))。SongItem への組み立ては呼び出し側で行う。
+# workers=0、またはプールを作れない環境 (Lambda には /dev/shm がない) では呼び出し元のプロセスで処理する。
+# multiprocessing / ProcessPoolExecutor は最初にプールを作るときに import する (コールドスタートに載せない)。
+
+# 行: (index, original_title, artist, channel, result_type)
+
+_worker_matcher = None
+
+def init_worker(keywords: dict):
+    global _worker_matcher
+    _worker_matcher = KeywordMatcher(keywords)
+
+def classify_rows(matcher: KeywordMatcher, rows: list):
+    results = []
+    for index, original_title, artist, channel, result_type in rows:
+        flags = matcher.classify(original_title, channel)
+        results.append((index, flags, parse_metadata(original_title, artist, channel, result_type)))
+    return results
+
+def classify_chunk(rows: list):
+    # ワーカープロセス側の入口
+    return classify_rows(_worker_matcher, rows)
+
+def parser_name(row: tuple):
+    _, original_title, artist, channel, result_type = row
+    return select_parser(original_title, artist, channel, result_type).__name__
+
+def group_chunks(rows: list, chunk_size: int):
+    # 同じパーサの行を隣り合わせにしてから分割する (チャンク内で同じ正規表現・メモを使い回す)
+    ordered = sorted(rows, key=lambda row: (parser_name(row), row[0]))
+    return [ordered[i:i + chunk_size] for i in range(0, len(ordered), chunk_size)]
+
+class BatchClassifier:
+    def __init__(self, workers: int, chunk_size: int = 500):
+        self.workers = workers
+        self.chunk_size = max(chunk_size, 1)
+        self._pool = None
+        self._pool_fingerprint = None
+        self._lock = threading.Lock()
+
+    def pool(self, matcher: KeywordMatcher):
+        # キーワード構成が変わったらワーカーを作り直す。作れなければ以後はプロセス内で処理する
+        if self.workers <= 0: return None
+        with self._lock:
+            if self._pool is not None and self._pool_fingerprint == matcher.fingerprint:
+                return self._pool
+            if self._pool is not None: self._pool.shutdown(wait=False, cancel_futures=True)
+            try:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_worker,
+                    initargs=(matcher.keywords,),
+                )
+            except (OSError, NotImplementedError) as e:
+                print(f"Batch classifier: process pool unavailable, classifying in-process: {e!r}")
+                self.workers, self._pool = 0, None
+                return None
+            self._pool_fingerprint = matcher.fingerprint
+            return self._pool
+
+    def discard_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None: self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def run(self, matcher: KeywordMatcher, rows: list):
+        # チャンクごとの結果を終わった順に返す (同期版。Python API 用)
+        chunks = group_chunks(rows, self.chunk_size)
+        pool = self.pool(matcher) if len(chunks) > 1 else None
+        if pool is None:
+            for chunk in chunks:
+                yield classify_rows(matcher, chunk)
+            return
+
+        futures = {pool.submit(classify_chunk, chunk): chunk for chunk in chunks}
+        done = set()
+        try:
+            for future in as_completed(futures):
+                results = future.result()
+                done.add(future)
+                yield results
+        except BrokenExecutor:
+            # ワーカーが落ちたら残りはプロセス内で片付ける (次回はプールを作り直す)
+            self.discard_pool(pool)
+            for future, chunk in futures.items():
+                if future not in done: yield classify_rows(matcher, chunk)
+        finally:
+            for future in futures: future.cancel()
+
+    async def run_async(self, matcher: KeywordMatcher, rows: list):
+        # run と同じ。イベントループは塞がない (プロセス内で処理する場合もスレッドで回す)
+        loop = asyncio.get_running_loop()
+        chunks = group_chunks(rows, self.chunk_size)
+        pool = self.pool(matcher) if len(chunks) > 1 else None
+        if pool is None:
+            for chunk in chunks:
+                yield await loop.run_in_executor(None, classify_rows, matcher, chunk)
+            return
+
+        pending = {asyncio.wrap_future(pool.submit(classify_chunk, chunk)): chunk for chunk in chunks}
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except BrokenExecutor:
+                        self.discard_pool(pool)
+                        results = await loop.run_in_executor(None, classify_rows, matcher, chunk)
+                    yield results
+        finally:
+            # クライアントが途中で切断した場合は残りのチャンクを取り消す
+            for future in pending: future.cancel()
+
+    def classify(self, matcher: KeywordMatcher, rows: list) -> List[tuple]:
+        # 全件を入力順 (index 順) で返す
+        results = [result for chunk in self.run(matcher, rows) for result in chunk]
+        results.sort(key=lambda result: result[0])
+        return results
@@ -0,0 +1,183 @@
+import bisect
+import gzip
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+# --- Catalog Index ---
+# これまでにランキングした SongItem の転置インデックス (サジェスト用)。
+#   - 正規化 (normalize_for_comparison) したタイトル / アーティストの文字 bi-gram → 文書ID
+#   - 前方一致用に、正規化タイトル / アーティストのソート済みリスト (bisect)
+# 検索が終わるたびに追記し、定期的にディスクへスナップショットを書き出す。
+# スナップショットは複数のプロセス (run_local.py --workers) で共有する。書き出すときはファイルの内容に
+# 自分の文書を重ねて (同じ動画は自分のものを新しいとみなす) max_docs 件に切り詰め、ロック中に置き換える。
+
+def bigrams(text: str):
+    if len(text) < 2: return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+class CatalogIndex:
+    def __init__(self, normalize: Callable[[str], str], max_docs: int = 50000,
+                 snapshot_path: Optional[str] = None, snapshot_interval: float = 60):
+        self.normalize = normalize
+        self.max_docs = max_docs
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._docs: "OrderedDict[str, dict]" = OrderedDict()   # video_id -> SongItem dict
+        self._norm: Dict[str, tuple] = {}                       # video_id -> (norm_title, norm_artist)
+        self._postings: Dict[str, set] = {}                     # bi-gram -> {video_id}
+        self._prefix: List[tuple] = []                          # [(normalized text, video_id)] ソート済み
+        self._prefix_unsorted = False                           # 大量追加の途中 (末尾に足しただけ) なら True
+        self._dirty = False
+        self._snapshot_at = time.monotonic()
+        if snapshot_path: self.load()
+
+    def __len__(self):
+        return len(self._docs)
+
+    # --- 更新 ---
+
+    def add_many(self, songs: List[dict]):
+        # 大量追加 (スナップショット読み込み等) は前方一致リストを最後にまとめてソートする
+        bulk = len(songs) > 256
+        with self._lock:
+            for song in songs:
+                self._add(song, bulk)
+            self._sort_prefix()
+            while len(self._docs) > self.max_docs:
+                oldest = next(iter(self._docs))
+                self._remove(oldest)
+            self._dirty = True
+
+    def _add(self, song: dict, bulk: bool = False):
+        vid = song.get("video_id")
+        if not vid: return
+        norm = (self.normalize(song.get("title", "")), self.normalize(song.get("artist", "")))
+        if vid in self._docs:
+            if self._norm[vid] == norm:
+                self._docs[vid] = song
+                self._docs.move_to_end(vid)
+                return
+            self._remove(vid)
+        self._docs[vid] = song
+        self._norm[vid] = norm
+        for gram in bigrams(norm[0]) | bigrams(norm[1]):
+            self._postings.setdefault(gram, set()).add(vid)
+        for text in set(norm):
+            if not text: continue
+            if bulk:
+                self._prefix.append((text, vid))
+                self._prefix_unsorted = True
+            else:
+                self._sort_prefix()
+                bisect.insort(self._prefix, (text, vid))
+
+    def _sort_prefix(self):
+        # bisect の前に必ず呼ぶ (大量追加の途中で削除・検索が入ることがある)
+        if self._prefix_unsorted:
+            self._prefix.sort()
+            self._prefix_unsorted = False
+
+    def _remove(self, vid: str):
+        self._docs.pop(vid, None)
+        norm = self._norm.pop(vid, None)
+        if norm is None: return
+        for gram in bigrams(norm[0]) | bigrams(norm[1]):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(vid)
+                if not posting: del self._postings[gram]
+        self._sort_prefix()
+        for text in set(norm):
+            i = bisect.bisect_left(self._prefix, (text, vid))
+            if i < len(self._prefix) and self._prefix[i] == (text, vid):
+                del self._prefix[i]
+
+    # --- 検索 ---
+
+    def suggest(self, query: str, limit: int = 10, min_similarity: float = 0.5) -> List[dict]:
+        # 前方一致 > 部分一致 > bi-gram の一致率 (あいまい一致) の順に並べる
+        qn = self.normalize(query)
+        if not qn: return []
+        scores: Dict[str, float] = {}
+        with self._lock:
+            self._sort_prefix()
+            # 前方一致 (タイトル・アーティスト)
+            i = bisect.bisect_left(self._prefix, (qn, ""))
+            while i < len(self._prefix) and self._prefix[i][0].startswith(qn) and len(scores) < limit * 4:
+                text, vid = self._prefix[i]
+                i += 1
+                if vid not in self._docs: continue
+                scores[vid] = max(scores.get(vid, 0), 3.0 - len(text) / 1000)
+
+            if len(qn) >= 2:
+                grams = bigrams(qn)
+                counts: Dict[str, int] = {}
+                for gram in grams:
+                    for vid in self._postings.get(gram, ()):
+                        counts[vid] = counts.get(vid, 0) + 1
+                for vid, hit in counts.items():
+                    similarity = hit / len(grams)
+                    if similarity < min_similarity or vid not in self._norm: continue
+                    title, artist = self._norm[vid]
+                    score = 2.0 if (qn in title or qn in artist) else similarity
+                    if score > scores.get(vid, 0): scores[vid] = score
+
+            ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+            return [self._docs[vid] for vid, _ in ranked if vid in self._docs]
+
+    # --- スナップショット ---
+
+    def snapshot_if_due(self):
+        if not self.snapshot_path or not self._dirty: return False
+        if time.monotonic() - self._snapshot_at < self.snapshot_interval: return False
+        self.snapshot()
+        return True
+
+    def snapshot(self):
+        if not self.snapshot_path: return
+        # 書き出し中に別スレッドから呼ばれた場合は何もしない (次の機会に書く)
+        if not self._snapshot_lock.acquire(blocking=False): return
+        try:
+            with self._lock:
+                docs = list(self._docs.values())
+                self._dirty = False
+                self._snapshot_at = time.monotonic()
+            with open(f"{self.snapshot_path}.lock", "w") as lock_file:
+                if fcntl: fcntl.flock(lock_file, fcntl.LOCK_EX)
+                own_ids = {doc["video_id"] for doc in docs}
+                merged = [doc for doc in self._read_snapshot() if doc.get("video_id") not in own_ids] + docs
+                tmp_path = f"{self.snapshot_path}.tmp{os.getpid()}"
+                with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                    json.dump(merged[-self.max_docs:], f, ensure_ascii=False, separators=(",", ":"))
+                os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"CatalogIndex: snapshot failed ({e})")
+        finally:
+            self._snapshot_lock.release()
+
+    def _read_snapshot(self) -> List[dict]:
+        try:
+            with gzip.open(self.snapshot_path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            print(f"CatalogIndex: failed to load snapshot ({e})")
+            return []
+
+    def load(self):
+        docs = self._read_snapshot()
+        if not docs: return
+        self.add_many(docs)
+        self._dirty = False
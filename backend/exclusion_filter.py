@@ -0,0 +1,71 @@
+import base64
+import math
+from typing import Iterable
+
+# --- Exclusion Filter ---
+# 利用者が結果から外したい動画 (My Book に保存済み・ブロック済み) をブルームフィルタで受け取る。
+# 形式: "1.<k>.<bits>"  bits はビット列 (m = バイト数 * 8、ビット i はバイト i // 8 の (i % 8) ビット目) の base64url (パディングなし)
+# 位置: h1 = FNV-1a(video_id, 0x811c9dc5)、h2 = FNV-1a(video_id, 0x050c5d1f) | 1 として (h1 + i * h2) mod m (i = 0..k-1)
+# フロントエンド (frontend/index.html の buildExclusionFilter) と同じ計算。
+# 偽陽性 (除外していない動画が落ちる) はあり得るが、除外した動画が残ることはない。
+
+FORMAT_VERSION = "1"
+MAX_HASHES = 16
+SEED_1 = 0x811C9DC5
+SEED_2 = 0x050C5D1F
+
+def fnv1a(text: str, seed: int) -> int:
+    h = seed
+    for ch in text:
+        h ^= ord(ch)
+        h = (h * 0x01000193) & 0xFFFFFFFF
+    return h
+
+class ExclusionFilter:
+    def __init__(self, bits: bytes, hashes: int):
+        self.bits = bits
+        self.hashes = hashes
+        self.size = len(bits) * 8
+
+    @classmethod
+    def parse(cls, value: str, max_bytes: int) -> "ExclusionFilter":
+        # 形式が不正・大きすぎる場合は ValueError
+        version, _, rest = value.partition(".")
+        hashes, _, encoded = rest.partition(".")
+        if version != FORMAT_VERSION or not hashes.isdigit() or not encoded:
+            raise ValueError("unsupported exclusion filter format")
+        if not 1 <= int(hashes) <= MAX_HASHES:
+            raise ValueError("invalid number of hashes")
+        if len(encoded) > math.ceil(max_bytes * 4 / 3):
+            raise ValueError("exclusion filter is too large")
+        try:
+            bits = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+        except ValueError:
+            raise ValueError("invalid base64 in exclusion filter")
+        if not bits: raise ValueError("empty exclusion filter")
+        return cls(bits, int(hashes))
+
+    @classmethod
+    def from_ids(cls, video_ids: Iterable[str], false_positive_rate: float = 0.01, max_bytes: int = 4096) -> "ExclusionFilter":
+        video_ids = list(video_ids)
+        n = max(len(video_ids), 1)
+        size = min(max(math.ceil(-n * math.log(false_positive_rate) / math.log(2) ** 2 / 8), 1), max_bytes) * 8
+        hashes = min(max(round(size / n * math.log(2)), 1), MAX_HASHES)
+        bits = bytearray(size // 8)
+        for video_id in video_ids:
+            for pos in cls._positions(video_id, size, hashes):
+                bits[pos >> 3] |= 1 << (pos & 7)
+        return cls(bytes(bits), hashes)
+
+    @staticmethod
+    def _positions(video_id: str, size: int, hashes: int):
+        h1 = fnv1a(video_id, SEED_1)
+        h2 = fnv1a(video_id, SEED_2) | 1
+        return [(h1 + i * h2) % size for i in range(hashes)]
+
+    def encode(self) -> str:
+        return f"{FORMAT_VERSION}.{self.hashes}.{base64.urlsafe_b64encode(self.bits).decode().rstrip('=')}"
+
+    def __contains__(self, video_id: str) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(video_id, self.size, self.hashes))
@@ -0,0 +1,173 @@
+import json
+import os
+import hashlib
+import threading
+import time
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional
+
+# --- Keyword Matcher (Aho-Corasick) ---
+# NEGATIVE / OFF_VOCAL / ガイドなし / 信頼チャンネル の全キーワードを1つのオートマトンにまとめ、
+# タイトル (小文字化) を1回走査するだけで全フラグを得る。チャンネル名の判定は名前ごとにメモ化する。
+# キーワード数が増えても走査コストはテキスト長にしか比例しない。
+
+TITLE_CATEGORIES = ("negative", "off_vocal", "no_guide")
+CHANNEL_CATEGORY = "trusted_channel"
+
+CHANNEL_CACHE_MAX = 4096
+
+class KeywordFlags(NamedTuple):
+    negative: bool
+    off_vocal: bool
+    no_guide: bool
+    trusted_channel: bool
+    matched_channel: Optional[str]
+
+class KeywordMatcher:
+    def __init__(self, keywords: Dict[str, List[str]]):
+        # keywords: {"negative": [...], "off_vocal": [...], "no_guide": [...], "trusted_channel": [...]}
+        self.keywords = {k: list(v) for k, v in keywords.items()}
+        # キーワード構成のハッシュ (解析結果キャッシュのバージョンに使う)
+        self.fingerprint = hashlib.sha1(json.dumps(self.keywords, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:12]
+        # 各状態の遷移表 (失敗リンクを展開済みの DFA) と、その状態で確定する出力
+        self._delta: List[Dict[str, int]] = [{}]
+        self._outputs: List[tuple] = [()]
+        self._channel_priority = {name: i for i, name in enumerate(self.keywords.get(CHANNEL_CATEGORY, []))}
+        self._channel_cache: Dict[str, Optional[str]] = {}
+
+        for category in TITLE_CATEGORIES + (CHANNEL_CATEGORY,):
+            for word in self.keywords.get(category, []):
+                self._add(word, (category, word))
+        self._build()
+
+    def _add(self, word: str, output: tuple):
+        if not word: return
+        state = 0
+        for ch in word:
+            nxt = self._delta[state].get(ch)
+            if nxt is None:
+                nxt = len(self._delta)
+                self._delta[state][ch] = nxt
+                self._delta.append({})
+                self._outputs.append(())
+            state = nxt
+        self._outputs[state] = self._outputs[state] + (output,)
+
+    def _build(self):
+        fail = [0] * len(self._delta)
+        goto = [dict(d) for d in self._delta]
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[nxt] = target if target != nxt else 0
+                self._outputs[nxt] = self._outputs[nxt] + self._outputs[fail[nxt]]
+        # 失敗リンクを辿らずに済むよう、親の失敗先の遷移を取り込んで DFA にする (BFS 順)
+        order = deque([0])
+        visited = [False] * len(goto)
+        visited[0] = True
+        while order:
+            state = order.popleft()
+            if state:
+                merged = dict(self._delta[fail[state]])
+                merged.update(goto[state])
+                self._delta[state] = merged
+            for nxt in goto[state].values():
+                if not visited[nxt]:
+                    visited[nxt] = True
+                    order.append(nxt)
+        # タイトル側の判定用に、状態ごとのタイトル系カテゴリだけを持つ表も作っておく
+        self._title_outputs = [
+            frozenset(category for category, _ in out if category in TITLE_CATEGORIES)
+            for out in self._outputs
+        ]
+
+    def scan(self, text: str, categories=None):
+        # text 中に現れるキーワードを (category, word) の集合で返す
+        delta, outputs = self._delta, self._outputs
+        state = 0
+        found = set()
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        if categories is not None:
+            found = {hit for hit in found if hit[0] in categories}
+        return found
+
+    def match_channel(self, channel: str) -> Optional[str]:
+        # チャンネル名は種類が限られるので結果をメモ化する。複数一致時はリストの先頭側を優先
+        if channel in self._channel_cache: return self._channel_cache[channel]
+        matched = [word for _, word in self.scan(channel, (CHANNEL_CATEGORY,))]
+        result = min(matched, key=self._channel_priority.__getitem__) if matched else None
+        if len(self._channel_cache) >= CHANNEL_CACHE_MAX: self._channel_cache.clear()
+        self._channel_cache[channel] = result
+        return result
+
+    def classify(self, title: str, channel: str) -> KeywordFlags:
+        # タイトルは小文字化して、チャンネル名はそのまま比較する (従来の判定と同じ)
+        delta, title_outputs = self._delta, self._title_outputs
+        state = 0
+        categories = set()
+        for ch in title.lower():
+            state = delta[state].get(ch, 0)
+            if title_outputs[state]:
+                categories.update(title_outputs[state])
+        matched_channel = self.match_channel(channel)
+        return KeywordFlags(
+            negative="negative" in categories,
+            off_vocal="off_vocal" in categories,
+            no_guide="no_guide" in categories,
+            trusted_channel=matched_channel is not None,
+            matched_channel=matched_channel,
+        )
+
+# --- Config Reload ---
+
+class KeywordRegistry:
+    # 既定のキーワードに JSON 設定ファイルの内容を上書きしたマッチャを保持する。
+    # ファイルの mtime を reload_interval 秒ごとに確認し、変わっていれば再構築する (再デプロイ不要)。
+    # 設定ファイル例: {"negative": ["歌ってみ", ...], "trusted_channel": ["JOYSOUND", ...]}
+
+    def __init__(self, defaults: Dict[str, List[str]], config_path: Optional[str] = None, reload_interval: float = 30):
+        self.defaults = defaults
+        self.config_path = config_path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self.matcher = KeywordMatcher(defaults)
+        self.reload()
+
+    def reload(self):
+        if not self.config_path: return
+        try:
+            mtime = os.path.getmtime(self.config_path)
+        except OSError:
+            return
+        if mtime == self._mtime: return
+        try:
+            with open(self.config_path, encoding="utf-8") as f:
+                overrides = json.load(f)
+            keywords = dict(self.defaults)
+            keywords.update({k: list(v) for k, v in overrides.items() if k in self.defaults})
+            self.matcher = KeywordMatcher(keywords)
+            self._mtime = mtime
+            print(f"KeywordRegistry: loaded {self.config_path}")
+        except (OSError, ValueError, TypeError) as e:
+            print(f"KeywordRegistry: failed to load {self.config_path} ({e})")
+
+    def get(self) -> KeywordMatcher:
+        if self.config_path:
+            now = time.monotonic()
+            if now - self._checked_at >= self.reload_interval:
+                with self._lock:
+                    if now - self._checked_at >= self.reload_interval:
+                        self._checked_at = now
+                        self.reload()
+        return self.matcher
@@ -0,0 +1,151 @@
+import re
+import threading
+from typing import List, Optional
+
+# --- Lyrics Resolver ---
+# LRCLib の検索結果から、曲に最も合う歌詞を選ぶ。
+# スコアリングは frontend/index.html の searchAndScoreLRCLib と同じ:
+#   タイトル一致 (+60 / 部分一致 +40)、アーティスト一致 (+40 / +20)、再生時間の差 (3秒以内 +40 / 10秒以内 +20)、
+#   同期歌詞 +1000、日本語の曲なのに歌詞に日本語がない -1500、タイムスタンプの重複が多い -1500、
+#   instrumental 等のノイズ -200
+
+RE_PAREN = re.compile(r"×?\(.*?\)")
+RE_ZEN_PAREN = re.compile(r"×?（.*?）")
+RE_QUERY_PUNCT = re.compile(r"[,!?.]|・・・|…")
+RE_SPACES = re.compile(r"\s+")
+RE_SCORE_NOISE = re.compile(r"[^a-z0-9\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]")
+RE_JAPANESE = re.compile(r"[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]")
+RE_LRC_TIME = re.compile(r"\[\d{2}:\d{2}(?:\.\d+)?\]")
+
+LYRICS_NOISE_WORDS = ("instrumental", "tv size", "off vocal")
+
+def clean_lyrics_query(text: str):
+    if not text: return ""
+    text = RE_ZEN_PAREN.sub("", RE_PAREN.sub("", text))
+    text = RE_QUERY_PUNCT.sub(" ", text)
+    return RE_SPACES.sub(" ", text).strip()
+
+def normalize_for_score(text: str):
+    if not text: return ""
+    return RE_SCORE_NOISE.sub("", text.lower())
+
+def has_japanese(text: str):
+    return bool(text) and RE_JAPANESE.search(text) is not None
+
+def duration_to_seconds(duration: str):
+    # "m:ss" / "h:mm:ss" -> 秒
+    if not duration: return 0
+    try:
+        seconds = 0
+        for part in str(duration).split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return 0
+
+def analyze_lrc_content(lrc_text: str):
+    # 歌詞テキストの品質 (同期歌詞か、日本語を含むか、タイムスタンプの重複率)
+    if not lrc_text:
+        return {"is_synced": False, "has_japanese": False, "timestamp_ratio": 0, "line_count": 0}
+    time_count = 0
+    content_lines = 0
+    jp_lines = 0
+    timestamps = set()
+    for line in lrc_text.split("\n"):
+        times = RE_LRC_TIME.findall(line)
+        if times:
+            time_count += len(times)
+            timestamps.update(times)
+        content = RE_LRC_TIME.sub("", line).strip()
+        if content:
+            content_lines += 1
+            if has_japanese(content): jp_lines += 1
+    return {
+        "is_synced": time_count > 5,
+        "has_japanese": jp_lines > 0,
+        "timestamp_ratio": len(timestamps) / time_count if time_count else 1.0,
+        "line_count": content_lines,
+    }
+
+def score_candidate(item: dict, title_norm: str, artist_norm: str, duration: int, query_has_jp: bool, title_lower: str):
+    lrc_content = item.get("syncedLyrics") or item.get("plainLyrics")
+    if not lrc_content: return -9999, 999
+
+    score = 0
+    analysis = analyze_lrc_content(lrc_content)
+    item_title_norm = normalize_for_score(item.get("trackName") or "")
+    item_artist_norm = normalize_for_score(item.get("artistName") or "")
+
+    if title_norm and item_title_norm:
+        if title_norm == item_title_norm: score += 60
+        elif title_norm in item_title_norm or item_title_norm in title_norm: score += 40
+    if artist_norm and item_artist_norm:
+        if artist_norm == item_artist_norm: score += 40
+        elif artist_norm in item_artist_norm or item_artist_norm in artist_norm: score += 20
+
+    diff = 999
+    try:
+        lrc_duration = float(item.get("duration") or 0)
+    except (TypeError, ValueError):
+        lrc_duration = 0
+    if duration > 0 and lrc_duration > 0:
+        diff = abs(duration - lrc_duration)
+        if diff <= 3: score += 40
+        elif diff <= 10: score += 20
+
+    if item.get("syncedLyrics") and analysis["is_synced"]: score += 1000
+    if query_has_jp and not analysis["has_japanese"]: score -= 1500
+    if item.get("syncedLyrics") and analysis["timestamp_ratio"] < 0.75: score -= 1500
+
+    track_lower = (item.get("trackName") or "").lower()
+    if any(w in track_lower and w not in title_lower for w in LYRICS_NOISE_WORDS): score -= 200
+    return score, diff
+
+def score_candidates(items: List[dict], title: str, artist: str, duration: str) -> List[dict]:
+    # 各候補に score / diff を付けて降順に並べる
+    title_norm = normalize_for_score(title)
+    artist_norm = normalize_for_score(artist)
+    seconds = duration_to_seconds(duration)
+    query_has_jp = has_japanese(title) or has_japanese(artist)
+    title_lower = (title or "").lower()
+    scored = []
+    for item in items:
+        if not isinstance(item, dict): continue
+        score, diff = score_candidate(item, title_norm, artist_norm, seconds, query_has_jp, title_lower)
+        scored.append({**item, "score": score, "diff": diff})
+    scored.sort(key=lambda x: x["score"], reverse=True)
+    return scored
+
+class LyricsClient:
+    # LRCLib 互換の /search を叩く。base_url を差し替えればローカルのスタブサーバーでも動く
+    def __init__(self, base_url: str, timeout: float = 5.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._session = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        # requests の import はコールドスタートに効くので、最初の問い合わせまで遅らせる
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    session = requests.Session()
+                    session.headers["User-Agent"] = "Projeck-K (lyrics resolver)"
+                    self._session = session
+        return self._session
+
+    def search(self, title: str, artist: str) -> List[dict]:
+        cleaned_title = clean_lyrics_query(title)
+        cleaned_artist = clean_lyrics_query(artist)
+        term = f"{cleaned_title or title} {cleaned_artist or artist}".strip()
+        response = self.session().get(f"{self.base_url}/search", params={"q": term}, timeout=self.timeout)
+        response.raise_for_status()
+        items = response.json()
+        return items if isinstance(items, list) else []
+
+    def resolve(self, title: str, artist: str, duration: str) -> Optional[dict]:
+        # 最もスコアの高い候補 (score >= 0) を返す。見つからなければ None
+        candidates = score_candidates(self.search(title, artist), title, artist, duration)
+        if not candidates or candidates[0]["score"] < 0: return None
+        return candidates[0]
@@ -1,12 +1,40 @@
+import io
 import os
 import re
+import json
+import time
+import random
+import heapq
+import base64
+import asyncio
+import hashlib
+import threading
 import unicodedata
-from fastapi import FastAPI, Query
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware, DEFAULT_EXCLUDED_CONTENT_TYPES
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import List, Optional
 from mangum import Mangum
-from ytmusicapi import YTMusic
+
+try:
+    import orjson
+except ImportError: # 任意の依存。なければ標準の json で同じ出力を作る
+    orjson = None
+from search_cache import SearchCache
+from metadata_parser import parse_metadata, RULES_FINGERPRINT as PARSER_RULES_FINGERPRINT
+from metadata_store import MetadataStore
+from keyword_matcher import KeywordFlags, KeywordRegistry
+from single_flight import SingleFlight, SingleFlightOverflow
+from catalog_index import CatalogIndex
+from lyrics_resolver import LyricsClient
+from exclusion_filter import ExclusionFilter
+from batch_classifier import BatchClassifier
+from upstream_session import LatencyTracker, build_session, hedged_call
+from upstream_governor import PRIORITY_BACKGROUND, SharedPriority, UpstreamGovernor, UpstreamThrottled, priority_value, upstream_priority
+from metrics import MetricsRegistry, current_timer, start_request_timer
 
 app = FastAPI()
 
@@ -17,6 +45,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 一定以上の大きさのレスポンスは gzip で返す (NDJSON は届いた順に表示したいので圧縮しない)
+GZIP_MIN_BYTES = int(os.environ.get("GZIP_MIN_BYTES", "1024"))
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=GZIP_MIN_BYTES,
+    compresslevel=5,
+    exclude_content_types=(*DEFAULT_EXCLUDED_CONTENT_TYPES, "application/x-ndjson"),
+)
+
 # --- Configuration ---
 
 # 「ボーカルなし（カラオケ）」とみなすチャンネル (White List)
@@ -52,290 +89,1330 @@ NEGATIVE_KEYWORDS = [
     "reaction", "リアクション", "切り抜き"
 ]
 
-ytmusic = YTMusic(language='ja', location='JP')
+# 「ガイドメロディなし」とみなすキーワード
+NO_GUIDE_KEYWORDS = ["ガイドなし", "ガイド無し", "no guide", "ガイドメロディなし", "ガイドメロディ無し"]
+
+# 上記キーワードを上書きする JSON 設定ファイル (任意)。変更は KEYWORDS_RELOAD_SEC ごとに反映される
+KEYWORDS_CONFIG = os.environ.get("KEYWORDS_CONFIG")
+KEYWORDS_RELOAD_SEC = float(os.environ.get("KEYWORDS_RELOAD_SEC", "30"))
+
+# リクエストをこの割合でサンプリングして cProfile の結果をログに出す (0 で無効)
+PROFILE_SAMPLE_RATE = float(os.environ.get("SEARCH_PROFILE_SAMPLE_RATE", "0"))
+
+# Lambda 上で動いているか (ストリーミング不可のためバッファして返す)
+IS_LAMBDA = bool(os.environ.get("AWS_LAMBDA_FUNCTION_NAME"))
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# 上流 (YouTube Music) 呼び出しの並列度とタイムアウト
+UPSTREAM_MAX_WORKERS = int(os.environ.get("UPSTREAM_MAX_WORKERS", "8"))
+UPSTREAM_TIMEOUT_SEC = float(os.environ.get("UPSTREAM_TIMEOUT_SEC", "8"))
+# HTTP レベルのタイムアウト (1リクエストごと)。UPSTREAM_TIMEOUT_SEC は呼び出し全体の待ち時間
+UPSTREAM_CONNECT_TIMEOUT_SEC = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT_SEC", "3"))
+UPSTREAM_READ_TIMEOUT_SEC = float(os.environ.get("UPSTREAM_READ_TIMEOUT_SEC", "6"))
+# ヘッジ: 観測した p95 (下限 UPSTREAM_HEDGE_MIN_SEC) を過ぎても返らない呼び出しをもう1本出す。同時に出すのは UPSTREAM_HEDGE_MAX_INFLIGHT 本まで
+UPSTREAM_HEDGE = os.environ.get("UPSTREAM_HEDGE", "0") == "1"
+UPSTREAM_HEDGE_MIN_SEC = float(os.environ.get("UPSTREAM_HEDGE_MIN_SEC", "0.5"))
+UPSTREAM_HEDGE_MAX_INFLIGHT = int(os.environ.get("UPSTREAM_HEDGE_MAX_INFLIGHT", "2"))
+# 上流の呼び出し予算 (トークンバケット): 1秒あたり UPSTREAM_RATE_PER_SEC 回、最大 UPSTREAM_BURST 回まで連続可 (0 で無制限)
+# 予算を超えた呼び出しは優先度順に最大 UPSTREAM_QUEUE_WAIT_SEC 秒待ち、それでも駄目ならキャッシュの古い結果で返す
+# 既定は無制限。上流の制限は公開されていないので、実測した値 (429 が出始める回数) をもとに設定する
+UPSTREAM_RATE_PER_SEC = float(os.environ.get("UPSTREAM_RATE_PER_SEC", "0"))
+UPSTREAM_BURST = int(os.environ.get("UPSTREAM_BURST", "20"))
+# 同じ上流の枠を分け合うサーバープロセス数 (run_local.py --workers が設定する)。各プロセスは 1/N ずつ使う
+SERVER_WORKERS = max(int(os.environ.get("SERVER_WORKERS", "1")), 1)
+UPSTREAM_QUEUE_MAX = int(os.environ.get("UPSTREAM_QUEUE_MAX", "100"))
+UPSTREAM_QUEUE_WAIT_SEC = float(os.environ.get("UPSTREAM_QUEUE_WAIT_SEC", "2"))
+# ファンアウト検索: 1ページ目は通常のクエリに加え、信頼チャンネル名を付けたクエリ (videos) も同時に出して結果を混ぜる。
+# 追加分は SEARCH_FANOUT_DEADLINE_SEC までに返ったものだけ使い、残りは打ち切る (通常のクエリは従来どおり待つ)
+SEARCH_FANOUT = os.environ.get("SEARCH_FANOUT", "0") == "1"
+SEARCH_FANOUT_CHANNELS = [c.strip() for c in os.environ.get("SEARCH_FANOUT_CHANNELS", "歌っちゃ王,JOYSOUND,DAM").split(",") if c.strip()]
+SEARCH_FANOUT_LIMIT = int(os.environ.get("SEARCH_FANOUT_LIMIT", "10"))
+SEARCH_FANOUT_DEADLINE_SEC = float(os.environ.get("SEARCH_FANOUT_DEADLINE_SEC", "2.5"))
+
+# 起動モード: "lazy" は初回の検索で YTMusic を生成する (空クエリ等は上流の準備を待たない)。
+# "eager" は import 時に生成とウォームアップまで済ませる (Lambda の INIT フェーズで払う)
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "lazy")
+
+# 最初に必要になった時点で生成し、ウォームスタート間で使い回す (テストでは差し替え可)
+ytmusic = None
+ytmusic_lock = threading.Lock()
+
+# 検索結果キャッシュ (キーは normalize_for_comparison(q))
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "512"))
+SEARCH_CACHE_TTL_SEC = float(os.environ.get("SEARCH_CACHE_TTL_SEC", "300"))
+SEARCH_CACHE_STALE_SEC = float(os.environ.get("SEARCH_CACHE_STALE_SEC", "3600"))
+SEARCH_CACHE_DB = os.environ.get("SEARCH_CACHE_DB") # 例: /tmp/search_cache.sqlite3 (未設定ならメモリのみ)
+
+# 解析済みメタデータの保存先 (例: /tmp/metadata.sqlite3。未設定ならプロセス内のみ)
+METADATA_STORE_DB = os.environ.get("METADATA_STORE_DB")
+METADATA_STORE_MAX_ENTRIES = int(os.environ.get("METADATA_STORE_MAX_ENTRIES", "20000"))
+# 保存するレコードの形式を変えたら上げる
+METADATA_RECORD_VERSION = 1
+
+# ページング: 1ページ目は小さい limit で上流を叩き、LOAD MORE で段階的に広げる (songs, videos)
+UPSTREAM_STAGES = [(10, 20), (20, 40)]
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", "20"))
+SEARCH_CURSOR_TTL_SEC = float(os.environ.get("SEARCH_CURSOR_TTL_SEC", "900"))
+# 複数プロセスで動かす場合は共有する (別プロセスが発行した page_token も引ける)。未設定ならメモリのみ
+SEARCH_CURSOR_DB = os.environ.get("SEARCH_CURSOR_DB")
+# 除外フィルタ (exclude パラメータ、保存済み・ブロック済みの動画) の上限バイト数
+EXCLUDE_FILTER_MAX_BYTES = int(os.environ.get("EXCLUDE_FILTER_MAX_BYTES", "4096"))
+
+# サジェスト用のカタログ (これまでにランキングした曲)。スナップショットは /tmp 等に置く (未設定ならメモリのみ)
+CATALOG_SNAPSHOT = os.environ.get("CATALOG_SNAPSHOT")
+CATALOG_MAX_DOCS = int(os.environ.get("CATALOG_MAX_DOCS", "50000"))
+CATALOG_SNAPSHOT_SEC = float(os.environ.get("CATALOG_SNAPSHOT_SEC", "60"))
+SUGGEST_MAX_LIMIT = 20
+
+# 歌詞 (LRCLib 互換 API)。ローカルのスタブサーバーで試す場合は LYRICS_API_URL を差し替える
+LYRICS_API_URL = os.environ.get("LYRICS_API_URL", "https://lrclib.net/api")
+LYRICS_TIMEOUT_SEC = float(os.environ.get("LYRICS_TIMEOUT_SEC", "5"))
+LYRICS_CACHE_MAX_ENTRIES = int(os.environ.get("LYRICS_CACHE_MAX_ENTRIES", "1024"))
+LYRICS_CACHE_TTL_SEC = float(os.environ.get("LYRICS_CACHE_TTL_SEC", "86400"))
+LYRICS_CACHE_DB = os.environ.get("LYRICS_CACHE_DB")
+LYRICS_MAX_WORKERS = int(os.environ.get("LYRICS_MAX_WORKERS", "4"))
+LYRICS_BATCH_MAX_ITEMS = 50
+
+# プレイリスト取り込み: 取得する曲数の上限と、1ページ (解析単位) の件数
+PLAYLIST_MAX_TRACKS = int(os.environ.get("PLAYLIST_MAX_TRACKS", "1000"))
+PLAYLIST_PAGE_SIZE = int(os.environ.get("PLAYLIST_PAGE_SIZE", "100"))
+PLAYLIST_TIMEOUT_SEC = float(os.environ.get("PLAYLIST_TIMEOUT_SEC", "20"))
+PLAYLIST_CACHE_MAX_ENTRIES = int(os.environ.get("PLAYLIST_CACHE_MAX_ENTRIES", "64"))
+PLAYLIST_CACHE_DB = os.environ.get("PLAYLIST_CACHE_DB")
+
+# 一括分類 (/api/classify)
+CLASSIFY_MAX_ITEMS = int(os.environ.get("CLASSIFY_MAX_ITEMS", "10000"))
+CLASSIFY_CHUNK_SIZE = int(os.environ.get("CLASSIFY_CHUNK_SIZE", "500"))
+# 分類用プロセスプールのワーカー数 (0 ならプロセスを作らない。Lambda は multiprocessing のプールが使えない)
+CLASSIFY_WORKERS = int(os.environ.get("CLASSIFY_WORKERS", "0" if IS_LAMBDA else str(min(max((os.cpu_count() or 1) // SERVER_WORKERS, 1), 4))))
+RE_PLAYLIST_ID = re.compile(r"^[A-Za-z0-9_-]{2,128}$")
+
+# /api/search の HTTP キャッシュ (CloudFront / ブラウザ)。部分的な結果やエラーはキャッシュさせない
+SEARCH_HTTP_MAX_AGE_SEC = int(os.environ.get("SEARCH_HTTP_MAX_AGE_SEC", "60"))
+SEARCH_HTTP_SWR_SEC = int(os.environ.get("SEARCH_HTTP_SWR_SEC", "300"))
+NO_STORE_HEADERS = {"Cache-Control": "no-store"}
+
+# キャッシュの事前取得 (prewarm)。シードファイル (1行1クエリ) と、このプロセスでよく検索されたクエリを対象にする
+PREWARM_SEED_FILE = os.environ.get("PREWARM_SEED_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prewarm_queries.txt"))
+PREWARM_TOP_N = int(os.environ.get("PREWARM_TOP_N", "50"))
+PREWARM_CONCURRENCY = int(os.environ.get("PREWARM_CONCURRENCY", "2"))
+PREWARM_RATE_PER_SEC = float(os.environ.get("PREWARM_RATE_PER_SEC", "2"))
+PREWARM_BUDGET_SEC = float(os.environ.get("PREWARM_BUDGET_SEC", "20"))
+POPULAR_QUERIES_MAX = 2000
+
+metrics = MetricsRegistry()
+metrics.describe("search_stage_seconds", "histogram", "Time spent per pipeline stage, labelled by API route")
+metrics.describe("http_request_duration_seconds", "histogram", "API request latency")
+metrics.describe("upstream_call_seconds", "histogram", "YouTube Music call latency")
+metrics.describe("upstream_errors_total", "counter", "Failed YouTube Music calls")
+metrics.describe("upstream_latency_seconds", "gauge", "Recent YouTube Music call latency percentiles")
+metrics.describe("upstream_governor_total", "counter", "Upstream call slots by outcome (granted, queued, rejected, timed_out)")
+metrics.describe("upstream_governor_waiting", "gauge", "Upstream calls waiting for a slot")
+metrics.describe("search_degraded_total", "counter", "Searches answered from expired cache because upstream was throttled or failing")
+metrics.describe("prewarm_queries_total", "counter", "Pre-warmed queries by outcome")
+metrics.describe("upstream_hedges_total", "counter", "Hedged YouTube Music calls by which request answered first")
+metrics.describe("search_fanout_total", "counter", "Channel-targeted fan-out queries by outcome (ok, late, error)")
+metrics.describe("search_cache_lookups_total", "counter", "Search cache lookups by result")
+metrics.describe("search_cache_entries", "gauge", "Entries in the in-process search cache")
+metrics.describe("metadata_store_lookups_total", "counter", "Parsed metadata lookups by result")
+metrics.describe("search_single_flight_total", "counter", "Searches that led, joined or were rejected by single-flight")
+metrics.describe("search_single_flight_waiting", "gauge", "Searches currently waiting on an identical in-flight search")
+metrics.describe("lyrics_cache_lookups_total", "counter", "Lyrics cache lookups by result")
+metrics.describe("catalog_index_entries", "gauge", "Songs in the typeahead catalog index")
+metrics.describe("classify_items_total", "counter", "Records classified through the batch classification API")
+profiling_active = False
+
+# ytmusicapi は同期APIなので、イベントループを塞がないよう専用スレッドプールで実行する
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_MAX_WORKERS, thread_name_prefix="ytmusic")
+upstream_latency = LatencyTracker()
+upstream_governor = UpstreamGovernor(UPSTREAM_RATE_PER_SEC / SERVER_WORKERS, max(UPSTREAM_BURST // SERVER_WORKERS, 1),
+                                     UPSTREAM_QUEUE_MAX, UPSTREAM_QUEUE_WAIT_SEC)
+hedges_in_flight = 0
+
+keyword_registry = KeywordRegistry(
+    {
+        "negative": NEGATIVE_KEYWORDS,
+        "off_vocal": OFF_VOCAL_KEYWORDS,
+        "no_guide": NO_GUIDE_KEYWORDS,
+        "trusted_channel": TRUSTED_KARAOKE_CHANNELS,
+    },
+    config_path=KEYWORDS_CONFIG,
+    reload_interval=KEYWORDS_RELOAD_SEC,
+)
+
+search_cache = SearchCache(
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    ttl=SEARCH_CACHE_TTL_SEC,
+    stale_ttl=SEARCH_CACHE_STALE_SEC,
+    db_path=SEARCH_CACHE_DB,
+)
+metadata_store = MetadataStore(METADATA_STORE_DB, max_entries=METADATA_STORE_MAX_ENTRIES)
+
+# ページングカーソル (ランキング済みリスト全体 + 上流の取得段階) をトークンIDで保持する
+cursor_store = SearchCache(max_entries=1000, ttl=SEARCH_CURSOR_TTL_SEC, stale_ttl=0, db_path=SEARCH_CURSOR_DB)
+# 同一クエリの同時検索を1回の上流呼び出しにまとめる
+SEARCH_MAX_WAITERS = int(os.environ.get("SEARCH_MAX_WAITERS", "64"))
+search_flight = SingleFlight(max_waiters=SEARCH_MAX_WAITERS)
+refreshing_keys = set()
+# 実行中の検索 (single-flight) ごとの上流の優先度
+flight_priorities = {}
+background_tasks = set()
+# 1ページ目の検索回数 (正規化キー -> [回数, 元のクエリ])。prewarm の対象選びに使う
+popular_queries = {}
+# 取り込んだプレイリストの曲一覧を playlist_id ごとに保持する (検索のキーとは混ぜない)
+playlist_cache = SearchCache(max_entries=PLAYLIST_CACHE_MAX_ENTRIES, ttl=SEARCH_CACHE_TTL_SEC, stale_ttl=SEARCH_CACHE_STALE_SEC, db_path=PLAYLIST_CACHE_DB)
+playlist_flight = SingleFlight(max_waiters=SEARCH_MAX_WAITERS)
+
+# 選んだ歌詞を video_id ごとに保持する (見つからなかった結果も含む。上流のエラーは保持しない)
+lyrics_client = LyricsClient(LYRICS_API_URL, timeout=LYRICS_TIMEOUT_SEC)
+lyrics_cache = SearchCache(max_entries=LYRICS_CACHE_MAX_ENTRIES, ttl=LYRICS_CACHE_TTL_SEC, stale_ttl=0, db_path=LYRICS_CACHE_DB)
+lyrics_executor = ThreadPoolExecutor(max_workers=LYRICS_MAX_WORKERS, thread_name_prefix="lyrics")
+lyrics_flight = SingleFlight(max_waiters=SEARCH_MAX_WAITERS)
+
+# 一括分類用 (ワーカープロセスは最初の大きなバッチで作る)
+batch_classifier = BatchClassifier(CLASSIFY_WORKERS, chunk_size=CLASSIFY_CHUNK_SIZE)
 
 # --- Models ---
 
-class SongItem(BaseModel):
+def song_item(video_id: str, title: str, artist: str, original_title: str, duration: str, channel: str,
+              result_type: str, is_no_guide: bool = False, has_vocal: bool = True, key: Optional[str] = None):
+    # 検索結果1件 (SongItem) の dict。result_type は 'song' または 'video'
+    # 値は解析結果そのままなので pydantic での検証は省く (1件ごとの生成・model_dump が検索1回あたり数十件分かかるため)
+    return {
+        "video_id": video_id,
+        "title": title,
+        "artist": artist,
+        "original_title": original_title,
+        "duration": duration,
+        "channel": channel,
+        "result_type": result_type,
+        "is_no_guide": is_no_guide,
+        "has_vocal": has_vocal,
+        "key": key,
+        "type": result_type, # アイコン表示用に 'song' または 'video' をそのまま代入 (v2.2)
+    }
+
+class LyricsRequest(BaseModel):
     video_id: str
     title: str
-    artist: str
-    original_title: str
-    duration: str
-    channel: str
-    result_type: str # 'song' or 'video'
-    is_no_guide: bool = False
-    has_vocal: bool = True
-    key: Optional[str] = None
-    type: str # フロントエンドのアイコン判定用に追加 (v2.2)
+    artist: str = ""
+    duration: str = ""
+
+class LyricsBatchRequest(BaseModel):
+    items: List[LyricsRequest]
+
+class ClassifyItem(BaseModel):
+    title: str
+    artist: str = ""
+    channel: str = "" # 空なら検索と同じく artist (それも空なら "YouTube Music")
+    result_type: str = "video" # 'song' or 'video'
+    video_id: str = ""
+    duration: str = ""
+
+class ClassifyRequest(BaseModel):
+    items: List[ClassifyItem]
 
 # --- Utilities ---
 
-def clean_text(text: str):
-    if not text: return ""
-    return text.replace("　", " ").strip()
+RE_COMPARISON_NOISE = re.compile(r'[!！?？、。.,・･~～\-−_＿\s「」『』()（）【】\[\]/／]')
 
 def normalize_for_comparison(text: str):
     if not text: return ""
     normalized = unicodedata.normalize('NFKC', text).lower()
-    cleaned = re.sub(r'[!！?？、。.,・･~～\-−_＿\s「」『』()（）【】\[\]/／]', '', normalized)
+    cleaned = RE_COMPARISON_NOISE.sub('', normalized)
     return cleaned
 
-def determine_attributes(title: str, channel: str):
-    title_lower = title.lower()
-    is_no_guide = any(k in title_lower for k in ["ガイドなし", "ガイド無し", "no guide", "ガイドメロディなし", "ガイドメロディ無し"])
-    
-    has_vocal = True
-    if any(c in channel for c in TRUSTED_KARAOKE_CHANNELS):
-        has_vocal = False
-    elif any(k in title_lower for k in OFF_VOCAL_KEYWORDS):
-        has_vocal = False
+def metadata_rules_version():
+    # 保存済み解析結果のバージョン: 解析ルール (metadata_parser) + キーワード構成 + レコード形式
+    return f"{METADATA_RECORD_VERSION}-{PARSER_RULES_FINGERPRINT}-{keyword_registry.get().fingerprint}"
+
+def classify_item(title: str, channel: str) -> KeywordFlags:
+    return keyword_registry.get().classify(title, channel)
 
+def attributes_from_flags(flags: KeywordFlags):
+    is_no_guide = flags.no_guide
+    has_vocal = not (flags.trusted_channel or flags.off_vocal)
     return is_no_guide, has_vocal
 
-def parse_metadata(original_title: str, artist_from_api: str, channel_name: str, result_type: str):
-    title = original_title
-    artist = artist_from_api
-    key = None
-    
-    clean_t = original_title.replace("（カラオケ）", "").replace("(Karaoke)", "").replace("(Official)", "")
-    clean_t = re.sub(r"[\[\(]ガイド.*?(?:無し|なし)カラオケ[\]\)]", "", clean_t)
-
-    # --- NicoKara Logic ---
-    if "ニコカラ" in original_title or "ニコカラ" in channel_name:
-        def nico_clean(t):
-            if not t: return ""
-            t = re.sub(r"【(?:ニコカラ|カラオケ).*?】", "", t)
-            t = re.sub(r"(?i)[【\[\(]?(?:off\s*vocal|オフボーカル|karaoke|カラオケ|instrumental|インスト|guide|ガイド).*?[】\]\)]?", "", t)
-            t = t.replace("ニコカラ", "")
-            return t.strip()
-
-        match_brackets = re.search(r"(.*?)\s*《(.*?)》", original_title)
-        is_bracket_valid = False
-        if match_brackets:
-            inner_text = match_brackets.group(2)
-            noise_check = ["off vocal", "offvocal", "key", "キー", "guide", "ガイド", "karaoke", "カラオケ"]
-            if not any(n in inner_text.lower() for n in noise_check):
-                is_bracket_valid = True
-        
-        if is_bracket_valid:
-            title = match_brackets.group(1)
-            artist = match_brackets.group(2)
-        elif re.search(r"[/／]", original_title):
-            parts = re.split(r"[/／]", original_title, 1)
-            title = parts[0]
-            artist = parts[1]
+def determine_attributes(title: str, channel: str):
+    return attributes_from_flags(classify_item(title, channel))
+
+RELEVANCE_PER_PART = 20000
+
+def relevance_parts(query: str):
+    # クエリを空白で区切って正規化した語 (空になる語は数えない)
+    if not query: return []
+    return [part_norm for part_norm in map(normalize_for_comparison, query.split()) if part_norm]
+
+def relevance_from_parts(parts: list, title: str, artist: str, original_title: str):
+    if not parts: return 0
+    target_norm = normalize_for_comparison(f"{title} {artist} {original_title}")
+    return sum(RELEVANCE_PER_PART for part_norm in parts if part_norm in target_norm)
+
+def calculate_relevance_score(query: str, title: str, artist: str, original_title: str):
+    return relevance_from_parts(relevance_parts(query), title, artist, original_title)
+
+# --- Upstream ---
+
+def get_ytmusic():
+    global ytmusic
+    if ytmusic is None:
+        with ytmusic_lock:
+            if ytmusic is None:
+                from ytmusicapi import YTMusic
+                # ワーカースレッドごとに keep-alive の接続を使い回せるよう、プールをスレッド数に合わせる
+                session = build_session(UPSTREAM_MAX_WORKERS, UPSTREAM_CONNECT_TIMEOUT_SEC, UPSTREAM_READ_TIMEOUT_SEC)
+                ytmusic = YTMusic(language='ja', location='JP', requests_session=session)
+    return ytmusic
+
+def hedge_delay(name: str):
+    # ヘッジを出すまでの待ち時間。無効・サンプル不足・同時ヘッジ数の上限なら None
+    if not UPSTREAM_HEDGE or hedges_in_flight >= UPSTREAM_HEDGE_MAX_INFLIGHT: return None
+    p95 = upstream_latency.percentile(name, 0.95)
+    if p95 is None: return None
+    return max(p95, UPSTREAM_HEDGE_MIN_SEC)
+
+async def call_upstream(name: str, fn, timeout: float = UPSTREAM_TIMEOUT_SEC, hedge: bool = True):
+    # タイムアウトしてもスレッド自体は止まらないが、レスポンスは待たずに返す
+    global hedges_in_flight
+    timer = current_timer()
+    try:
+        with timer.stage("upstream_wait"):
+            await upstream_governor.acquire()
+    except UpstreamThrottled:
+        metrics.inc("upstream_errors_total", filter=name, kind="throttled")
+        raise
+    start = time.perf_counter()
+    hedge_after = hedge_delay(name) if hedge else None
+    hedge_sent = False
+
+    def can_hedge():
+        # ヘッジも上流の呼び出し1回なので、その場で予算が取れるときだけ出す。同時ヘッジ数は実際に出した分だけ数える
+        global hedges_in_flight
+        nonlocal hedge_sent
+        if hedges_in_flight >= UPSTREAM_HEDGE_MAX_INFLIGHT or not upstream_governor.try_acquire(): return False
+        hedges_in_flight += 1
+        hedge_sent = True
+        return True
+
+    try:
+        result, hedged = await asyncio.wait_for(
+            hedged_call(upstream_executor, fn, hedge_after, can_hedge=can_hedge), timeout=timeout
+        )
+        upstream_latency.observe(name, time.perf_counter() - start)
+        if hedged is not None:
+            metrics.inc("upstream_hedges_total", filter=name, winner="hedge" if hedged == "won" else "original")
+        return result
+    except asyncio.TimeoutError:
+        metrics.inc("upstream_errors_total", filter=name, kind="timeout")
+        raise
+    except Exception:
+        metrics.inc("upstream_errors_total", filter=name, kind="error")
+        raise
+    finally:
+        if hedge_sent: hedges_in_flight -= 1
+        elapsed = time.perf_counter() - start
+        timer.add(f"upstream_{name}", elapsed)
+        metrics.observe("upstream_call_seconds", elapsed, filter=name)
+
+async def fetch_upstream(search_query: str, filter: str, limit: int):
+    # 初回は ytmusicapi の import と生成もワーカースレッド側で行う
+    def call():
+        return get_ytmusic().search(search_query, filter=filter, limit=limit)
+    return await call_upstream(filter, call)
+
+async def fetch_songs_and_videos(search_query: str, song_limit: int = 20, video_limit: int = 40):
+    # songs / videos を並列に取得し、片方が失敗しても残りを返す (partial=True)
+    song_res, video_res = await asyncio.gather(
+        fetch_upstream(search_query, "songs", song_limit),
+        fetch_upstream(search_query, "videos", video_limit),
+        return_exceptions=True,
+    )
+    partial_result = False
+    if isinstance(song_res, BaseException):
+        print(f"Search Error (songs): {song_res!r}")
+        song_res, partial_result = [], True
+    if isinstance(video_res, BaseException):
+        print(f"Search Error (videos): {video_res!r}")
+        video_res, partial_result = [], True
+    return song_res, video_res, partial_result
+
+async def fetch_fanout_variants(q: str):
+    # 信頼チャンネル向けのクエリを並列に出し、期限までに返った videos をまとめて返す (失敗・期限切れは捨てる)
+    upstream_priority.set(PRIORITY_BACKGROUND)
+
+    def variant_call(variant_query: str):
+        return lambda: get_ytmusic().search(variant_query, filter="videos", limit=SEARCH_FANOUT_LIMIT)
+
+    tasks = [
+        asyncio.ensure_future(call_upstream("fanout", variant_call(f"{q} {channel}"), timeout=SEARCH_FANOUT_DEADLINE_SEC, hedge=False))
+        for channel in SEARCH_FANOUT_CHANNELS
+    ]
+    if not tasks: return []
+    done, pending = await asyncio.wait(tasks, timeout=SEARCH_FANOUT_DEADLINE_SEC)
+    for task in pending: task.cancel()
+    items = []
+    for task in tasks:
+        if task in pending:
+            metrics.inc("search_fanout_total", outcome="late")
+        elif task.exception() is not None:
+            metrics.inc("search_fanout_total", outcome="error")
         else:
-            title = original_title
-            artist = ""
-
-        title = nico_clean(title)
-        artist = nico_clean(artist)
-
-    # --- Videoの場合 ---
-    elif result_type == "video":
-        artist = ""
-        if channel_name == "JOYSOUND CHANNEL":
-            if "【合唱練習用】" in original_title:
-                match_chorus = re.search(r"「(.*?)」", original_title)
-                title = match_chorus.group(1) if match_chorus else original_title.replace("【合唱練習用】", "").strip()
-                artist = "合唱練習用"
-            else:
-                temp = original_title.replace("【karaoke】", "").replace("【JOYSOUND】", "").strip()
-                if "/" in temp:
-                    parts = temp.split("/", 1)
-                    def extract_jp(text):
-                        if text.endswith(")") and "(" in text:
-                            last_open = text.rfind("(")
-                            if last_open != -1: return text[last_open+1:-1]
-                        return text
-                    title = extract_jp(parts[0].strip())
-                    artist = extract_jp(parts[1].strip())
-                else:
-                    title = temp
-
-        elif "歌っちゃ王" in channel_name:
-            temp_title = re.sub(r"【.*?】", "", original_title).strip()
-            temp_title = temp_title.replace("（カラオケ）", "").replace("(Karaoke)", "").replace("(Official)", "")
-            temp_title = re.sub(r"[\[\(]ガイド.*?(?:無し|なし)カラオケ[\]\)]", "", temp_title)
-            
-            re_prefix = r"(?i)(?:Key|キー)\s*[:：]?\s*([+＋\-−–—ー－]?\d+)"
-            re_suffix = r"(?i)([+＋\-−–—ー－]?\d+)\s*(?:Key|キー)"
-            match_p = re.search(re_prefix, temp_title)
-            match_s = re.search(re_suffix, temp_title)
-            raw_key = None
-            if match_p:
-                raw_key = match_p.group(1); temp_title = re.sub(re_prefix, "", temp_title)
-            elif match_s:
-                raw_key = match_s.group(1); temp_title = re.sub(re_suffix, "", temp_title)
-            if raw_key:
-                key_val = raw_key.replace("＋", "+").translate(str.maketrans("−–—ー－", "-----"))
-                key = f"{key_val}KEY"
-
-            match_artist = re.search(r"[\[\(\【［（](?:原曲歌手|オリジナルアーティスト|オリジナル歌手)[:：](.*?)[\]\)\】］）]", temp_title)
-            if match_artist:
-                artist = match_artist.group(1).strip()
-                temp_title = re.sub(r"[\[\(\【［（](?:原曲歌手|オリジナルアーティスト|オリジナル歌手)[:：].*?[\]\)\】］）]", "", temp_title)
-                title = temp_title.strip()
-            else:
-                if " / " in temp_title:
-                    parts = temp_title.split(" / ", 1); title = parts[0].strip(); artist = parts[1].replace("[カラオケ]", "").strip()
-                elif "/" in temp_title:
-                    parts = temp_title.split("/", 1); title = parts[0].strip(); artist = parts[1].replace("[カラオケ]", "").strip()
-                else:
-                    title = temp_title.strip()
-        
-        elif "EdKara" in channel_name:
-            temp_title = re.sub(r"^(?:練習用)?(?:Karaoke|カラオケ)[♬♪]*\s*", "", original_title, flags=re.IGNORECASE).strip()
-            match_performed = re.search(r"[\(\[\【](?:Originally Performed by|Original Artist)[:\s]+(.*?)[\]\)\】]", temp_title, re.IGNORECASE)
-            if match_performed:
-                artist = match_performed.group(1).strip()
-                title_part = temp_title.split(match_performed.group(0))[0]
-                title = re.sub(r"[\[\(\【].*?[\]\)\】]", "", title_part).strip()
-            elif " - " in temp_title:
-                parts = temp_title.split(" - ", 1); title = parts[0].strip(); artist_candidate = parts[1].strip()
-                cutoff_pattern = r"(?:【|\[|\(|Instrumental|Off Vocal)"
-                split_match = re.search(cutoff_pattern, artist_candidate, re.IGNORECASE)
-                if split_match: artist_candidate = artist_candidate[:split_match.start()]
-                artist = re.sub(r"(?i)Karaoke[♬♪]*", "", artist_candidate).strip()
-            elif "/" in temp_title:
-                parts = temp_title.split("/", 1); title = parts[0].strip(); artist = parts[1].strip()
-            else:
-                title = re.sub(r"【.*?】", "", temp_title).strip()
+            metrics.inc("search_fanout_total", outcome="ok")
+            items.extend(task.result())
+    return items
+
+async def fetch_with_fanout(q: str, search_query: str, song_limit: int, video_limit: int):
+    # 戻り値は fetch_songs_and_videos と同じ。チャンネル向けの結果は videos の後ろに付ける (重複は rank_items で落ちる)
+    # 追加分は上流の枠を後回しにし (PRIORITY_BACKGROUND)、失敗しても partial にはしない
+    variants = asyncio.ensure_future(fetch_fanout_variants(q))
+    try:
+        song_res, video_res, partial_result = await fetch_songs_and_videos(search_query, song_limit, video_limit)
+        extra = await variants
+    finally:
+        variants.cancel()
+    return song_res, video_res + extra, partial_result
+
+# --- Search Pipeline ---
+
+def analyze_item(vid: str, item_type: str, original_title: str, api_artist_name: str, channel_name: str, duration: str,
+                 flags: Optional[KeywordFlags] = None):
+    # 1件分の分類と解析。結果は metadata_store に保存され、同じ動画では再利用される
+    timer = current_timer()
+    if flags is None:
+        with timer.stage("filter"):
+            flags = classify_item(original_title, channel_name)
+    record = {
+        "original_title": original_title,
+        "channel": channel_name,
+        "negative": flags.negative,
+        "trusted_channel": flags.trusted_channel,
+        "song": None,
+    }
+    if flags.negative: return record
+
+    parse_started = time.perf_counter()
+    is_no_guide, has_vocal = attributes_from_flags(flags)
+    parsed_title, parsed_artist, key = parse_metadata(original_title, api_artist_name, channel_name, item_type)
+
+    record["song"] = song_item(vid, parsed_title, parsed_artist, original_title, duration, channel_name,
+                               item_type, is_no_guide, has_vocal, key)
+    timer.add("parse_metadata", time.perf_counter() - parse_started)
+    return record
+
+def lookup_records(items: list):
+    # 既知の動画は解析済みの結果をまとめて引く (解析ルールが変わっていれば見つからない扱い)
+    rules_version = metadata_rules_version()
+    with current_timer().stage("metadata_store"):
+        known = metadata_store.get_many(
+            [(item.get("videoId"), item['_type']) for item in items if item.get("videoId")], rules_version
+        )
+    return known, rules_version
+
+def item_fields(item: dict):
+    # 戻り値: (original_title, api_artist_name, channel_name)
+    original_title = item.get("title", "")
+    artists = item.get("artists") or []
+    api_artist_name = artists[0]["name"] if artists else ""
+    return original_title, api_artist_name, api_artist_name if api_artist_name else "YouTube Music"
+
+def known_record(item: dict, known: dict):
+    # 保存済みの解析結果 (タイトル・チャンネルが変わっていれば None)
+    record = known.get((item.get("videoId"), item['_type']))
+    if record is None: return None
+    original_title, _, channel_name = item_fields(item)
+    if record["original_title"] != original_title or record["channel"] != channel_name: return None
+    return record
+
+def record_for_item(item: dict, known: dict, new_records: list, flags: Optional[KeywordFlags] = None):
+    # 保存済みの解析結果を使い、なければ (タイトル・チャンネルが変わった場合も) 解析して new_records に積む
+    record = known_record(item, known)
+    if record is None:
+        vid = item.get("videoId")
+        original_title, api_artist_name, channel_name = item_fields(item)
+        record = analyze_item(vid, item['_type'], original_title, api_artist_name, channel_name, item.get("duration") or "00:00", flags)
+        new_records.append((vid, item['_type'], record))
+    return record
+
+def store_records(new_records: list, rules_version: str):
+    with current_timer().stage("metadata_store"):
+        metadata_store.put_many(new_records, rules_version)
+
+def tag_items(song_results: list, video_results: list):
+    all_items = []
+    for item in song_results:
+        item['_type'] = 'song'
+        all_items.append(item)
+    for item in video_results:
+        item['_type'] = 'video'
+        all_items.append(item)
+    return all_items
+
+def pending_item(item: dict):
+    # 未解析のまま残す候補。解析に必要な項目だけにしてキャッシュ・カーソルに載せる
+    artists = item.get("artists") or []
+    return {
+        "videoId": item.get("videoId"),
+        "title": item.get("title", ""),
+        "artists": [{"name": artists[0]["name"]}] if artists else [],
+        "duration": item.get("duration"),
+        "_type": item['_type'],
+    }
+
+def rank_items(q: str, items: list, top_n: Optional[int] = None):
+    # 2段階のランキング。戻り値: {"results": 上位 top_n 件 (解析済み・並び確定), "pending": 残りの候補 (未解析、元の順)}
+    #   1段目: キーワード判定のフラグだけで各候補のスコアの上限を出す (関連度はクエリの全語が一致したとみなす)
+    #   2段目: 上限の高い順に解析して正確なスコアを出し、top_n 件目に残りの上限が届かなくなったら打ち切る
+    # 同点は元の順 (songs → videos) なので、全件を解析して並べた場合と同じ並びになる。top_n=None なら全件
+    timer = current_timer()
+    clock = time.perf_counter
+    parts = relevance_parts(q)
+    max_relevance = RELEVANCE_PER_PART * len(parts)
+    known, rules_version = lookup_records(items)
+    new_records = []
+    seen_ids = set()
+    # 候補: (item, 保存済みの解析結果 or None, フラグ, 関連度以外の加点)
+    candidates = []
+
+    for item in items:
+        vid = item.get("videoId")
+        if not vid or vid in seen_ids: continue
+        record = known_record(item, known)
+        flags = None
+        if record is not None:
+            negative, trusted_channel = record["negative"], record["trusted_channel"]
+            has_vocal = not negative and record["song"]["has_vocal"]
         else:
-            if "/" in clean_t:
-                parts = clean_t.split("/", 1); title = parts[0]; artist = parts[1].replace("[カラオケ]", "").strip()
-            elif " - " in clean_t:
-                parts = clean_t.split(" - ", 1); title = parts[0]; artist = parts[1]
-            else:
-                title = clean_t
-                if any(k in channel_name for k in ["Official", "Music", "Records"]): artist = channel_name
-
-    # --- Songの場合 ---
-    elif result_type == "song":
-        if "まねきねこ" in artist_from_api or "Manekineko" in artist_from_api:
-            temp_title = original_title
-            match_key = re.search(r"([+-]?\d+KEY)", temp_title)
-            if match_key:
-                key = match_key.group(1); temp_title = re.sub(r"[+-]?\d+KEY", "", temp_title)
-            match_artist_long = re.search(r"\[Originally Performed By (.*?)\]", temp_title, re.IGNORECASE)
-            match_artist_short = re.search(r"\[(.*?)\]$", temp_title)
-            if match_artist_long:
-                artist = match_artist_long.group(1).strip()
-                temp_title = re.sub(r"\[Originally Performed By .*?\]", "", temp_title, flags=re.IGNORECASE)
-            elif match_artist_short:
-                artist = match_artist_short.group(1).strip()
-                temp_title = re.sub(r"\[.*?\]$", "", temp_title)
-            title = temp_title.replace("（カラオケ）", "").replace("(カラオケ)", "").strip()
-
-        elif "歌っちゃ王" in artist_from_api:
-            temp_title = original_title
-            re_prefix = r"(?i)(?:Key|キー)\s*[:：]?\s*([+＋\-−–—ー－]?\d+)"
-            re_suffix = r"(?i)([+＋\-−–—ー－]?\d+)\s*(?:Key|キー)"
-            match_p = re.search(re_prefix, temp_title); match_s = re.search(re_suffix, temp_title)
-            raw_key = None
-            if match_p:
-                raw_key = match_p.group(1); temp_title = re.sub(re_prefix, "", temp_title)
-            elif match_s:
-                raw_key = match_s.group(1); temp_title = re.sub(re_suffix, "", temp_title)
-            if raw_key:
-                key_val = raw_key.replace("＋", "+").translate(str.maketrans("−–—ー－", "-----"))
-                key = f"{key_val}KEY"
-            match_artist = re.search(r"[\[\(\【［（](?:原曲歌手|オリジナルアーティスト|オリジナル歌手)[:：](.*?)[\]\)\】］）]", temp_title)
-            if match_artist:
-                artist = match_artist.group(1).strip()
-                temp_title = re.sub(r"[\[\(\【［（](?:原曲歌手|オリジナルアーティスト|オリジナル歌手)[:：].*?[\]\)\】］）]", "", temp_title)
-            temp_title = temp_title.replace("（カラオケ）", "").replace("(カラオケ)", "")
-            title = re.sub(r"[\[\(]ガイド.*?(?:無し|なし)カラオケ[\]\)]", "", temp_title).strip()
-
-        elif "カラオケ" in artist_from_api or "Karaoke" in artist_from_api:
-             if "/" in original_title:
-                parts = original_title.split("/", 1); title = parts[0]; artist = parts[1].replace("【カラオケ音源】", "").strip()
-
-    return clean_text(title), clean_text(artist), key
+            with timer.stage("filter"):
+                flags = classify_item(item.get("title", ""), item_fields(item)[2])
+            negative, trusted_channel = flags.negative, flags.trusted_channel
+            has_vocal = attributes_from_flags(flags)[1]
+        if negative:
+            # 除外した動画も記録しておき、次回は判定を省く
+            if record is None: record_for_item(item, known, new_records, flags)
+            continue
+        bonus = 0
+        if not has_vocal: bonus += 5000
+        if trusted_channel: bonus += 3000
+        if item['_type'] == 'song': bonus += 100
+        candidates.append((item, record, flags, bonus))
+        seen_ids.add(vid)
 
-def calculate_relevance_score(query: str, title: str, artist: str, original_title: str):
-    if not query: return 0
-    score = 0
-    query_parts = query.split()
-    target_text_raw = f"{title} {artist} {original_title}"
-    target_norm = normalize_for_comparison(target_text_raw)
-    for part in query_parts:
-        part_norm = normalize_for_comparison(part)
-        if not part_norm: continue
-        if part_norm in target_norm: score += 20000 
-    return score
+    n = len(candidates) if top_n is None else min(top_n, len(candidates))
+    with timer.stage("sort"):
+        bounds = [(-(bonus + max_relevance), i) for i, (_, _, _, bonus) in enumerate(candidates)]
+        heapq.heapify(bounds)
+    # 正確なスコアでの上位 n 件。(score, -i) の min-heap なので先頭が n 件中の最下位
+    top = []
+    songs = {}
+    scored_out = []
+    while n and bounds:
+        neg_bound, i = bounds[0]
+        if len(top) == n and (-neg_bound, -i) < top[0]: break
+        heapq.heappop(bounds)
+
+        item, record, flags, bonus = candidates[i]
+        if record is None: record = record_for_item(item, known, new_records, flags)
+        t2 = clock()
+        song = record["song"]
+        score = bonus + relevance_from_parts(parts, song["title"], song["artist"], song["original_title"])
+        songs[i] = song
+        if len(top) < n:
+            heapq.heappush(top, (score, -i))
+        else:
+            scored_out.append(-heapq.heappushpop(top, (score, -i))[1])
+        timer.add("scoring", clock() - t2)
+
+    store_records(new_records, rules_version)
+    with timer.stage("sort"):
+        results = [songs[-neg_i] for _, neg_i in sorted(top, reverse=True)]
+        rest = sorted(scored_out + [i for _, i in bounds])
+    return {"results": results, "pending": [pending_item(candidates[i][0]) for i in rest]}
+
+def rank_results(q: str, song_results: list, video_results: list, top_n: Optional[int] = None):
+    return rank_items(q, tag_items(song_results, video_results), top_n)
+
+def as_ranking(value):
+    # キャッシュの値: {"results", "pending"}。それ以外 (旧形式など) は見つからなかった扱いにする
+    return value if isinstance(value, dict) else None
+
+def unranked(items: list):
+    # 解析・並べ替え前の候補だけのランキング (最初に使う側が expand_ranking で解析する)
+    return {"results": [], "pending": [pending_item(item) for item in items]}
+
+def exclude_from_ranking(ranking: dict, excluded: Optional[ExclusionFilter]):
+    # 除外対象を並びから外す。未解析の候補は解析前に落とすので、その分は次点の候補で埋まる
+    if excluded is None: return ranking
+    return {
+        **ranking,
+        "results": [r for r in ranking["results"] if r["video_id"] not in excluded],
+        "pending": [item for item in ranking.get("pending") or [] if item["videoId"] not in excluded],
+    }
+
+def expand_ranking(q: str, ranking: dict, count: Optional[int] = None):
+    # 解析済みの結果が count 件 (None なら全件) になるまで、残りの候補を2段目にかける
+    pending = ranking.get("pending") or []
+    need = len(pending) if count is None else count - len(ranking["results"])
+    if need <= 0 or not pending: return ranking
+    more = rank_items(q, pending, need)
+    index_results(more["results"])
+    return {**ranking, "results": ranking["results"] + more["results"], "pending": more["pending"]}
+
+def index_results(results: list):
+    # ランキング済みの結果をサジェスト用カタログに追記し、期限が来ていればスナップショットを裏で書き出す
+    if not results: return
+    with current_timer().stage("catalog_index"):
+        catalog_index.add_many(results)
+    if catalog_index.snapshot_path:
+        asyncio.get_running_loop().run_in_executor(None, catalog_index.snapshot_if_due)
+
+async def run_search(q: str, stage: int = 0):
+    # 上流から取得する。戻り値: (候補 (_type 付きの上流の item、songs → videos の順), partial)
+    search_query = f"{q} カラオケ"
+    song_limit, video_limit = UPSTREAM_STAGES[stage]
+    if SEARCH_FANOUT and stage == 0:
+        song_results, video_results, partial_result = await fetch_with_fanout(q, search_query, song_limit, video_limit)
+    else:
+        song_results, video_results, partial_result = await fetch_songs_and_videos(search_query, song_limit, video_limit)
+    return tag_items(song_results, video_results), partial_result
+
+def rank_candidates(q: str, items: list, excluded: Optional[ExclusionFilter] = None):
+    # 1ページ分をランキングする。除外対象は解析の前に落とす。戻り値: (ranking, failed)
+    if excluded is not None: items = [item for item in items if item.get("videoId") not in excluded]
+    try:
+        ranking = rank_items(q, items, top_n=SEARCH_PAGE_SIZE)
+    except Exception as e:
+        print(f"Search Error: {e}")
+        return {"results": [], "pending": []}, True
+    index_results(ranking["results"])
+    return ranking, False
+
+async def search_and_cache(cache_key: str, q: str, stage: int, excluded: Optional[ExclusionFilter] = None):
+    # 同じキーの同時リクエストは1回の上流呼び出しを共有し、ランキングは除外フィルタごとに行う。戻り値: (ranking, partial)
+    # 共有キャッシュには除外なしの並びを置く。先頭のリクエストに除外がある場合は未解析の候補のまま置く
+    # 上流へは待っている中で最も高い優先度で出す (裏の更新や prewarm に利用者の検索が合流した場合は引き上げる)
+    shared = flight_priorities.get(cache_key)
+    if shared is None:
+        shared = flight_priorities[cache_key] = SharedPriority(priority_value(upstream_priority.get()))
+    else:
+        shared.raise_to(priority_value(upstream_priority.get()))
+
+    async def fetch():
+        upstream_priority.set(shared)
+        try:
+            return await fetch_and_rank()
+        finally:
+            if flight_priorities.get(cache_key) is shared: del flight_priorities[cache_key]
+
+    async def fetch_and_rank():
+        items, partial_result = await run_search(q, stage)
+        ranking = None
+        if excluded is None:
+            ranking, failed = rank_candidates(q, items)
+            partial_result = partial_result or failed
+        # 部分的な結果やエラーはキャッシュしない
+        if not partial_result:
+            search_cache.set(cache_key, ranking if ranking is not None else unranked(items))
+        return items, ranking, partial_result
+    items, ranking, partial_result = await search_flight.do(cache_key, fetch)
+    if ranking is None or excluded is not None:
+        ranking, failed = rank_candidates(q, items, excluded)
+        partial_result = partial_result or failed
+    return ranking, partial_result
+
+async def refresh_search_cache(cache_key: str, q: str, stage: int):
+    # 裏での更新は利用者の検索より後回しにする (このタスク内だけの設定)
+    upstream_priority.set(PRIORITY_BACKGROUND)
+    try:
+        await search_and_cache(cache_key, q, stage)
+    except SingleFlightOverflow:
+        pass
+    finally:
+        refreshing_keys.discard(cache_key)
+
+async def get_ranked_results(q: str, stage: int = 0, excluded: Optional[ExclusionFilter] = None):
+    # 段階ごとのランキング結果をキャッシュ経由で取得する (除外対象は取り除いた並び)。戻り値: (ranking, partial, cache_state)
+    cache_key = normalize_for_comparison(q)
+    if stage: cache_key = f"{cache_key}#{stage}"
+
+    cached, cache_state = search_cache.get(cache_key)
+    cached = as_ranking(cached)
+    if cached is not None:
+        # stale-while-revalidate: 期限切れでも即返し、裏で更新する
+        if cache_state == "stale" and cache_key not in refreshing_keys:
+            refreshing_keys.add(cache_key)
+            background_tasks.add(task := asyncio.create_task(refresh_search_cache(cache_key, q, stage)))
+            task.add_done_callback(background_tasks.discard)
+        return exclude_from_ranking(cached, excluded), False, cache_state
+
+    try:
+        ranking, partial_result = await search_and_cache(cache_key, q, stage, excluded)
+    except SingleFlightOverflow:
+        fallback = degraded_results(cache_key, excluded)
+        if fallback is None: raise
+        return fallback
+    if partial_result and not ranking["results"]:
+        # 上流が絞られている・失敗している間は、期限切れでも残っている最新の結果を返す
+        return degraded_results(cache_key, excluded) or (ranking, partial_result, "miss")
+    return ranking, partial_result, "miss"
+
+def degraded_results(cache_key: str, excluded: Optional[ExclusionFilter] = None):
+    # 戻り値: (ranking, partial=True, "stale") または None。partial なので HTTP キャッシュはされない
+    cached, age = search_cache.get_any(cache_key)
+    cached = as_ranking(cached)
+    if cached is None: return None
+    metrics.inc("search_degraded_total")
+    print(f"Search degraded: serving cached results for {cache_key!r} ({age:.0f}s old)")
+    return exclude_from_ranking(cached, excluded), True, "stale"
+
+async def extend_cursor(cursor: dict, excluded: Optional[ExclusionFilter] = None):
+    # 次の段階の上流結果を取得し、未出のものだけを末尾に追加する (今の段階の候補は先に全部並べておく)
+    cursor = expand_ranking(cursor["q"], cursor)
+    stage = cursor["stage"] + 1
+    more, partial_result, cache_state = await get_ranked_results(cursor["q"], stage, excluded)
+    known_ids = {r["video_id"] for r in cursor["results"]}
+    results = cursor["results"] + [r for r in more["results"] if r["video_id"] not in known_ids]
+    pending = [item for item in more["pending"] if item["videoId"] not in known_ids]
+    return {"q": cursor["q"], "stage": stage, "results": results, "pending": pending}, partial_result, cache_state
+
+async def build_cursor(q: str, stage: int, excluded: Optional[ExclusionFilter] = None):
+    # カーソルが見つからない場合 (期限切れ・別インスタンス) に q から同じ並びを再構築する
+    ranking, partial_result, cache_state = await get_ranked_results(q, 0, excluded)
+    cursor = {"q": q, "stage": 0, **ranking}
+    while cursor["stage"] < stage:
+        cursor, more_partial, cache_state = await extend_cursor(cursor, excluded)
+        partial_result = partial_result or more_partial
+    return cursor, partial_result, cache_state
+
+def record_query(q: str):
+    key = normalize_for_comparison(q)
+    entry = popular_queries.get(key)
+    if entry is not None:
+        entry[0] += 1
+        return
+    if len(popular_queries) >= POPULAR_QUERIES_MAX:
+        # 上限に達したら回数の少ない半分を捨てる
+        for stale_key, _ in sorted(popular_queries.items(), key=lambda x: x[1][0])[:POPULAR_QUERIES_MAX // 2]:
+            del popular_queries[stale_key]
+    popular_queries[key] = [1, q]
+
+def save_cursor(cursor_id: str, cursor: dict):
+    # 同じIDのカーソルは利用者間で共有される。他の利用者が LOAD MORE で先まで伸ばしたものは巻き戻さない
+    stored, _ = cursor_store.get(cursor_id)
+    if stored is not None and (stored["stage"], len(stored["results"])) > (cursor["stage"], len(cursor["results"])): return
+    cursor_store.set(cursor_id, cursor)
+
+def cursor_id_for(q: str, exclude: Optional[str] = None):
+    # 除外フィルタごとに並びが変わるので、フィルタもIDに含める
+    key = normalize_for_comparison(q) + (f"\n{exclude}" if exclude else "")
+    return hashlib.blake2b(key.encode(), digest_size=9).hexdigest()
+
+def encode_page_token(cursor_id: str, offset: int, stage: int):
+    raw = json.dumps({"c": cursor_id, "o": offset, "s": stage}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_page_token(token: str):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json.loads(raw)
+        stage = int(data["s"])
+        if not 0 <= stage < len(UPSTREAM_STAGES): return None
+        return str(data["c"]), max(int(data["o"]), 0), stage
+    except (ValueError, KeyError, TypeError):
+        return None
+
+# --- Instrumentation ---
+
+def encode_json(body) -> bytes:
+    # orjson があればそちらで (標準の json より数倍速い)。出力はどちらも空白なし・非ASCIIはそのまま
+    if orjson is not None: return orjson.dumps(body)
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode()
+
+def json_response(body: dict, status_code: int = 200):
+    # FastAPI の JSONResponse と同じ形式で、エンコード時間を serialization ステージに計上する
+    with current_timer().stage("serialization"):
+        content = encode_json(body)
+    return Response(content, status_code=status_code, media_type="application/json")
+
+def etag_matches(if_none_match: Optional[str], etag: str):
+    if not if_none_match: return False
+    if if_none_match.strip() == "*": return True
+    # 弱い比較 (W/ の有無は区別しない)
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in if_none_match.split(","))
+
+def cacheable_json_response(request: Request, body: dict):
+    # 検索結果のレスポンス。内容ハッシュの ETag を付け、If-None-Match が一致すれば 304 を返す。
+    # ETag は "cache" (このインスタンスでのキャッシュ状態) を除いた内容で計算する
+    if body.get("partial"):
+        response = json_response(body)
+        response.headers.update(NO_STORE_HEADERS)
+        return response
+
+    cache_state = body.get("cache")
+    with current_timer().stage("serialization"):
+        content = encode_json({k: v for k, v in body.items() if k != "cache"})
+        etag = f'W/"{hashlib.blake2b(content, digest_size=12).hexdigest()}"'
+        if cache_state is not None:
+            content = content[:-1] + b',"cache":' + encode_json(cache_state) + b"}"
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={SEARCH_HTTP_MAX_AGE_SEC}, stale-while-revalidate={SEARCH_HTTP_SWR_SEC}",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content, media_type="application/json", headers=headers)
+
+def collect_runtime_metrics():
+    cache_stats = search_cache.stats()
+    flight_stats = search_flight.stats()
+    lyrics_stats = lyrics_cache.stats()
+    governor_stats = upstream_governor.stats()
+    return [
+        ("search_cache_lookups_total", {"state": "hit"}, cache_stats["hits"]),
+        ("search_cache_lookups_total", {"state": "stale"}, cache_stats["stale_hits"]),
+        ("search_cache_lookups_total", {"state": "miss"}, cache_stats["misses"]),
+        ("search_cache_entries", {}, cache_stats["entries"]),
+        ("metadata_store_lookups_total", {"state": "hit"}, metadata_store.hits),
+        ("metadata_store_lookups_total", {"state": "miss"}, metadata_store.misses),
+        ("search_single_flight_total", {"role": "leader"}, flight_stats["leaders"]),
+        ("search_single_flight_total", {"role": "follower"}, flight_stats["coalesced"]),
+        ("search_single_flight_total", {"role": "rejected"}, flight_stats["rejected"]),
+        ("search_single_flight_waiting", {}, flight_stats["waiting"]),
+        ("lyrics_cache_lookups_total", {"state": "hit"}, lyrics_stats["hits"]),
+        ("lyrics_cache_lookups_total", {"state": "miss"}, lyrics_stats["misses"]),
+        ("catalog_index_entries", {}, len(catalog_index)),
+        *[("upstream_governor_total", {"outcome": outcome}, governor_stats[outcome]) for outcome in ("granted", "queued", "rejected", "timed_out")],
+        ("upstream_governor_waiting", {}, governor_stats["waiting"]),
+        *[
+            ("upstream_latency_seconds", {"filter": name, "quantile": q}, stats[key])
+            for name, stats in upstream_latency.stats().items()
+            for q, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))
+        ],
+    ]
+
+metrics.add_collector(collect_runtime_metrics)
+
+@app.middleware("http")
+async def server_timing_middleware(request: Request, call_next):
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+
+    timer = start_request_timer()
+    profiler = None
+    global profiling_active
+    if PROFILE_SAMPLE_RATE > 0 and not profiling_active and random.random() < PROFILE_SAMPLE_RATE:
+        # 同一スレッドで同時に有効にできるプロファイラは1つだけ。期間中の他リクエストも含まれる点に注意
+        import cProfile
+        profiling_active = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        response = await call_next(request)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiling_active = False
+            import pstats
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(25)
+            print(f"Profile {request.url.path}?{request.url.query}\n{out.getvalue()}")
+
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    if response.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+        # NDJSON はヘッダを送った後に処理が進むので Server-Timing は付けず、送り終えてから記録する
+        response.body_iterator = observe_after_stream(response.body_iterator, timer, path)
+        return response
+    observe_request(timer, path)
+    response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+def observe_request(timer, path: str):
+    for stage, seconds in timer.stages.items():
+        metrics.observe("search_stage_seconds", seconds, stage=stage, path=path)
+    metrics.observe("http_request_duration_seconds", timer.elapsed(), path=path)
+
+async def observe_after_stream(body_iterator, timer, path: str):
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        observe_request(timer, path)
 
 # --- API Endpoints ---
 
+@app.get("/api/metrics")
+async def get_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/search")
-async def search(q: Optional[str] = None):
+async def search(request: Request, q: Optional[str] = None, page_token: Optional[str] = None, type: str = "standard", playlist_id: Optional[str] = None,
+                 exclude: Optional[str] = None):
+    if type == "playlist":
+        if not playlist_id or not RE_PLAYLIST_ID.match(playlist_id):
+            raise HTTPException(status_code=400, detail="Invalid playlist_id", headers=NO_STORE_HEADERS)
+        try:
+            return cacheable_json_response(request, await playlist_page(playlist_id, page_token))
+        except SingleFlightOverflow:
+            raise HTTPException(status_code=503, detail="Too many identical imports in flight", headers={"Retry-After": "1", **NO_STORE_HEADERS})
+
     if not q:
         return {"results": [], "next_page_token": None}
 
-    search_query = f"{q} カラオケ"
-    temp_results = []
-    seen_ids = set()
+    excluded = None
+    if exclude:
+        try:
+            excluded = ExclusionFilter.parse(exclude, EXCLUDE_FILTER_MAX_BYTES)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid exclude ({e})", headers=NO_STORE_HEADERS)
 
     try:
-        song_results = ytmusic.search(search_query, filter="songs", limit=20)
-        video_results = ytmusic.search(search_query, filter="videos", limit=40)
-        
-        all_items = []
-        for item in song_results:
-            item['_type'] = 'song'
-            all_items.append(item)
-        for item in video_results:
-            item['_type'] = 'video'
-            all_items.append(item)
-
-        for item in all_items:
-            vid = item.get("videoId")
-            if not vid or vid in seen_ids: continue
-
-            original_title = item.get("title", "")
-            title_lower = original_title.lower()
-            if any(ng in title_lower for ng in NEGATIVE_KEYWORDS): continue
-            
-            artists = item.get("artists", [])
-            api_artist_name = artists[0]["name"] if artists else ""
-            channel_name = api_artist_name if api_artist_name else "YouTube Music"
-
-            is_no_guide, has_vocal = determine_attributes(original_title, channel_name)
-            parsed_title, parsed_artist, key = parse_metadata(original_title, api_artist_name, channel_name, item['_type'])
-
-            # SongItemの作成 (typeフィールドを v2.2 用にセット)
-            song_obj = SongItem(
-                video_id=vid,
-                title=parsed_title,
-                artist=parsed_artist,
-                original_title=original_title,
-                duration=item.get("duration") or "00:00",
-                channel=channel_name,
-                result_type=item['_type'],
-                is_no_guide=is_no_guide,
-                has_vocal=has_vocal,
-                key=key,
-                type=item['_type'] # アイコン表示用に 'song' または 'video' をそのまま代入
-            )
-
-            score = 0
-            relevance = calculate_relevance_score(q, parsed_title, parsed_artist, original_title)
-            score += relevance
-            if not has_vocal: score += 5000 
-            if any(c in channel_name for c in TRUSTED_KARAOKE_CHANNELS): score += 3000
-            if item['_type'] == 'song': score += 100
-
-            temp_results.append({ "data": song_obj, "score": score })
-            seen_ids.add(vid)
+        return cacheable_json_response(request, await search_page(q, page_token, exclude if excluded else None, excluded))
+    except SingleFlightOverflow:
+        # 同一クエリの待機数が上限を超えた場合は、上流を叩かずにリトライを促す
+        raise HTTPException(status_code=503, detail="Too many identical searches in flight", headers={"Retry-After": "1", **NO_STORE_HEADERS})
+
+async def search_page(q: str, page_token: Optional[str], exclude: Optional[str] = None, excluded: Optional[ExclusionFilter] = None):
+    # exclude / excluded: 除外フィルタ (元の文字列と解析済み)。カーソルはフィルタごとに別になる
+    if page_token:
+        decoded = decode_page_token(page_token)
+        if decoded is None:
+            # 空のページを返すと CDN にキャッシュされてしまう (キャッシュキーに page_token を含むため)
+            raise HTTPException(status_code=400, detail="Invalid page_token", headers=NO_STORE_HEADERS)
+        cursor_id, offset, stage = decoded
+        cursor, _ = cursor_store.get(cursor_id)
+        partial_result, cache_state = False, "hit"
+        if cursor is None or normalize_for_comparison(cursor["q"]) != normalize_for_comparison(q):
+            cursor, partial_result, cache_state = await build_cursor(q, stage, excluded)
+    else:
+        record_query(q)
+        # 同じクエリには同じカーソルIDを振る (レスポンスが利用者によらず同一になり、CDN / ETag でキャッシュできる)
+        cursor_id, offset = cursor_id_for(q, exclude), 0
+        ranking, partial_result, cache_state = await get_ranked_results(q, 0, excluded)
+        cursor = {"q": q, "stage": 0, **ranking}
+
+    # 表示するページまでを解析・確定する。LOAD MORE では足りなければ上流の次の段階を取りに行く (1ページ目は待たずに返す)
+    end = offset + SEARCH_PAGE_SIZE
+    cursor = expand_ranking(q, cursor, end)
+    while page_token and len(cursor["results"]) < end and cursor["stage"] < len(UPSTREAM_STAGES) - 1:
+        cursor, more_partial, cache_state = await extend_cursor(cursor, excluded)
+        partial_result = partial_result or more_partial
+        cursor = expand_ranking(q, cursor, end)
+    save_cursor(cursor_id, cursor)
+
+    page = cursor["results"][offset:end]
+    # 1ページ目が埋まらなかった場合 (除外が多い等) も、次のページは返した分の続きから
+    next_offset = offset + len(page)
+    has_more = len(cursor["results"]) > next_offset or bool(cursor.get("pending")) or cursor["stage"] < len(UPSTREAM_STAGES) - 1
+    next_page_token = encode_page_token(cursor_id, next_offset, cursor["stage"]) if has_more else None
+
+    return {"results": page, "next_page_token": next_page_token, "partial": partial_result, "cache": cache_state}
+
+@app.get("/api/suggest")
+async def suggest(q: Optional[str] = None, limit: int = 10):
+    # 上流は呼ばず、これまでに検索された曲のカタログから前方一致・あいまい一致で候補を返す
+    if not q:
+        return {"results": []}
+    limit = min(max(limit, 1), SUGGEST_MAX_LIMIT)
+    with current_timer().stage("suggest"):
+        results = catalog_index.suggest(q, limit)
+    return json_response({"results": results})
+
+# --- Playlist Import ---
+# プレイリスト全体 (最大 PLAYLIST_MAX_TRACKS 曲) を1回取得し、必要な項目だけに絞って playlist_cache に置く。
+# 解析はページ (PLAYLIST_PAGE_SIZE 曲) 単位で、検索のランキングと同じくまとめて1回で行う。
+# 解析済みの動画は metadata_store から再利用するので、2回目以降の取り込みはほぼ解析なしで返る。
+# 並び順はプレイリストのまま (スコアリングはしない)。
 
+def compact_playlist_track(track: dict):
+    # ytmusicapi の videoType: ATV は公式音源 (song)、それ以外 (OMV / UGC) は動画扱い
+    artists = track.get("artists") or []
+    return {
+        "videoId": track.get("videoId"),
+        "title": track.get("title") or "",
+        "artists": [{"name": artists[0].get("name") or ""}] if artists else [],
+        "duration": track.get("duration"),
+        "_type": "song" if track.get("videoType") == "MUSIC_VIDEO_TYPE_ATV" else "video",
+    }
+
+async def get_playlist_tracks(playlist_id: str):
+    # 戻り値: (tracks, cache_state)
+    cached, cache_state = playlist_cache.get(playlist_id)
+    if cached is not None:
+        return cached, cache_state
+
+    async def fetch():
+        # 取り込みは検索より優先度を下げる (single-flight のタスク内だけの設定)
+        upstream_priority.set(PRIORITY_BACKGROUND)
+        def call():
+            return get_ytmusic().get_playlist(playlist_id, limit=PLAYLIST_MAX_TRACKS)
+        # 大きなプレイリストは取得自体が重いので二重に出さない
+        playlist = await call_upstream("playlist", call, timeout=PLAYLIST_TIMEOUT_SEC, hedge=False)
+        tracks = [compact_playlist_track(t) for t in (playlist.get("tracks") or [])[:PLAYLIST_MAX_TRACKS] if t.get("videoId")]
+        playlist_cache.set(playlist_id, tracks)
+        return tracks
+    return await playlist_flight.do(playlist_id, fetch), "miss"
+
+def classify_playlist_batch(tracks: list):
+    known, rules_version = lookup_records(tracks)
+    new_records = []
+    songs = []
+    for track in tracks:
+        record = record_for_item(track, known, new_records)
+        if not record["negative"]: songs.append(record["song"])
+    store_records(new_records, rules_version)
+    return songs
+
+async def playlist_page(playlist_id: str, page_token: Optional[str]):
+    offset = 0
+    if page_token:
+        decoded = decode_page_token(page_token)
+        if decoded is None or decoded[0] != playlist_id:
+            raise HTTPException(status_code=400, detail="Invalid page_token", headers=NO_STORE_HEADERS)
+        offset = decoded[1]
+
+    try:
+        tracks, cache_state = await get_playlist_tracks(playlist_id)
+    except SingleFlightOverflow:
+        raise
     except Exception as e:
-        print(f"Search Error: {e}")
-        return {"results": [], "next_page_token": None}
+        print(f"Playlist Error ({playlist_id}): {e!r}")
+        return {"results": [], "next_page_token": None, "partial": True, "cache": "miss"}
+
+    window = tracks[offset:offset + PLAYLIST_PAGE_SIZE]
+    partial = False
+    try:
+        songs = classify_playlist_batch(window)
+    except Exception as e:
+        print(f"Playlist Error ({playlist_id}): {e!r}")
+        songs, partial = [], True
+    results = []
+    seen_ids = set()
+    for song in songs:
+        if song["video_id"] in seen_ids: continue
+        seen_ids.add(song["video_id"])
+        results.append(song)
+
+    end = offset + len(window)
+    next_page_token = encode_page_token(playlist_id, end, 0) if end < len(tracks) else None
+    return {"results": results, "next_page_token": next_page_token, "partial": partial, "cache": cache_state, "total": len(tracks)}
+
+# --- Lyrics ---
+# frontend の searchAndScoreLRCLib と同じスコアリングで歌詞を選び、video_id + 問い合わせ内容 (正規化したタイトル・アーティストと再生時間) 単位でキャッシュする。
+# タイトル等はクライアントから送られてくるので、video_id だけをキーにすると別の内容で選んだ歌詞が他の利用者に返ってしまう。
+# バッチ (予約リスト全体の先読み) は lyrics_executor のスレッド数までで並列に解決する。
+
+def lyrics_result(video_id: str, best: Optional[dict]):
+    if best is None:
+        return {"video_id": video_id, "lyrics": "", "source": "None", "synced": False,
+                "track_name": None, "artist_name": None, "score": None}
+    return {
+        "video_id": video_id,
+        "lyrics": best.get("syncedLyrics") or best.get("plainLyrics") or "",
+        "source": "LRCLib (Auto)",
+        "synced": bool(best.get("syncedLyrics")),
+        "track_name": best.get("trackName"),
+        "artist_name": best.get("artistName"),
+        "score": best["score"],
+    }
+
+def lyrics_key(item: LyricsRequest):
+    return json.dumps([item.video_id, normalize_for_comparison(item.title), normalize_for_comparison(item.artist), item.duration.strip()], ensure_ascii=False)
+
+async def resolve_lyrics(item: LyricsRequest):
+    cache_key = lyrics_key(item)
+    cached, _ = lyrics_cache.get(cache_key)
+    if cached is not None:
+        return {**cached, "cache": "hit"}
+
+    async def fetch():
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            best = await loop.run_in_executor(lyrics_executor, lyrics_client.resolve, item.title, item.artist, item.duration)
+        except Exception:
+            metrics.inc("upstream_errors_total", filter="lyrics", kind="error")
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            current_timer().add("upstream_lyrics", elapsed)
+            metrics.observe("upstream_call_seconds", elapsed, filter="lyrics")
+        result = lyrics_result(item.video_id, best)
+        lyrics_cache.set(cache_key, result)
+        return result
+
+    try:
+        result = await lyrics_flight.do(cache_key, fetch)
+    except SingleFlightOverflow:
+        raise
+    except Exception as e:
+        # 上流のエラーはキャッシュせず「見つからない」として返す (クライアントは直接 LRCLib に問い合わせられる)
+        print(f"Lyrics Error ({item.video_id}): {e!r}")
+        return {**lyrics_result(item.video_id, None), "cache": "error"}
+    return {**result, "cache": "miss"}
+
+@app.get("/api/lyrics")
+async def get_lyrics(video_id: str, title: str, artist: str = "", duration: str = ""):
+    try:
+        return json_response(await resolve_lyrics(LyricsRequest(video_id=video_id, title=title, artist=artist, duration=duration)))
+    except SingleFlightOverflow:
+        raise HTTPException(status_code=503, detail="Too many identical lyrics lookups in flight", headers={"Retry-After": "1"})
+
+@app.post("/api/lyrics/batch")
+async def get_lyrics_batch(request: LyricsBatchRequest):
+    # 予約リストの先読み用。重複する問い合わせはまとめ、結果は入力順に返す
+    if len(request.items) > LYRICS_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Too many items (max {LYRICS_BATCH_MAX_ITEMS})")
+    unique = {lyrics_key(item): item for item in request.items}
+    resolved = await asyncio.gather(*(resolve_lyrics(item) for item in unique.values()), return_exceptions=True)
+    by_key = {}
+    for (key, item), result in zip(unique.items(), resolved):
+        if isinstance(result, BaseException):
+            result = {**lyrics_result(item.video_id, None), "cache": "error"}
+        by_key[key] = result
+    return json_response({"results": [by_key[lyrics_key(item)] for item in request.items]})
+
+# --- Streaming Search ---
+# NDJSON で段階的に返す。1行1イベント:
+#   {"event": "results", "phase": "songs",  "results": [...]}             songs の解析・スコアリングが終わった時点
+#   {"event": "results", "phase": "videos", "results": [...], "order": [...]}  videos を加えた新規分と、全体の並び順 (video_id)
+#   {"event": "results", "phase": "cache",  "results": [...]}             キャッシュヒット時はまとめて1回
+#   {"event": "done", "partial": bool, "cache": "hit" | "stale" | "miss"}
+# Lambda (Mangum) はレスポンスをストリームできないため、全イベントをまとめた1レスポンスで返す。
+
+def ndjson_line(event: dict):
+    return encode_json(event) + b"\n"
+
+async def stream_search_events(q: str):
+    stage = len(UPSTREAM_STAGES) - 1
+    cache_key = f"{normalize_for_comparison(q)}#{stage}"
+    cached, cache_state = search_cache.get(cache_key)
+    cached = as_ranking(cached)
+    if cached is not None:
+        results = expand_ranking(q, cached)["results"]
+        yield ndjson_line({"event": "results", "phase": "cache", "results": results})
+        yield ndjson_line({"event": "done", "partial": False, "cache": cache_state})
+        return
+
+    search_query = f"{q} カラオケ"
+    song_limit, video_limit = UPSTREAM_STAGES[stage]
+    songs_task = asyncio.ensure_future(fetch_upstream(search_query, "songs", song_limit))
+    videos_task = asyncio.ensure_future(fetch_upstream(search_query, "videos", video_limit))
+    partial_result = False
+    try:
+        try:
+            song_results = await songs_task
+        except Exception as e:
+            print(f"Search Error (songs): {e!r}")
+            song_results, partial_result = [], True
+        song_ranked = rank_results(q, song_results, [])["results"]
+        yield ndjson_line({"event": "results", "phase": "songs", "results": song_ranked})
+
+        try:
+            video_results = await videos_task
+        except Exception as e:
+            print(f"Search Error (videos): {e!r}")
+            video_results, partial_result = [], True
+        ranked = rank_results(q, song_results, video_results)["results"]
+        sent_ids = {r["video_id"] for r in song_ranked}
+        yield ndjson_line({
+            "event": "results",
+            "phase": "videos",
+            "results": [r for r in ranked if r["video_id"] not in sent_ids],
+            "order": [r["video_id"] for r in ranked],
+        })
+    finally:
+        # クライアントが途中で切断した場合は残りの上流呼び出しを待たない
+        songs_task.cancel(); videos_task.cancel()
+
+    index_results(ranked)
+    if not partial_result:
+        search_cache.set(cache_key, {"results": ranked, "pending": []})
+    yield ndjson_line({"event": "done", "partial": partial_result, "cache": "miss"})
+
+@app.get("/api/search/stream")
+async def search_stream(q: Optional[str] = None):
+    if not q:
+        return Response(ndjson_line({"event": "done", "partial": False, "cache": "miss"}), media_type=NDJSON_MEDIA_TYPE)
+
+    if IS_LAMBDA:
+        body = b"".join([line async for line in stream_search_events(q)])
+        return Response(body, media_type=NDJSON_MEDIA_TYPE)
+    return StreamingResponse(stream_search_events(q), media_type=NDJSON_MEDIA_TYPE)
 
-    temp_results.sort(key=lambda x: x["score"], reverse=True)
-    final_results = [x["data"] for x in temp_results]
+# --- Batch Classification ---
+# 検索を通さずに、手元の (title, artist, channel, result_type) をまとめて分類・解析する (保存済みライブラリの再分類、コーパス作成用)。
+# 処理は batch_classifier (パーサごとにチャンク分けしてプロセスプールで並列)。結果は SongItem + "negative" + "index" (入力の位置)。
+# NDJSON で、チャンクが終わるたびに1行:
+#   {"event": "results", "results": [...]}   終わった順 (入力順ではない。並べ直しは index で)
+#   {"event": "done", "count": int}
+# 検索と違い NEGATIVE に当たるものも落とさずに返す (negative: true)。
 
-    return {"results": final_results, "next_page_token": None}
+def classify_rows_for(items: list):
+    rows = []
+    for i, item in enumerate(items):
+        artist = item.get("artist") or ""
+        channel = item.get("channel") or artist or "YouTube Music"
+        rows.append((i, item["title"], artist, channel, item.get("result_type") or "video"))
+    return rows
+
+def classified_song(item: dict, row: tuple, flags: KeywordFlags, parsed: tuple):
+    is_no_guide, has_vocal = attributes_from_flags(flags)
+    title, artist, key = parsed
+    song = song_item(item.get("video_id") or "", title, artist, row[1], item.get("duration") or "00:00", row[3],
+                     row[4], is_no_guide, has_vocal, key)
+    return {"index": row[0], **song, "negative": flags.negative}
+
+def classify_records(records: List[dict]) -> List[dict]:
+    # Python から使う一括分類 (/api/classify と同じ処理)。
+    # records: {"title", "artist", "channel", "result_type", "video_id", "duration"} の dict (title 以外は省略可)。結果は入力順。
+    # ワーカーは spawn で起動するので、スクリプトから呼ぶ場合は if __name__ == "__main__": の中で呼ぶ
+    rows = classify_rows_for(records)
+    results = batch_classifier.classify(keyword_registry.get(), rows)
+    metrics.inc("classify_items_total", len(rows))
+    return [classified_song(records[index], rows[index], flags, parsed) for index, flags, parsed in results]
+
+async def classify_events(items: List[dict]):
+    rows = classify_rows_for(items)
+    async for chunk in batch_classifier.run_async(keyword_registry.get(), rows):
+        results = [classified_song(items[index], rows[index], flags, parsed) for index, flags, parsed in chunk]
+        metrics.inc("classify_items_total", len(results))
+        yield ndjson_line({"event": "results", "results": results})
+    yield ndjson_line({"event": "done", "count": len(rows)})
+
+@app.post("/api/classify")
+async def classify(request: ClassifyRequest):
+    if len(request.items) > CLASSIFY_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Too many items (max {CLASSIFY_MAX_ITEMS})")
+    items = [item.model_dump() for item in request.items]
+    if IS_LAMBDA:
+        body = b"".join([line async for line in classify_events(items)])
+        return Response(body, media_type=NDJSON_MEDIA_TYPE)
+    return StreamingResponse(classify_events(items), media_type=NDJSON_MEDIA_TYPE)
+
+# --- Prewarm ---
+# よく検索されるクエリを、利用者が来る前に通常の検索パイプラインで取得しておく。
+# 結果キャッシュ・解析済みメタデータ・サジェスト用カタログがすべて埋まる。上流へは PRIORITY_BACKGROUND で出す。
+
+def load_prewarm_queries(path: Optional[str]):
+    # 1行1クエリ。空行と # で始まる行は無視する
+    if not path: return []
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    except OSError as e:
+        print(f"Prewarm: cannot read {path} ({e})")
+        return []
+
+def top_queries(n: int):
+    ranked = sorted(popular_queries.values(), key=lambda x: x[0], reverse=True)
+    return [q for _, q in ranked[:n]]
+
+async def prewarm(queries: List[str], concurrency: int = PREWARM_CONCURRENCY, rate: float = PREWARM_RATE_PER_SEC,
+                  time_budget: float = PREWARM_BUDGET_SEC, stages=(0,), force: bool = False):
+    # 戻り値: 件数のレポート。fresh = TTL内のため省略、skipped = 時間切れで未着手
+    upstream_priority.set(PRIORITY_BACKGROUND)
+    started = time.monotonic()
+    deadline = started + time_budget
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    report = {"queries": 0, "refreshed": 0, "fresh": 0, "failed": 0, "skipped": 0}
+
+    unique = list({normalize_for_comparison(q): q for q in queries if normalize_for_comparison(q)}.values())
+    jobs = [(q, stage) for q in unique for stage in stages]
+    report["queries"] = len(jobs)
+
+    async def warm(q: str, stage: int):
+        async with semaphore:
+            if time.monotonic() >= deadline:
+                report["skipped"] += 1
+                return
+            cache_key = normalize_for_comparison(q) + (f"#{stage}" if stage else "")
+            _, cache_state = search_cache.get(cache_key)
+            if cache_state == "hit" and not force:
+                report["fresh"] += 1
+                return
+            try:
+                _, partial_result = await asyncio.wait_for(search_and_cache(cache_key, q, stage), timeout=max(deadline - time.monotonic(), 0.1))
+                outcome = "failed" if partial_result else "refreshed"
+            except Exception as e:
+                print(f"Prewarm Error ({q!r}): {e!r}")
+                outcome = "failed"
+            report[outcome] += 1
+
+    tasks = []
+    for i, (q, stage) in enumerate(jobs):
+        # rate 件/秒を超えないよう開始時刻をずらす
+        if rate > 0 and i: await asyncio.sleep(1 / rate)
+        if time.monotonic() >= deadline:
+            report["skipped"] += len(jobs) - i
+            break
+        tasks.append(asyncio.create_task(warm(q, stage)))
+    await asyncio.gather(*tasks)
+
+    for outcome in ("refreshed", "fresh", "failed", "skipped"):
+        if report[outcome]: metrics.inc("prewarm_queries_total", report[outcome], outcome=outcome)
+    report["elapsed_sec"] = round(time.monotonic() - started, 3)
+    return report
+
+def run_prewarm_job(options: dict):
+    # スケジュール実行 (EventBridge) 用: {"prewarm": {"top": 50, "budget": 20, ...}} のイベントで呼ばれる
+    queries = top_queries(int(options.get("top", PREWARM_TOP_N))) + load_prewarm_queries(options.get("seed_file", PREWARM_SEED_FILE))
+    queries += options.get("queries", [])
+    # Mangum と同じイベントループで実行し、閉じない。時間切れで残った single-flight のタスクや
+    # 呼び出し枠のタイマーは、このインスタンスの後続の検索がそのまま引き継ぐ
+    report = lambda_event_loop().run_until_complete(prewarm(
+        queries,
+        concurrency=int(options.get("concurrency", PREWARM_CONCURRENCY)),
+        rate=float(options.get("rate", PREWARM_RATE_PER_SEC)),
+        time_budget=float(options.get("budget", PREWARM_BUDGET_SEC)),
+        force=bool(options.get("force", False)),
+    ))
+    if catalog_index.snapshot_path: catalog_index.snapshot()
+    print(f"Prewarm: {json.dumps(report)}")
+    return report
+
+# --- Startup ---
+
+def warm_up():
+    # eager モード用: 上流クライアントの生成と、解析系のメモ (チャンネル→パーサ等) の事前計算
+    get_ytmusic()
+    matcher = keyword_registry.get()
+    for channel in TRUSTED_KARAOKE_CHANNELS:
+        matcher.match_channel(channel)
+        for result_type in ("song", "video"):
+            parse_metadata(f"{channel} / warm up", channel, channel, result_type)
+
+catalog_index = CatalogIndex(
+    normalize_for_comparison,
+    max_docs=CATALOG_MAX_DOCS,
+    snapshot_path=CATALOG_SNAPSHOT,
+    snapshot_interval=CATALOG_SNAPSHOT_SEC,
+)
+
+# 解析ルールが変わった古いレコードを捨てる
+metadata_store.purge_other_versions(metadata_rules_version())
+
+if STARTUP_MODE == "eager":
+    warm_up()
+
+mangum_handler = Mangum(app)
+lambda_loop = None
+
+def lambda_event_loop():
+    # handler の呼び出しで使うイベントループ。現在のループとして設定し、Mangum (get_event_loop) と prewarm で同じものを使い続ける
+    global lambda_loop
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    if lambda_loop is None or lambda_loop.is_closed():
+        lambda_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(lambda_loop)
+    return lambda_loop
 
-handler = Mangum(app)
\ No newline at end of file
+def handler(event, context):
+    lambda_event_loop()
+    if isinstance(event, dict) and "prewarm" in event:
+        return run_prewarm_job(event["prewarm"] or {})
+    return mangum_handler(event, context)
\ No newline at end of file
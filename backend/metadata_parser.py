@@ -0,0 +1,234 @@
+import re
+import hashlib
+from pathlib import Path
+
+# --- Metadata Parsing Rules ---
+# チャンネル (video) / アーティスト (song) ごとのタイトル解析ルール。
+# 正規表現と変換テーブルはすべて import 時に一度だけコンパイルし、
+# どのパーサを使うかはチャンネル名ごとにメモ化した辞書引きで決める。
+
+# このファイル (= 解析ルール) の内容ハッシュ。ルールを変えると保存済みの解析結果が自動で無効になる
+RULES_FINGERPRINT = hashlib.sha1(Path(__file__).read_bytes()).hexdigest()[:12]
+
+def clean_text(text: str):
+    if not text: return ""
+    return text.replace("　", " ").strip()
+
+# --- Compiled Patterns ---
+
+RE_GUIDE_LESS_KARAOKE = re.compile(r"[\[\(]ガイド.*?(?:無し|なし)カラオケ[\]\)]")
+RE_SLASH = re.compile(r"[/／]")
+RE_JP_BRACKET = re.compile(r"【.*?】")
+
+# ニコカラ
+RE_NICO_TAG = re.compile(r"【(?:ニコカラ|カラオケ).*?】")
+RE_NICO_NOISE = re.compile(r"(?i)[【\[\(]?(?:off\s*vocal|オフボーカル|karaoke|カラオケ|instrumental|インスト|guide|ガイド).*?[】\]\)]?")
+RE_NICO_BRACKETS = re.compile(r"(.*?)\s*《(.*?)》")
+NICO_BRACKET_NOISE = ("off vocal", "offvocal", "key", "キー", "guide", "ガイド", "karaoke", "カラオケ")
+
+# JOYSOUND
+RE_JOYSOUND_CHORUS = re.compile(r"「(.*?)」")
+
+# 歌っちゃ王 (video / song 共通)
+RE_UTACHA_KEY_PREFIX = re.compile(r"(?i)(?:Key|キー)\s*[:：]?\s*([+＋\-−–—ー－]?\d+)")
+RE_UTACHA_KEY_SUFFIX = re.compile(r"(?i)([+＋\-−–—ー－]?\d+)\s*(?:Key|キー)")
+RE_UTACHA_ARTIST = re.compile(r"[\[\(\【［（](?:原曲歌手|オリジナルアーティスト|オリジナル歌手)[:：](.*?)[\]\)\】］）]")
+KEY_SIGN_TABLE = str.maketrans("＋−–—ー－", "+-----")
+
+# EdKara
+RE_EDKARA_PREFIX = re.compile(r"^(?:練習用)?(?:Karaoke|カラオケ)[♬♪]*\s*", re.IGNORECASE)
+RE_EDKARA_PERFORMED = re.compile(r"[\(\[\【](?:Originally Performed by|Original Artist)[:\s]+(.*?)[\]\)\】]", re.IGNORECASE)
+RE_EDKARA_BRACKETS = re.compile(r"[\[\(\【].*?[\]\)\】]")
+RE_EDKARA_CUTOFF = re.compile(r"(?:【|\[|\(|Instrumental|Off Vocal)", re.IGNORECASE)
+RE_EDKARA_KARAOKE = re.compile(r"(?i)Karaoke[♬♪]*")
+
+# まねきねこ
+RE_MANEKINEKO_KEY = re.compile(r"([+-]?\d+KEY)")
+RE_MANEKINEKO_PERFORMED = re.compile(r"\[Originally Performed By (.*?)\]", re.IGNORECASE)
+RE_MANEKINEKO_TRAILING = re.compile(r"\[(.*?)\]$")
+
+# --- Shared Steps ---
+
+def strip_karaoke_labels(text: str):
+    text = text.replace("（カラオケ）", "").replace("(Karaoke)", "").replace("(Official)", "")
+    return RE_GUIDE_LESS_KARAOKE.sub("", text)
+
+def extract_utacha_key(text: str):
+    # 「キー+2」「-3Key」などを取り除き、"+2KEY" 形式に正規化する
+    match = RE_UTACHA_KEY_PREFIX.search(text)
+    if match:
+        text = RE_UTACHA_KEY_PREFIX.sub("", text)
+    else:
+        match = RE_UTACHA_KEY_SUFFIX.search(text)
+        if match:
+            text = RE_UTACHA_KEY_SUFFIX.sub("", text)
+    if not match: return text, None
+    return text, f"{match.group(1).translate(KEY_SIGN_TABLE)}KEY"
+
+def extract_utacha_artist(text: str):
+    match = RE_UTACHA_ARTIST.search(text)
+    if not match: return text, None
+    return RE_UTACHA_ARTIST.sub("", text), match.group(1).strip()
+
+def nico_clean(text: str):
+    if not text: return ""
+    text = RE_NICO_TAG.sub("", text)
+    text = RE_NICO_NOISE.sub("", text)
+    return text.replace("ニコカラ", "").strip()
+
+def extract_joysound_jp(text: str):
+    # "English(日本語)" の括弧内 (日本語表記) を優先する
+    if text.endswith(")") and "(" in text:
+        return text[text.rfind("(") + 1:-1]
+    return text
+
+# --- Parsers ---
+# いずれも (original_title, artist_from_api, channel_name) -> (title, artist, key)
+
+def parse_nicokara(original_title: str, artist_from_api: str, channel_name: str):
+    match_brackets = RE_NICO_BRACKETS.search(original_title)
+    if match_brackets and not any(n in match_brackets.group(2).lower() for n in NICO_BRACKET_NOISE):
+        title, artist = match_brackets.group(1), match_brackets.group(2)
+    elif RE_SLASH.search(original_title):
+        title, artist = RE_SLASH.split(original_title, 1)
+    else:
+        title, artist = original_title, ""
+    return nico_clean(title), nico_clean(artist), None
+
+def parse_joysound_video(original_title: str, artist_from_api: str, channel_name: str):
+    if "【合唱練習用】" in original_title:
+        match_chorus = RE_JOYSOUND_CHORUS.search(original_title)
+        title = match_chorus.group(1) if match_chorus else original_title.replace("【合唱練習用】", "").strip()
+        return title, "合唱練習用", None
+
+    temp = original_title.replace("【karaoke】", "").replace("【JOYSOUND】", "").strip()
+    if "/" in temp:
+        parts = temp.split("/", 1)
+        return extract_joysound_jp(parts[0].strip()), extract_joysound_jp(parts[1].strip()), None
+    return temp, "", None
+
+def parse_utacha_video(original_title: str, artist_from_api: str, channel_name: str):
+    temp_title = strip_karaoke_labels(RE_JP_BRACKET.sub("", original_title).strip())
+    temp_title, key = extract_utacha_key(temp_title)
+    temp_title, artist = extract_utacha_artist(temp_title)
+    if artist is not None:
+        return temp_title.strip(), artist, key
+
+    for sep in (" / ", "/"):
+        if sep in temp_title:
+            parts = temp_title.split(sep, 1)
+            return parts[0].strip(), parts[1].replace("[カラオケ]", "").strip(), key
+    return temp_title.strip(), "", key
+
+def parse_edkara_video(original_title: str, artist_from_api: str, channel_name: str):
+    temp_title = RE_EDKARA_PREFIX.sub("", original_title).strip()
+    match_performed = RE_EDKARA_PERFORMED.search(temp_title)
+    if match_performed:
+        title_part = temp_title.split(match_performed.group(0))[0]
+        return RE_EDKARA_BRACKETS.sub("", title_part).strip(), match_performed.group(1).strip(), None
+    if " - " in temp_title:
+        parts = temp_title.split(" - ", 1)
+        artist_candidate = parts[1].strip()
+        split_match = RE_EDKARA_CUTOFF.search(artist_candidate)
+        if split_match: artist_candidate = artist_candidate[:split_match.start()]
+        return parts[0].strip(), RE_EDKARA_KARAOKE.sub("", artist_candidate).strip(), None
+    if "/" in temp_title:
+        parts = temp_title.split("/", 1)
+        return parts[0].strip(), parts[1].strip(), None
+    return RE_JP_BRACKET.sub("", temp_title).strip(), "", None
+
+def parse_generic_video(original_title: str, artist_from_api: str, channel_name: str):
+    clean_t = strip_karaoke_labels(original_title)
+    if "/" in clean_t:
+        parts = clean_t.split("/", 1)
+        return parts[0], parts[1].replace("[カラオケ]", "").strip(), None
+    if " - " in clean_t:
+        parts = clean_t.split(" - ", 1)
+        return parts[0], parts[1], None
+    if any(k in channel_name for k in ("Official", "Music", "Records")):
+        return clean_t, channel_name, None
+    return clean_t, "", None
+
+def parse_manekineko_song(original_title: str, artist_from_api: str, channel_name: str):
+    temp_title = original_title
+    artist = artist_from_api
+    key = None
+    match_key = RE_MANEKINEKO_KEY.search(temp_title)
+    if match_key:
+        key = match_key.group(1); temp_title = RE_MANEKINEKO_KEY.sub("", temp_title)
+    match_artist_long = RE_MANEKINEKO_PERFORMED.search(temp_title)
+    if match_artist_long:
+        artist = match_artist_long.group(1).strip()
+        temp_title = RE_MANEKINEKO_PERFORMED.sub("", temp_title)
+    else:
+        match_artist_short = RE_MANEKINEKO_TRAILING.search(temp_title)
+        if match_artist_short:
+            artist = match_artist_short.group(1).strip()
+            temp_title = RE_MANEKINEKO_TRAILING.sub("", temp_title)
+    title = temp_title.replace("（カラオケ）", "").replace("(カラオケ)", "").strip()
+    return title, artist, key
+
+def parse_utacha_song(original_title: str, artist_from_api: str, channel_name: str):
+    temp_title, key = extract_utacha_key(original_title)
+    temp_title, artist = extract_utacha_artist(temp_title)
+    temp_title = temp_title.replace("（カラオケ）", "").replace("(カラオケ)", "")
+    title = RE_GUIDE_LESS_KARAOKE.sub("", temp_title).strip()
+    return title, artist if artist is not None else artist_from_api, key
+
+def parse_karaoke_artist_song(original_title: str, artist_from_api: str, channel_name: str):
+    if "/" in original_title:
+        parts = original_title.split("/", 1)
+        return parts[0], parts[1].replace("【カラオケ音源】", "").strip(), None
+    return original_title, artist_from_api, None
+
+def parse_passthrough(original_title: str, artist_from_api: str, channel_name: str):
+    return original_title, artist_from_api, None
+
+# --- Dispatch Table ---
+# (比較方法, 文字列, パーサ)。上から順に評価し、最初に一致したものを使う。
+# video はチャンネル名、song は API のアーティスト名で判定する。
+
+PARSER_RULES = {
+    "video": [
+        ("exact", "JOYSOUND CHANNEL", parse_joysound_video),
+        ("contains", "歌っちゃ王", parse_utacha_video),
+        ("contains", "EdKara", parse_edkara_video),
+        ("default", None, parse_generic_video),
+    ],
+    "song": [
+        ("contains", "まねきねこ", parse_manekineko_song),
+        ("contains", "Manekineko", parse_manekineko_song),
+        ("contains", "歌っちゃ王", parse_utacha_song),
+        ("contains", "カラオケ", parse_karaoke_artist_song),
+        ("contains", "Karaoke", parse_karaoke_artist_song),
+        ("default", None, parse_passthrough),
+    ],
+}
+
+PARSER_CACHE_MAX = 4096
+_parser_cache = {}
+
+def resolve_parser(result_type: str, name: str):
+    # 同じチャンネル名は何度も現れるので、判定結果を (result_type, name) で辞書にメモ化する
+    cache_key = (result_type, name)
+    parser = _parser_cache.get(cache_key)
+    if parser is not None: return parser
+
+    parser = parse_passthrough
+    for kind, needle, candidate in PARSER_RULES.get(result_type, ()):
+        if kind == "default" or (kind == "exact" and name == needle) or (kind == "contains" and needle in name):
+            parser = candidate
+            break
+    if len(_parser_cache) >= PARSER_CACHE_MAX: _parser_cache.clear()
+    _parser_cache[cache_key] = parser
+    return parser
+
+def select_parser(original_title: str, artist_from_api: str, channel_name: str, result_type: str):
+    if "ニコカラ" in original_title or "ニコカラ" in channel_name:
+        return parse_nicokara
+    return resolve_parser(result_type, channel_name if result_type == "video" else artist_from_api)
+
+def parse_metadata(original_title: str, artist_from_api: str, channel_name: str, result_type: str):
+    parser = select_parser(original_title, artist_from_api, channel_name, result_type)
+    title, artist, key = parser(original_title, artist_from_api, channel_name)
+    return clean_text(title), clean_text(artist), key
@@ -0,0 +1,136 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# --- Parsed Metadata Store ---
+# 解析済みの動画メタデータ (SongItem 相当 + スコアリング用のフラグ) を (video_id, result_type) 単位で保存する。
+# rules_version (解析ルールのハッシュ) が違う行は見つからなかった扱いになり、次の解析で上書きされる。
+# db_path を指定しない場合 (または開けない場合) はプロセス内 (:memory:) のみ。
+# 行数は max_entries まで。超えた分は書き込みの古いものから消す。
+
+# SQLite の1文あたりのプレースホルダ上限より十分小さく分割する
+LOOKUP_CHUNK = 400
+# 上限を超えた行の削除は、この行数を書き込むごとにまとめて行う
+PRUNE_EVERY_ROWS = 500
+
+class MetadataStore:
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = 20000):
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._rows_since_prune = 0
+        self._db = None
+        if db_path:
+            try:
+                self._db = self._open(db_path)
+            except sqlite3.Error as e:
+                print(f"MetadataStore: persistent store disabled, using memory ({e})")
+        if self._db is None:
+            try:
+                self._db = self._open(":memory:")
+            except sqlite3.Error as e:
+                print(f"MetadataStore: disabled ({e})")
+
+    @staticmethod
+    def _open(db_path: str):
+        db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        try:
+            if db_path != ":memory:":
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS video_metadata ("
+                " video_id TEXT NOT NULL, result_type TEXT NOT NULL, rules_version TEXT NOT NULL,"
+                " record TEXT NOT NULL, updated_at REAL NOT NULL,"
+                " PRIMARY KEY (video_id, result_type))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_video_metadata_updated_at ON video_metadata(updated_at)")
+        except sqlite3.Error:
+            db.close()
+            raise
+        return db
+
+    def get_many(self, keys: Iterable[Tuple[str, str]], rules_version: str) -> Dict[Tuple[str, str], dict]:
+        keys = list(dict.fromkeys(keys))
+        if not keys: return {}
+        video_ids = list({vid for vid, _ in keys})
+        wanted = set(keys)
+        found = {}
+        with self._lock:
+            if self._db is not None:
+                try:
+                    for i in range(0, len(video_ids), LOOKUP_CHUNK):
+                        chunk = video_ids[i:i + LOOKUP_CHUNK]
+                        rows = self._db.execute(
+                            f"SELECT video_id, result_type, record FROM video_metadata"
+                            f" WHERE rules_version = ? AND video_id IN ({','.join('?' * len(chunk))})",
+                            (rules_version, *chunk),
+                        ).fetchall()
+                        for vid, result_type, record in rows:
+                            if (vid, result_type) in wanted:
+                                found[(vid, result_type)] = json.loads(record)
+                except sqlite3.Error as e:
+                    print(f"MetadataStore: read failed ({e})")
+            self.hits += len(found)
+            self.misses += len(wanted) - len(found)
+        return found
+
+    def put_many(self, rows: List[Tuple[str, str, dict]], rules_version: str):
+        # rows: [(video_id, result_type, record)]
+        if not rows or self._db is None: return
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO video_metadata (video_id, result_type, rules_version, record, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    [(vid, result_type, rules_version, json.dumps(record, ensure_ascii=False), now) for vid, result_type, record in rows],
+                )
+                self._db.execute("COMMIT")
+            except sqlite3.Error as e:
+                print(f"MetadataStore: write failed ({e})")
+                try:
+                    self._db.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                return
+            self._rows_since_prune += len(rows)
+            if self._rows_since_prune >= PRUNE_EVERY_ROWS:
+                self._rows_since_prune = 0
+                self._prune()
+
+    def _prune(self):
+        # 新しい順に max_entries 行だけ残す
+        try:
+            self._db.execute(
+                "DELETE FROM video_metadata WHERE rowid IN ("
+                " SELECT rowid FROM video_metadata ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        except sqlite3.Error as e:
+            print(f"MetadataStore: prune failed ({e})")
+
+    def purge_other_versions(self, rules_version: str):
+        if self._db is None: return
+        with self._lock:
+            try:
+                self._db.execute("DELETE FROM video_metadata WHERE rules_version != ?", (rules_version,))
+            except sqlite3.Error as e:
+                print(f"MetadataStore: purge failed ({e})")
+            self._prune()
+
+    def clear(self):
+        if self._db is None: return
+        with self._lock:
+            self._db.execute("DELETE FROM video_metadata")
+
+    def stats(self) -> dict:
+        entries = 0
+        if self._db is not None:
+            with self._lock:
+                entries = self._db.execute("SELECT COUNT(*) FROM video_metadata").fetchone()[0]
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,149 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+# --- Search Result Cache ---
+# 1段目: プロセス内 LRU (TTL付き)
+# 2段目: SQLite ファイル (任意)。Lambda の /tmp に置けばウォームスタート間・ローカル再起動後も残る
+#        WAL モードなので、同じファイルを複数プロセス (run_local.py --workers) で共有できる
+#
+# get() の戻り値の状態:
+#   "hit"   ... TTL内
+#   "stale" ... TTL切れだが stale 期間内 (そのまま返し、裏で再取得する)
+#   "miss"  ... なし / stale 期間も過ぎた
+# 期限を過ぎたエントリも LRU から押し出されるまでは残し、上流が使えないときの代替 (get_any) に使う
+
+class SearchCache:
+    def __init__(self, max_entries: int = 512, ttl: float = 300, stale_ttl: float = 3600,
+                 db_path: Optional[str] = None, db_max_entries: int = 5000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.db_max_entries = db_max_entries
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_writes = 0
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS search_cache ("
+                    " key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_stored_at ON search_cache(stored_at)")
+            except sqlite3.Error as e:
+                print(f"SearchCache: persistent tier disabled ({e})")
+                self._db = None
+
+    def _state(self, stored_at: float, now: float) -> str:
+        age = now - stored_at
+        if age <= self.ttl: return "hit"
+        if age <= self.ttl + self.stale_ttl: return "stale"
+        return "miss"
+
+    def _count(self, state: str):
+        if state == "hit": self.hits += 1
+        elif state == "stale": self.stale_hits += 1
+        else: self.misses += 1
+
+    def get(self, key: str) -> Tuple[Optional[Any], str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                state = self._state(entry[0], now)
+                if state == "hit" or (state == "stale" and self._db is None):
+                    self._entries.move_to_end(key)
+                    self._count(state)
+                    return entry[1], state
+
+            row = self._db_get(key)
+            # 別プロセスが取り直していればそちらが新しい
+            if entry is not None and (row is None or row[0] < entry[0]): row = entry
+            if row is not None:
+                stored_at, value = row
+                state = self._state(stored_at, now)
+                if state != "miss":
+                    self._put_memory(key, stored_at, value)
+                    self._count(state)
+                    return value, state
+
+            self._count("miss")
+            return None, "miss"
+
+    def get_any(self, key: str) -> Tuple[Optional[Any], Optional[float]]:
+        # 期限に関係なく、残っている最新の値と保存からの経過秒数を返す (ヒット率には数えない)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                row = self._db_get(key)
+                if row is None: return None, None
+                entry = row
+            return entry[1], now - entry[0]
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, now, value)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO search_cache (key, value, stored_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False), now),
+                    )
+                    self._db_writes += 1
+                    if self._db_writes % 100 == 0:
+                        self._db.execute(
+                            "DELETE FROM search_cache WHERE key NOT IN ("
+                            " SELECT key FROM search_cache ORDER BY stored_at DESC LIMIT ?)",
+                            (self.db_max_entries,),
+                        )
+                except sqlite3.Error as e:
+                    print(f"SearchCache: write failed ({e})")
+
+    def _put_memory(self, key: str, stored_at: float, value: Any):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _db_get(self, key: str):
+        if self._db is None: return None
+        try:
+            row = self._db.execute(
+                "SELECT stored_at, value FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"SearchCache: read failed ({e})")
+            return None
+        if row is None: return None
+        return row[0], json.loads(row[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM search_cache")
+                except sqlite3.Error as e:
+                    print(f"SearchCache: clear failed ({e})")
+
+    def stats(self) -> dict:
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / total if total else 0.0,
+        }
@@ -0,0 +1,53 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+# --- Single Flight ---
+# 同じキーの処理が実行中なら新たに始めず、その結果を共有して待つ (リクエストの合流)。
+# 処理は独立したタスクで動かすので、先頭のリクエストが切断されても待機中の側には影響しない。
+
+class SingleFlightOverflow(Exception):
+    pass
+
+class SingleFlight:
+    def __init__(self, max_waiters: int = 64):
+        self.max_waiters = max_waiters
+        self.leaders = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]):
+        task = self._tasks.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda _: self._forget(key, task))
+            return await asyncio.shield(task)
+
+        # max_waiters は同時に待っている数の上限 (待ち終わった・切断した分は数えない)
+        if self._waiters[key] >= self.max_waiters:
+            self.rejected += 1
+            raise SingleFlightOverflow(key)
+        self.coalesced += 1
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self._tasks.get(key) is task: self._waiters[key] -= 1
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+            del self._waiters[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._tasks),
+            "waiting": sum(self._waiters.values()),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+        }
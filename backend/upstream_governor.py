@@ -0,0 +1,134 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from typing import List, Optional, Tuple, Union
+
+# --- Upstream Governor ---
+# 上流 (YouTube Music) への呼び出し回数をトークンバケットで制限する。
+#   - rate 回/秒でトークンが補充され、最大 burst 個まで貯まる。1呼び出しで1個使う
+#   - トークンがなければ優先度順 (数値が小さいほど先) のキューで待つ。同じ優先度は到着順
+#   - キューが max_queue を超える、または max_wait 秒待っても順番が来なければ UpstreamThrottled
+# 優先度は呼び出し元のコンテキスト (upstream_priority) から取る。裏で動く処理は PRIORITY_BACKGROUND にする。
+# 複数の呼び出し元が合流した処理 (single-flight) は SharedPriority を置き、待っている中で最も高い優先度で並ぶ。
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+class SharedPriority:
+    def __init__(self, value: int):
+        self.value = value
+
+    def raise_to(self, value: int):
+        if value < self.value: self.value = value
+
+def priority_value(priority: Union[int, SharedPriority]) -> int:
+    return priority.value if isinstance(priority, SharedPriority) else priority
+
+upstream_priority: contextvars.ContextVar[Union[int, SharedPriority]] = contextvars.ContextVar("upstream_priority", default=PRIORITY_INTERACTIVE)
+
+class UpstreamThrottled(Exception):
+    pass
+
+class UpstreamGovernor:
+    def __init__(self, rate: float, burst: int, max_queue: int = 100, max_wait: float = 2.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.granted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future, Optional[SharedPriority]]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_loop = None
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        # 待っている呼び出しがなく、トークンが残っていればすぐに使う (ヘッジなど待てない呼び出し用)
+        if not self.enabled: return True
+        self._refill()
+        self._prune()
+        if self._waiters or self.tokens < 1: return False
+        self.tokens -= 1
+        self.granted += 1
+        return True
+
+    async def acquire(self, priority: Union[int, SharedPriority, None] = None):
+        if self.try_acquire(): return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise UpstreamThrottled("upstream queue is full")
+
+        if priority is None: priority = upstream_priority.get()
+        shared = priority if isinstance(priority, SharedPriority) else None
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority_value(priority), next(self._seq), future, shared))
+        self.queued += 1
+        self._schedule()
+        try:
+            await asyncio.wait_for(future, timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise UpstreamThrottled(f"waited {self.max_wait}s for an upstream slot")
+
+    def _schedule(self):
+        # 次のトークンが貯まる時刻に _release を呼ぶ (ループが変わった場合は張り直す)
+        loop = asyncio.get_running_loop()
+        if self._timer is not None and self._timer_loop is loop: return
+        if not self._waiters: return
+        self._refill()
+        delay = max(0.0, (1 - self.tokens) / self.rate)
+        self._timer = loop.call_later(delay, self._release)
+        self._timer_loop = loop
+
+    def _release(self):
+        self._timer = None
+        self._refill()
+        self._reprioritize()
+        while self._waiters and self.tokens >= 1:
+            _, _, future, _ = heapq.heappop(self._waiters)
+            if future.done(): continue # 待ち時間切れ
+            self.tokens -= 1
+            self.granted += 1
+            future.set_result(None)
+        self._prune()
+        if self._waiters: self._schedule()
+
+    def _reprioritize(self):
+        # 待っている間に合流した呼び出しで優先度が上がったものを並べ直す
+        changed = False
+        for i, (priority, seq, future, shared) in enumerate(self._waiters):
+            if shared is not None and shared.value != priority:
+                self._waiters[i] = (shared.value, seq, future, shared)
+                changed = True
+        if changed: heapq.heapify(self._waiters)
+
+    def _prune(self):
+        # 待ち時間切れで終わった先頭の待機を取り除く
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "tokens": self.tokens,
+            "waiting": sum(1 for _, _, future, _ in self._waiters if not future.done()),
+            "granted": self.granted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
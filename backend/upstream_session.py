@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional
+
+# --- Upstream Session ---
+# YTMusic の下で使う HTTP セッションと、上流呼び出しのレイテンシ統計・ヘッジ (投機的な再送)。
+#   - keep-alive のコネクションプールをワーカースレッド数に合わせて確保し、接続/読み取りのタイムアウトを既定で付ける
+#   - 呼び出し種別ごとに直近のレイテンシを保持し、p50 / p95 / p99 を出す
+#   - ヘッジ: 1回目が p95 を超えても返らなければ同じ呼び出しをもう1本出し、先に返った方を使う
+
+def build_session(pool_size: int, connect_timeout: float, read_timeout: float):
+    # requests の import はコールドスタートに効くので、最初に YTMusic を作るとき (ワーカースレッド側) まで遅らせる
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class TimeoutHTTPAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            if kwargs.get("timeout") is None:
+                kwargs["timeout"] = (connect_timeout, read_timeout)
+            return super().send(request, **kwargs)
+
+    session = requests.Session()
+    # リトライは呼び出し側 (ヘッジ・キャッシュへのフォールバック) で扱うので、ここでは行わない
+    adapter = TimeoutHTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class LatencyTracker:
+    def __init__(self, window: int = 512, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        # サンプルが少ないうちは None (ヘッジの閾値に使わない)
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None or len(samples) < self.min_samples: return None
+            ordered = sorted(samples)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            names = list(self._samples)
+        result = {}
+        for name in names:
+            with self._lock:
+                ordered = sorted(self._samples[name])
+            if not ordered: continue
+            pick = lambda q: ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+            result[name] = {"count": len(ordered), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)}
+        return result
+
+def consume_result(future: asyncio.Future):
+    # 結果を使わなかった側の例外が "never retrieved" として記録されないようにする
+    if not future.cancelled(): future.exception()
+
+async def hedged_call(executor, fn: Callable, hedge_after: Optional[float], can_hedge: Optional[Callable[[], bool]] = None):
+    # 戻り値: (result, hedge)。hedge は None (出していない) / "won" (2本目が先) / "lost" (1本目が先)
+    # can_hedge は2本目を出す直前に確認する (上流の呼び出し枠が残っているか等)
+    # 実行中のスレッドは止められないので、負けた側の結果は捨てるだけ
+    loop = asyncio.get_running_loop()
+    first = loop.run_in_executor(executor, fn)
+    first.add_done_callback(consume_result)
+    if hedge_after is None:
+        return await first, None
+    done, _ = await asyncio.wait({first}, timeout=hedge_after)
+    if done or (can_hedge is not None and not can_hedge()):
+        return await first, None
+
+    second = loop.run_in_executor(executor, fn)
+    second.add_done_callback(consume_result)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result(), "won" if future is second else "lost"
+            error = future.exception()
+    raise error
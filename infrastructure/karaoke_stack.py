@@ -14,6 +14,8 @@ from aws_cdk import (
     aws_route53 as route53,
     aws_route53_targets as targets,
     aws_wafv2 as wafv2,
+    aws_events as events,
+    aws_events_targets as events_targets,
 )
 from constructs import Construct
 import os
@@ -78,6 +80,14 @@ class KaraokeStack(Stack):
             ),
             timeout=Duration.seconds(30), # YouTube検索は少し時間がかかる場合があるため
             memory_size=256,
+            environment={
+                # 検索結果キャッシュの永続層 (/tmp はウォームスタート間で保持される)
+                "SEARCH_CACHE_DB": "/tmp/search_cache.sqlite3",
+                # 解析済みの動画メタデータ (video_id 単位)
+                "METADATA_STORE_DB": "/tmp/metadata.sqlite3",
+                # サジェスト (/api/suggest) 用カタログのスナップショット
+                "CATALOG_SNAPSHOT": "/tmp/catalog.json.gz",
+            },
         )
 
         # ---------------------------------------------------------
@@ -189,6 +199,28 @@ class KaraokeStack(Stack):
             ]
         )
 
+        api_origin = origins.HttpOrigin(
+            f"{http_api.api_id}.execute-api.{self.region}.amazonaws.com",
+            origin_path=""
+        )
+
+        # /api/search 用のキャッシュポリシー
+        # キーは検索条件のクエリ文字列のみ (ヘッダ・Cookie は含めない)。playlist_id は type=playlist の取り込み用、
+        # exclude は利用者ごとの除外フィルタ (保存済み・ブロック済みの動画)。
+        # default_ttl=0 なので、Cache-Control のないレスポンス (エラー等) はキャッシュされない
+        search_cache_policy = cloudfront.CachePolicy(self, "SearchCachePolicy",
+            cache_policy_name=f"{config['stack_name']}-search",
+            comment="Cache /api/search by query string only",
+            min_ttl=Duration.seconds(0),
+            default_ttl=Duration.seconds(0),
+            max_ttl=Duration.minutes(10),
+            query_string_behavior=cloudfront.CacheQueryStringBehavior.allow_list("q", "page_token", "type", "playlist_id", "exclude"),
+            header_behavior=cloudfront.CacheHeaderBehavior.none(),
+            cookie_behavior=cloudfront.CacheCookieBehavior.none(),
+            enable_accept_encoding_gzip=True,
+            enable_accept_encoding_brotli=True,
+        )
+
         distribution = cloudfront.Distribution(self, "SiteDistribution",
             domain_names=[full_domain],
             certificate=certificate,
@@ -211,16 +243,26 @@ class KaraokeStack(Stack):
                     response_http_status=403,
                     response_page_path="/403.html",
                     ttl=Duration.seconds(0)
-                )
+                ),
+                # API のエラー (上流の失敗・過負荷) はエッジでキャッシュしない
+                *[
+                    cloudfront.ErrorResponse(http_status=status, ttl=Duration.seconds(0))
+                    for status in (500, 502, 503, 504)
+                ]
             ],
             
             # /api/* の挙動: API Gatewayへ (Backend)
             additional_behaviors={
+                # 検索はクエリ文字列だけをキーにエッジでキャッシュする (期間はバックエンドの Cache-Control に従う)
+                "/api/search": cloudfront.BehaviorOptions(
+                    origin=api_origin,
+                    viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+                    cache_policy=search_cache_policy,
+                    allowed_methods=cloudfront.AllowedMethods.ALLOW_GET_HEAD_OPTIONS,
+                    origin_request_policy=cloudfront.OriginRequestPolicy.ALL_VIEWER_EXCEPT_HOST_HEADER
+                ),
                 "/api/*": cloudfront.BehaviorOptions(
-                    origin=origins.HttpOrigin(
-                        f"{http_api.api_id}.execute-api.{self.region}.amazonaws.com",
-                        origin_path="" 
-                    ),
+                    origin=api_origin,
                     viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
                     cache_policy=cloudfront.CachePolicy.CACHING_DISABLED,
                     allowed_methods=cloudfront.AllowedMethods.ALLOW_ALL,
@@ -247,4 +289,18 @@ class KaraokeStack(Stack):
             destination_bucket=frontend_bucket,
             distribution=distribution, # キャッシュ無効化のためDistributionを指定
             distribution_paths=["/*"], # 全ファイルのキャッシュをクリア
-        )
\ No newline at end of file
+        )
+
+        # ---------------------------------------------------------
+        # 8. Prewarm Schedule (任意)
+        # ---------------------------------------------------------
+        # 定期的に人気クエリの検索キャッシュを取得しておく (main.handler が {"prewarm": {...}} を処理する)
+        prewarm_interval = config.get("prewarm_interval_minutes", 0)
+        if prewarm_interval:
+            events.Rule(self, "PrewarmSchedule",
+                schedule=events.Schedule.rate(Duration.minutes(prewarm_interval)),
+                targets=[events_targets.LambdaFunction(
+                    backend_lambda,
+                    event=events.RuleTargetInput.from_object({"prewarm": {}}),
+                )],
+            )
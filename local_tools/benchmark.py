@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from pathlib import Path
+
+# オフラインのベンチマーク (ネットワーク不要)
+#
+#   python local_tools/benchmark.py                          # 実行して表示
+#   python local_tools/benchmark.py --output before.json     # 結果を保存
+#   python local_tools/benchmark.py --compare before.json    # 保存済みの結果と比較
+#
+# 上流は fake_ytmusic.FakeYTMusic (記録済みレスポンス) に差し替える。
+# 各ベンチは repeat 回計測し、1操作あたりの中央値と最小値 (µs) を出す。
+
+current_dir = Path(__file__).resolve().parent
+project_root = current_dir.parent
+sys.path.append(str(project_root / "backend"))
+sys.path.append(str(current_dir))
+
+# 永続キャッシュなどの環境依存を切ってから main を読み込む
+for env_name in ("SEARCH_CACHE_DB", "METADATA_STORE_DB", "KEYWORDS_CONFIG", "SEARCH_PROFILE_SAMPLE_RATE", "UPSTREAM_BURST"):
+    os.environ.pop(env_name, None)
+# 上流の呼び出し枠 (upstream_governor) を切る。入れたままだとトークンの補充待ちを測ってしまう
+os.environ["UPSTREAM_RATE_PER_SEC"] = "0"
+
+import main
+from fake_ytmusic import FakeYTMusic, load_fixtures
+
+def measure(fn, number: int, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number * 1e6)
+    return {"median_us": statistics.median(samples), "min_us": min(samples), "number": number, "repeat": repeat}
+
+def corpus_items(fixtures):
+    # search() と同じ形で (title, api_artist, channel, result_type) を取り出す
+    items = []
+    for filters in fixtures.values():
+        for filter_name, result_type in (("songs", "song"), ("videos", "video")):
+            for item in filters.get(filter_name, []):
+                artists = item.get("artists", [])
+                api_artist = artists[0]["name"] if artists else ""
+                items.append((item.get("title", ""), api_artist, api_artist or "YouTube Music", result_type))
+    return items
+
+def micro_benchmarks(fixtures, repeat: int):
+    items = corpus_items(fixtures)
+    queries = [q.rsplit(" ", 1)[0] for q in fixtures]
+    n = len(items)
+    print(f"Corpus: {n} items / {len(queries)} queries")
+
+    def run_parse():
+        for title, artist, channel, result_type in items:
+            main.parse_metadata(title, artist, channel, result_type)
+
+    def run_attributes():
+        for title, _, channel, _ in items:
+            main.determine_attributes(title, channel)
+
+    def run_relevance():
+        for q in queries:
+            for title, artist, _, _ in items:
+                main.calculate_relevance_score(q, title, artist, title)
+
+    def run_normalize():
+        for title, _, _, _ in items:
+            main.normalize_for_comparison(title)
+
+    results = {}
+    for name, fn, per_call in (
+        ("parse_metadata", run_parse, n),
+        ("determine_attributes", run_attributes, n),
+        ("calculate_relevance_score", run_relevance, n * len(queries)),
+        ("normalize_for_comparison", run_normalize, n),
+    ):
+        r = measure(fn, number=20, repeat=repeat)
+        # 1アイテムあたりに換算する
+        results[name] = {**r, "median_us": r["median_us"] / per_call, "min_us": r["min_us"] / per_call}
+    return results
+
+def e2e_benchmarks(fixtures, repeat: int):
+    from fastapi.testclient import TestClient
+    main.ytmusic = FakeYTMusic(fixtures)
+    client = TestClient(main.app)
+    queries = [q.rsplit(" ", 1)[0] for q in fixtures]
+
+    def search_uncached():
+        for q in queries:
+            main.search_cache.clear()
+            main.metadata_store.clear()
+            client.get("/api/search", params={"q": q})
+
+    def search_known_videos():
+        # 結果キャッシュは外れるが、動画の解析結果は保存済みの状態
+        for q in queries:
+            main.search_cache.clear()
+            client.get("/api/search", params={"q": q})
+
+    def search_cached():
+        for q in queries:
+            client.get("/api/search", params={"q": q})
+
+    search_cached()
+    results = {}
+    for name, fn in (
+        ("api_search_uncached", search_uncached),
+        ("api_search_known_videos", search_known_videos),
+        ("api_search_cached", search_cached),
+    ):
+        r = measure(fn, number=5, repeat=repeat)
+        results[name] = {**r, "median_us": r["median_us"] / len(queries), "min_us": r["min_us"] / len(queries)}
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_root,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    print(f"{'benchmark':<30} {'median µs':>12} {'min µs':>12}" + (f" {'vs base':>10}" if baseline else ""))
+    for name, r in results.items():
+        line = f"{name:<30} {r['median_us']:>12.2f} {r['min_us']:>12.2f}"
+        if baseline and name in baseline:
+            base = baseline[name]["median_us"]
+            line += f" {(r['median_us'] - base) / base * 100:>+9.1f}%"
+        print(line)
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--skip-e2e", action="store_true", help="/api/search の計測を省略する")
+    parser.add_argument("--output", help="結果を JSON で保存するパス")
+    parser.add_argument("--compare", help="比較対象の結果 JSON")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    results = micro_benchmarks(fixtures, args.repeat)
+    if not args.skip_e2e:
+        results.update(e2e_benchmarks(fixtures, args.repeat))
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"Saved: {args.output}")
+
+if __name__ == "__main__":
+    main_cli()
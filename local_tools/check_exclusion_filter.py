@@ -0,0 +1,108 @@
+import re
+import sys
+import json
+import base64
+import hashlib
+import argparse
+import subprocess
+from pathlib import Path
+
+# フロントエンド (frontend/index.html の buildExclusionFilter) が作った除外フィルタを、
+# バックエンドの ExclusionFilter がそのまま読めることを確かめる
+#
+#   python local_tools/check_exclusion_filter.py           # 検証
+#   python local_tools/check_exclusion_filter.py --update  # buildExclusionFilter を変えた後に正解を作り直す (node が必要)
+#
+# 正解 (fixtures/exclusion_filters.json) はケース名 -> buildExclusionFilter の出力。
+# 各ケースについて、parse できること・入力の動画が全て含まれること・encode と from_ids が同じ文字列になること・
+# 偽陽性が想定 (1%) から大きく外れないこと (件数の少ないケース・上限で切り詰めたケースを除く) を見る。
+
+current_dir = Path(__file__).resolve().parent
+project_root = current_dir.parent
+sys.path.append(str(project_root / "backend"))
+
+from exclusion_filter import ExclusionFilter
+
+FIXTURE_PATH = current_dir / "fixtures" / "exclusion_filters.json"
+FRONTEND_PATH = project_root / "frontend" / "index.html"
+MAX_BYTES = 4096 # main.EXCLUDE_FILTER_MAX_BYTES / フロントエンドの EXCLUDE_FILTER_MAX_BYTES の既定値
+MAX_FALSE_POSITIVE_RATE = 0.03
+
+def synthetic_ids(n: int, prefix: str):
+    # 実際の video_id と同じ 11 文字の [A-Za-z0-9_-]
+    return [base64.urlsafe_b64encode(hashlib.sha1(f"{prefix}{i}".encode()).digest()).decode()[:11] for i in range(n)]
+
+CASES = {
+    "single": ["dQw4w9WgXcQ"],
+    "few": ["dQw4w9WgXcQ", "x8VYWazR5mE", "ZRtdQ81jPUQ", "-9tL0W_hq3M", "a_b-c_d-e_f"],
+    "duplicates": ["dQw4w9WgXcQ", "dQw4w9WgXcQ", "", "x8VYWazR5mE"],
+    "library_50": synthetic_ids(50, "library"),
+    "library_1000": synthetic_ids(1000, "library"),
+    # 上限 (4096 バイト) で切り詰められるサイズ
+    "capped_5000": synthetic_ids(5000, "library"),
+}
+
+def unique_ids(ids):
+    return [vid for vid in dict.fromkeys(ids) if vid]
+
+def build_with_frontend(cases: dict):
+    # index.html から buildExclusionFilter (と依存する定数・関数) を取り出して node で実行する
+    html = FRONTEND_PATH.read_text(encoding="utf-8")
+    start = html.index("const EXCLUDE_FILTER_MAX_BYTES")
+    end = re.compile(r"^ *\};$", re.M).search(html, html.index("const buildExclusionFilter")).end()
+    script = html[start:end] + """
+const cases = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+console.log(JSON.stringify(Object.fromEntries(Object.entries(cases).map(([name, ids]) => [name, buildExclusionFilter(ids)]))));
+"""
+    proc = subprocess.run(["node", "-e", script], input=json.dumps(cases), capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--update", action="store_true", help="buildExclusionFilter の出力で正解を書き換える")
+    args = parser.parse_args()
+
+    if args.update:
+        filters = build_with_frontend(CASES)
+        FIXTURE_PATH.write_text(json.dumps(filters, indent=1) + "\n", encoding="utf-8")
+        print(f"Updated {len(filters)} filters: {FIXTURE_PATH}")
+        return
+
+    filters = json.loads(FIXTURE_PATH.read_text(encoding="utf-8"))
+    others = synthetic_ids(20000, "other")
+    failures = 0
+    for name, ids in CASES.items():
+        encoded = filters[name]
+        ids = unique_ids(ids)
+        try:
+            excluded = ExclusionFilter.parse(encoded, MAX_BYTES)
+        except ValueError as e:
+            print(f"NG: {name}: parse failed ({e})")
+            failures += 1
+            continue
+        missing = [vid for vid in ids if vid not in excluded]
+        false_positive_rate = sum(vid in excluded for vid in others) / len(others)
+        capped = len(excluded.bits) == MAX_BYTES
+        problems = []
+        if missing: problems.append(f"{len(missing)} ids missing, e.g. {missing[:3]}")
+        if excluded.encode() != encoded: problems.append("encode() differs")
+        if ExclusionFilter.from_ids(ids, max_bytes=MAX_BYTES).encode() != encoded: problems.append("from_ids() differs")
+        # 数件のフィルタはバイト単位の切り上げで偽陽性がぶれるので、ある程度の件数からだけ見る
+        if len(ids) >= 50 and not capped and false_positive_rate > MAX_FALSE_POSITIVE_RATE: problems.append(f"false positive rate {false_positive_rate:.2%}")
+        failures += bool(problems)
+        detail = f"{len(ids)} ids, {len(excluded.bits)} bytes, k={excluded.hashes}, false positives {false_positive_rate:.2%}"
+        print(f"{'NG' if problems else 'OK'}: {name} ({detail}){': ' + '; '.join(problems) if problems else ''}")
+
+    for encoded in ("", "2.3.AAAA", "1.0.AAAA", "1.17.AAAA", "1.3.", "1.3.!!!!", "1.3." + "A" * (MAX_BYTES * 2)):
+        try:
+            ExclusionFilter.parse(encoded, MAX_BYTES)
+            print(f"NG: malformed filter {encoded[:20]!r} was accepted")
+            failures += 1
+        except ValueError:
+            pass
+
+    print("All checks passed" if not failures else f"{failures} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import sys
+import json
+import argparse
+from pathlib import Path
+
+# parse_metadata / determine_attributes の出力を正解コーパス (golden) と突き合わせる
+#
+#   python local_tools/check_parse_metadata.py           # 検証
+#   python local_tools/check_parse_metadata.py --update  # 意図した変更の後に正解を更新
+#
+# コーパスの各行: [original_title, api_artist, result_type, title, artist, key, is_no_guide, has_vocal]
+# channel は search() と同じく api_artist が空なら "YouTube Music" とする
+
+current_dir = Path(__file__).resolve().parent
+project_root = current_dir.parent
+sys.path.append(str(project_root / "backend"))
+
+GOLDEN_PATH = current_dir / "fixtures" / "parse_metadata_golden.json"
+
+def evaluate(row):
+    from main import parse_metadata, determine_attributes
+    original_title, api_artist, result_type = row[:3]
+    channel = api_artist if api_artist else "YouTube Music"
+    title, artist, key = parse_metadata(original_title, api_artist, channel, result_type)
+    is_no_guide, has_vocal = determine_attributes(original_title, channel)
+    return [original_title, api_artist, result_type, title, artist, key, is_no_guide, has_vocal]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--update", action="store_true", help="現在の出力で正解コーパスを書き換える")
+    args = parser.parse_args()
+
+    rows = json.loads(GOLDEN_PATH.read_text(encoding="utf-8"))
+    results = [evaluate(row) for row in rows]
+
+    if args.update:
+        body = ",\n".join(json.dumps(r, ensure_ascii=False) for r in results)
+        GOLDEN_PATH.write_text(f"[\n{body}\n]\n", encoding="utf-8")
+        print(f"Updated {len(results)} rows: {GOLDEN_PATH}")
+        return
+
+    mismatches = [(expected, got) for expected, got in zip(rows, results) if expected != got]
+    for expected, got in mismatches[:20]:
+        print(f"MISMATCH {expected[:3]}")
+        print(f"  expected: {expected[3:]}")
+        print(f"  got:      {got[3:]}")
+    print(f"{len(rows) - len(mismatches)}/{len(rows)} rows match")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import gzip
+import json
+import base64
+from pathlib import Path
+
+# Lambda の同じインスタンスで、時間切れになった prewarm の後の検索が壊れないことを確かめる
+#
+#   python local_tools/check_prewarm_handler.py
+#
+# 上流 (FakeYTMusic) を遅くし、呼び出し枠も絞って prewarm を予算内に終わらせない
+# (同じクエリの single-flight と、呼び出し枠の待機が残った状態になる)。
+# その後、同じクエリの検索を API Gateway 形式のイベントで main.handler に送り、200 で結果が返ることを見る。
+
+current_dir = Path(__file__).resolve().parent
+project_root = current_dir.parent
+sys.path.append(str(project_root / "backend"))
+sys.path.append(str(current_dir))
+
+for env_name in ("SEARCH_CACHE_DB", "METADATA_STORE_DB", "CATALOG_SNAPSHOT", "KEYWORDS_CONFIG", "SEARCH_PROFILE_SAMPLE_RATE"):
+    os.environ.pop(env_name, None)
+os.environ["UPSTREAM_RATE_PER_SEC"] = "2"
+os.environ["UPSTREAM_BURST"] = "1"
+os.environ["UPSTREAM_QUEUE_WAIT_SEC"] = "5"
+
+import main
+from fake_ytmusic import FakeYTMusic
+from load_test import api_gateway_event
+
+QUERY = "マリーゴールド"
+
+def search(q: str):
+    res = main.handler(api_gateway_event("/api/search", {"q": q}), None)
+    body = res.get("body") or ""
+    body = base64.b64decode(body) if res.get("isBase64Encoded") else body.encode()
+    headers = {k.lower(): v for k, v in (res.get("headers") or {}).items()}
+    if headers.get("content-encoding") == "gzip": body = gzip.decompress(body)
+    return res["statusCode"], body
+
+def main_cli():
+    main.ytmusic = FakeYTMusic(latency=0.5)
+    report = main.handler({"prewarm": {"queries": [QUERY, f"{QUERY} ライブ"], "top": 0, "seed_file": "",
+                                       "budget": 0.3, "rate": 0, "concurrency": 2}}, None)
+    print(f"prewarm: {json.dumps(report)}")
+    failures = 0
+    if report.get("failed", 0) + report.get("skipped", 0) == 0:
+        print("NG: prewarm finished within the budget (nothing left in flight)")
+        failures += 1
+
+    for attempt in range(2):
+        status, body = search(QUERY)
+        results = json.loads(body).get("results") if status == 200 else None
+        ok = status == 200 and bool(results)
+        failures += not ok
+        print(f"{'OK' if ok else 'NG'}: search #{attempt + 1} -> {status} ({len(results) if results else 0} results)")
+
+    print("All checks passed" if not failures else f"{failures} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main_cli()
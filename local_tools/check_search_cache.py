@@ -0,0 +1,81 @@
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+# SearchCache (検索結果キャッシュ) の期限・LRU・SQLite 層の動きを確かめる
+#
+#   python local_tools/check_search_cache.py
+#
+# TTL / stale は短い値 (0.2秒) にして実際に待つ。SQLite 層は一時ディレクトリに作り、
+# 2つのインスタンス (= run_local.py --workers の2プロセス) で同じファイルを共有させる。
+
+current_dir = Path(__file__).resolve().parent
+project_root = current_dir.parent
+sys.path.append(str(project_root / "backend"))
+
+from search_cache import SearchCache
+
+TTL = 0.2
+failures = 0
+
+def check(name: str, ok: bool, detail=""):
+    global failures
+    failures += not ok
+    print(f"{'OK' if ok else 'NG'}: {name}{f' ({detail})' if detail else ''}")
+
+def check_ttl():
+    cache = SearchCache(ttl=TTL, stale_ttl=TTL)
+    cache.set("q", {"results": [1]})
+    value, state = cache.get("q")
+    check("fresh entry is a hit", state == "hit" and value == {"results": [1]}, state)
+    time.sleep(TTL * 1.5)
+    value, state = cache.get("q")
+    check("entry past ttl is stale", state == "stale" and value is not None, state)
+    time.sleep(TTL)
+    value, state = cache.get("q")
+    check("entry past ttl + stale_ttl is a miss", state == "miss" and value is None, state)
+    value, age = cache.get_any("q")
+    check("get_any still returns the expired entry", value == {"results": [1]} and age > TTL * 2, f"age={age}")
+    stats = cache.stats()
+    check("hit / stale / miss are counted", (stats["hits"], stats["stale_hits"], stats["misses"]) == (1, 1, 1), stats)
+
+def check_lru():
+    cache = SearchCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    check("least recently used entry is evicted", [cache.get(k)[0] for k in ("a", "b", "c")] == [1, None, 3])
+
+def check_sqlite(tmp_dir: Path):
+    db_path = str(tmp_dir / "search_cache.sqlite3")
+    a = SearchCache(ttl=TTL, stale_ttl=60, db_path=db_path)
+    b = SearchCache(ttl=TTL, stale_ttl=60, db_path=db_path)
+    a.set("q", ["from a"])
+    value, state = b.get("q")
+    check("entry written by another process is read from SQLite", state == "hit" and value == ["from a"], state)
+
+    time.sleep(TTL * 1.5)
+    b.set("q", ["from b"])
+    value, state = a.get("q")
+    check("newer SQLite row wins over a stale memory entry", state == "hit" and value == ["from b"], f"{state} {value}")
+
+    c = SearchCache(db_path=db_path)
+    check("entries survive a restart", c.get("q")[0] == ["from b"])
+
+    broken = SearchCache(ttl=TTL, db_path=str(tmp_dir / "missing" / "search_cache.sqlite3"))
+    broken.set("q", ["memory"])
+    value, state = broken.get("q")
+    check("unusable db_path falls back to memory", broken._db is None and state == "hit" and value == ["memory"], state)
+
+def main():
+    check_ttl()
+    check_lru()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        check_sqlite(Path(tmp_dir))
+    print("All checks passed" if not failures else f"{failures} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# SingleFlight (同じキーの処理の合流) の動きを確かめる
+#
+#   python local_tools/check_single_flight.py
+#
+# 合流 (処理は1回)、同時に待つ数の上限 (max_waiters)、呼び出し元の取り消し、例外の共有を見る。
+
+current_dir = Path(__file__).resolve().parent
+project_root = current_dir.parent
+sys.path.append(str(project_root / "backend"))
+
+from single_flight import SingleFlight, SingleFlightOverflow
+
+failures = 0
+
+def check(name: str, ok: bool, detail=""):
+    global failures
+    failures += not ok
+    print(f"{'OK' if ok else 'NG'}: {name}{f' ({detail})' if detail else ''}")
+
+def slow_call(calls: list, gate: asyncio.Event, result="done"):
+    async def fn():
+        calls.append(result)
+        await gate.wait()
+        return result
+    return fn
+
+async def check_coalescing():
+    flight = SingleFlight()
+    calls, gate = [], asyncio.Event()
+    tasks = [asyncio.create_task(flight.do("k", slow_call(calls, gate))) for _ in range(5)]
+    await asyncio.sleep(0)
+    gate.set()
+    results = await asyncio.gather(*tasks)
+    stats = flight.stats()
+    check("concurrent calls share one execution", calls == ["done"] and results == ["done"] * 5, calls)
+    check("leader / follower counts", (stats["leaders"], stats["coalesced"]) == (1, 4), stats)
+    check("finished key is forgotten", stats["in_flight"] == 0 and stats["waiting"] == 0, stats)
+
+async def check_waiter_cap():
+    flight = SingleFlight(max_waiters=2)
+    calls, gate = [], asyncio.Event()
+    leader = asyncio.create_task(flight.do("k", slow_call(calls, gate)))
+    followers = [asyncio.create_task(flight.do("k", slow_call(calls, gate))) for _ in range(2)]
+    await asyncio.sleep(0)
+    try:
+        await flight.do("k", slow_call(calls, gate))
+        check("waiter over max_waiters is rejected", False)
+    except SingleFlightOverflow:
+        check("waiter over max_waiters is rejected", flight.stats()["rejected"] == 1)
+
+    # 待っていた側が切断すれば枠が空く (累計ではなく同時に待っている数の上限)
+    followers[0].cancel()
+    await asyncio.sleep(0)
+    check("cancelled waiter frees its slot", flight.stats()["waiting"] == 1, flight.stats())
+    late = asyncio.create_task(flight.do("k", slow_call(calls, gate)))
+    await asyncio.sleep(0)
+    gate.set()
+    results = await asyncio.gather(leader, followers[1], late)
+    check("slot is reused by a later waiter", results == ["done"] * 3 and calls == ["done"], results)
+
+async def check_cancellation():
+    flight = SingleFlight()
+    calls, gate = [], asyncio.Event()
+    leader = asyncio.create_task(flight.do("k", slow_call(calls, gate)))
+    follower = asyncio.create_task(flight.do("k", slow_call(calls, gate)))
+    await asyncio.sleep(0)
+    leader.cancel()
+    await asyncio.sleep(0)
+    gate.set()
+    result = await follower
+    check("cancelling the leader's caller does not cancel the shared call", result == "done" and leader.cancelled())
+
+async def check_errors():
+    flight = SingleFlight()
+    gate = asyncio.Event()
+    async def failing():
+        await gate.wait()
+        raise RuntimeError("upstream")
+    tasks = [asyncio.create_task(flight.do("k", failing)) for _ in range(3)]
+    await asyncio.sleep(0)
+    gate.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    check("exception is raised to every waiter", all(isinstance(r, RuntimeError) for r in results), results)
+    calls = []
+    gate2 = asyncio.Event()
+    gate2.set()
+    result = await flight.do("k", slow_call(calls, gate2, "retry"))
+    check("failed call is not cached", result == "retry" and calls == ["retry"])
+
+async def run():
+    await check_coalescing()
+    await check_waiter_cap()
+    await check_cancellation()
+    await check_errors()
+
+def main():
+    asyncio.run(run())
+    print("All checks passed" if not failures else f"{failures} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# UpstreamGovernor (上流の呼び出し予算) の動きを確かめる
+#
+#   python local_tools/check_upstream_governor.py
+#
+# トークンを使い切った状態で待たせ、順番 (優先度 → 到着順)、合流した処理の優先度の引き上げ、
+# キューあふれ・待ち時間切れの UpstreamThrottled を見る。rate は大きめにして待ち時間を短くする。
+
+current_dir = Path(__file__).resolve().parent
+project_root = current_dir.parent
+sys.path.append(str(project_root / "backend"))
+
+from upstream_governor import (PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, SharedPriority, UpstreamGovernor,
+                               UpstreamThrottled, upstream_priority)
+
+failures = 0
+
+def check(name: str, ok: bool, detail=""):
+    global failures
+    failures += not ok
+    print(f"{'OK' if ok else 'NG'}: {name}{f' ({detail})' if detail else ''}")
+
+async def acquire_in_order(governor: UpstreamGovernor, waiters: list, before_release=None):
+    # waiters: [(name, priority)] をこの順に並ばせ、許可された順を返す
+    order = []
+    async def wait(name, priority):
+        await governor.acquire(priority)
+        order.append(name)
+    tasks = []
+    for name, priority in waiters:
+        tasks.append(asyncio.create_task(wait(name, priority)))
+        await asyncio.sleep(0)
+    if before_release: before_release()
+    await asyncio.gather(*tasks)
+    return order
+
+async def check_disabled():
+    governor = UpstreamGovernor(rate=0, burst=1)
+    for _ in range(100): await governor.acquire()
+    check("rate 0 never waits", governor.stats()["queued"] == 0, governor.stats())
+
+async def check_burst():
+    governor = UpstreamGovernor(rate=50, burst=3)
+    for _ in range(3): await governor.acquire()
+    stats = governor.stats()
+    check("burst is granted without queueing", stats["granted"] == 3 and stats["queued"] == 0, stats)
+    check("try_acquire fails with no tokens left", not governor.try_acquire())
+
+async def check_priority_order():
+    governor = UpstreamGovernor(rate=50, burst=1)
+    await governor.acquire()
+    order = await acquire_in_order(governor, [
+        ("bg-1", PRIORITY_BACKGROUND), ("ui-1", PRIORITY_INTERACTIVE), ("bg-2", PRIORITY_BACKGROUND), ("ui-2", PRIORITY_INTERACTIVE),
+    ])
+    check("interactive before background, arrival order within a priority", order == ["ui-1", "ui-2", "bg-1", "bg-2"], order)
+
+async def check_context_priority():
+    governor = UpstreamGovernor(rate=50, burst=1)
+    await governor.acquire()
+    order = []
+    async def wait(name, priority):
+        upstream_priority.set(priority)
+        await governor.acquire()
+        order.append(name)
+    background = asyncio.create_task(wait("bg", PRIORITY_BACKGROUND))
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(wait("ui", PRIORITY_INTERACTIVE))
+    await asyncio.gather(background, interactive)
+    check("priority is taken from the upstream_priority context", order == ["ui", "bg"], order)
+
+async def check_shared_priority():
+    # 裏の更新が先頭になった検索に利用者の検索が合流した場合、待っている途中で優先度が上がる
+    governor = UpstreamGovernor(rate=50, burst=1)
+    await governor.acquire()
+    shared = SharedPriority(PRIORITY_BACKGROUND)
+    order = await acquire_in_order(governor, [("other-bg", PRIORITY_BACKGROUND), ("coalesced", shared)],
+                                   before_release=lambda: shared.raise_to(PRIORITY_INTERACTIVE))
+    check("raised SharedPriority is re-ordered while queued", order == ["coalesced", "other-bg"], order)
+    shared.raise_to(PRIORITY_BACKGROUND)
+    check("SharedPriority is never lowered", shared.value == PRIORITY_INTERACTIVE)
+
+async def check_queue_overflow():
+    governor = UpstreamGovernor(rate=20, burst=1, max_queue=2, max_wait=5)
+    await governor.acquire()
+    queued = [asyncio.create_task(governor.acquire()) for _ in range(2)]
+    await asyncio.sleep(0)
+    try:
+        await governor.acquire()
+        check("call over max_queue is rejected", False)
+    except UpstreamThrottled:
+        check("call over max_queue is rejected", governor.stats()["rejected"] == 1, governor.stats())
+    await asyncio.gather(*queued)
+    check("queued calls are still granted", governor.stats()["waiting"] == 0, governor.stats())
+
+async def check_max_wait():
+    governor = UpstreamGovernor(rate=1, burst=1, max_wait=0.1)
+    await governor.acquire()
+    try:
+        await governor.acquire()
+        check("call waiting past max_wait is throttled", False)
+    except UpstreamThrottled:
+        check("call waiting past max_wait is throttled", governor.stats()["timed_out"] == 1, governor.stats())
+    await asyncio.sleep(1)
+    check("timed-out waiter does not use the next token", governor.try_acquire())
+
+async def run():
+    await check_disabled()
+    await check_burst()
+    await check_priority_order()
+    await check_context_priority()
+    await check_shared_priority()
+    await check_queue_overflow()
+    await check_max_wait()
+
+def main():
+    asyncio.run(run())
+    print("All checks passed" if not failures else f"{failures} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
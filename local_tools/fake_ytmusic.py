@@ -0,0 +1,169 @@
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import urllib.parse
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 記録済みの ytmusic.search レスポンスを再生する YTMusic の代役 (ネットワーク不要)
+#
+#   from fake_ytmusic import FakeYTMusic
+#   main.ytmusic = FakeYTMusic()
+#
+# フィクスチャの形式: { "<検索クエリ>": { "songs": [...], "videos": [...] } }
+# 未収録のクエリには、先頭のクエリの結果をタイトル中の曲名だけ差し替えて返す。
+#
+# 実データで撮り直す場合 (要ネットワーク):
+#   python local_tools/fake_ytmusic.py --record "夜に駆ける" "マリーゴールド"
+#
+# 負荷試験用に HTTP サーバーとして立てることもできる (レイテンシ・エラーを注入):
+#   python local_tools/fake_ytmusic.py --serve --port 18200 --p50-ms 150 --p95-ms 600 --error-rate 0.02
+#   main.ytmusic = RemoteYTMusic("http://127.0.0.1:18200")
+
+current_dir = Path(__file__).resolve().parent
+FIXTURE_PATH = current_dir / "fixtures" / "ytmusic_search.json"
+
+def load_fixtures(path=FIXTURE_PATH):
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+class FakeYTMusic:
+    def __init__(self, fixtures=None, latency: float = 0.0):
+        self.fixtures = fixtures if fixtures is not None else load_fixtures()
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._fallback_query = next(iter(self.fixtures))
+
+    def search(self, query: str, filter: str = None, limit: int = 20, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.latency: time.sleep(self.latency)
+
+        recorded = self.fixtures.get(query)
+        if recorded is None:
+            recorded = self.fixtures[self._fallback_query]
+            # 曲名部分だけをクエリに合わせ、結果の並び・チャンネル構成は同じにする
+            old = self._fallback_query.rsplit(" ", 1)[0]
+            new = query.rsplit(" ", 1)[0]
+            items = [dict(item, title=item["title"].replace(old, new), videoId=f"{item['videoId']}:{new}") for item in recorded.get(filter, [])]
+        else:
+            items = recorded.get(filter, [])
+        # search() は item に '_type' を書き込むのでコピーを返す
+        return [dict(item) for item in items[:limit]]
+
+class UpstreamProfile:
+    # 応答時間は対数正規分布 (中央値 p50_ms、95パーセンタイル p95_ms)。
+    # error_rate の割合で 500、throttle_rate の割合で 429 を返す
+    def __init__(self, p50_ms: float = 0.0, p95_ms: float = 0.0, error_rate: float = 0.0, throttle_rate: float = 0.0, seed=None):
+        self.p50_ms = p50_ms
+        self.sigma = math.log(p95_ms / p50_ms) / 1.645 if p50_ms > 0 and p95_ms > p50_ms else 0.0
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        # 戻り値: (遅延秒, HTTP ステータス)
+        with self._lock:
+            latency = self.p50_ms * math.exp(self._random.gauss(0, self.sigma)) / 1000 if self.p50_ms > 0 else 0.0
+            roll = self._random.random()
+        if roll < self.error_rate: return latency, 500
+        if roll < self.error_rate + self.throttle_rate: return latency, 429
+        return latency, 200
+
+def serve(fake: FakeYTMusic, profile: UpstreamProfile, host: str = "127.0.0.1", port: int = 0):
+    # GET /search?query=...&filter=songs&limit=20 に FakeYTMusic.search() の結果を返す。
+    # 呼び出し側で serve_forever() する。port=0 なら空いているポートを使う (server.server_address で確認)
+    stats = {"requests": 0, "errors": 0, "throttled": 0}
+    stats_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path == "/stats":
+                with stats_lock:
+                    return self.reply(200, dict(stats))
+            if url.path != "/search":
+                return self.reply(404, {"error": "not found"})
+            params = urllib.parse.parse_qs(url.query)
+            latency, status = profile.sample()
+            if latency: time.sleep(latency)
+            with stats_lock:
+                stats["requests"] += 1
+                if status == 500: stats["errors"] += 1
+                if status == 429: stats["throttled"] += 1
+            if status != 200:
+                return self.reply(status, {"error": "injected"})
+            items = fake.search(params["query"][0], filter=params.get("filter", ["songs"])[0], limit=int(params.get("limit", ["20"])[0]))
+            self.reply(200, items)
+
+        def reply(self, status: int, body):
+            data = json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+class RemoteYTMusic:
+    # serve() で立てたサーバーに問い合わせる YTMusic の代役。
+    # 本番と同じ build_session (コネクションプール・タイムアウト) を渡せば、上流の HTTP 周りも含めて計測できる
+    def __init__(self, base_url: str, session=None):
+        self.base_url = base_url.rstrip("/")
+        if session is None:
+            import requests
+            session = requests.Session()
+        self.session = session
+
+    def search(self, query: str, filter: str = None, limit: int = 20, **kwargs):
+        res = self.session.get(f"{self.base_url}/search", params={"query": query, "filter": filter or "songs", "limit": limit})
+        res.raise_for_status()
+        return res.json()
+
+def record(queries, path=FIXTURE_PATH):
+    from ytmusicapi import YTMusic
+    ytmusic = YTMusic(language='ja', location='JP')
+    fixtures = load_fixtures(path) if Path(path).exists() else {}
+    for q in queries:
+        search_query = f"{q} カラオケ"
+        fixtures[search_query] = {
+            "songs": ytmusic.search(search_query, filter="songs", limit=20),
+            "videos": ytmusic.search(search_query, filter="videos", limit=40),
+        }
+        print(f"Recorded: {search_query}")
+    Path(path).write_text(json.dumps(fixtures, ensure_ascii=False, indent=1) + "\n", encoding="utf-8")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", nargs="+", metavar="QUERY", help="YouTube Music から取得してフィクスチャに追加する")
+    parser.add_argument("--serve", action="store_true", help="フィクスチャを返す HTTP サーバーを起動する")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18200)
+    parser.add_argument("--p50-ms", type=float, default=0.0, help="応答時間の中央値 (ミリ秒)")
+    parser.add_argument("--p95-ms", type=float, default=0.0, help="応答時間の95パーセンタイル (ミリ秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500 を返す割合")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="429 を返す割合")
+    args = parser.parse_args()
+    if args.record:
+        record(args.record)
+    elif args.serve:
+        profile = UpstreamProfile(args.p50_ms, args.p95_ms, args.error_rate, args.throttle_rate)
+        server = serve(FakeYTMusic(), profile, args.host, args.port)
+        print(f"Serving fixtures on http://{args.host}:{server.server_address[1]}")
+        server.serve_forever()
+    else:
+        fixtures = load_fixtures()
+        for q, filters in fixtures.items():
+            print(f"{q}: songs={len(filters.get('songs', []))} videos={len(filters.get('videos', []))}")
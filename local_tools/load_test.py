@@ -0,0 +1,291 @@
+import os
+import sys
+import gzip
+import json
+import time
+import base64
+import random
+import socket
+import argparse
+import platform
+import urllib.parse
+import urllib.request
+import multiprocessing
+from collections import Counter
+from pathlib import Path
+
+# 負荷試験 (ネットワーク不要)
+#
+#   python local_tools/load_test.py --target uvicorn --concurrency 16 --requests 1000
+#   python local_tools/load_test.py --target mangum --concurrency 4 --p50-ms 200 --p95-ms 800 --error-rate 0.02
+#   python local_tools/load_test.py --target url --url http://localhost:8000     # 起動済みのサーバーに対して実行
+#   python local_tools/load_test.py --env UPSTREAM_MAX_WORKERS=4 --output before.json
+#   python local_tools/load_test.py --env UPSTREAM_MAX_WORKERS=16 --compare before.json
+#
+# 上流は fake_ytmusic.serve() (記録済みレスポンスを返す HTTP サーバー) を別プロセスで立て、
+# 応答時間 (--p50-ms / --p95-ms) とエラー (--error-rate / --throttle-rate) を注入する。
+#   - uvicorn: アプリを別プロセスの uvicorn で起動し、--concurrency 本の接続から GET /api/search を送る
+#   - mangum:  --concurrency 個のプロセスをそれぞれ Lambda の1インスタンスに見立て、
+#              API Gateway (HTTP API) 形式のイベントで main.handler を1件ずつ呼ぶ
+# クエリは --hot-ratio の割合で人気クエリ (フィクスチャの曲名、上位ほど多い)、残りは毎回異なるクエリ。
+# 同じ --seed なら同じ順序のクエリを送る。
+
+current_dir = Path(__file__).resolve().parent
+project_root = current_dir.parent
+sys.path.append(str(project_root / "backend"))
+sys.path.append(str(current_dir))
+
+from fake_ytmusic import FakeYTMusic, UpstreamProfile, RemoteYTMusic, load_fixtures, serve
+
+# 永続キャッシュなどの環境依存を切る (子プロセスにも引き継がれる)
+for env_name in ("SEARCH_CACHE_DB", "METADATA_STORE_DB", "CATALOG_SNAPSHOT", "KEYWORDS_CONFIG", "SEARCH_PROFILE_SAMPLE_RATE"):
+    os.environ.pop(env_name, None)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_until_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            if time.monotonic() >= deadline: raise
+            time.sleep(0.1)
+
+# --- Processes ---
+
+def run_upstream(port: int, profile_args: dict):
+    server = serve(FakeYTMusic(), UpstreamProfile(**profile_args), port=port)
+    server.serve_forever()
+
+def use_stand_in(upstream_url: str):
+    # main の YTMusic を代役に差し替える (本番と同じコネクションプール・タイムアウトで呼ぶ)
+    import main
+    session = main.build_session(main.UPSTREAM_MAX_WORKERS, main.UPSTREAM_CONNECT_TIMEOUT_SEC, main.UPSTREAM_READ_TIMEOUT_SEC)
+    main.ytmusic = RemoteYTMusic(upstream_url, session=session)
+    return main
+
+def run_app(port: int, upstream_url: str):
+    import uvicorn
+    main = use_stand_in(upstream_url)
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+# --- Requests ---
+
+def plan_queries(n: int, hot_ratio: float, seed: int):
+    titles = [q.rsplit(" ", 1)[0] for q in load_fixtures()]
+    weights = [1 / (i + 1) for i in range(len(titles))]
+    rng = random.Random(seed)
+    queries = []
+    for i in range(n):
+        if rng.random() < hot_ratio:
+            queries.append(rng.choices(titles, weights)[0])
+        else:
+            queries.append(f"{rng.choice(titles)} {i}")
+    return queries
+
+def summarize_body(status: int, body: bytes):
+    # 戻り値: (status, cache, partial)
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return status, None, None
+    return status, data.get("cache"), data.get("partial")
+
+async def drive_http(base_url: str, queries, concurrency: int):
+    import asyncio
+    import httpx
+    results = []
+    pending = iter(queries)
+
+    async def worker(client):
+        for q in pending:
+            started = time.perf_counter()
+            try:
+                res = await client.get("/api/search", params={"q": q})
+                outcome = summarize_body(res.status_code, res.content)
+            except httpx.HTTPError:
+                outcome = (0, None, None)
+            results.append((time.perf_counter() - started, *outcome))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return results
+
+lambda_main = None
+
+def init_lambda_worker(upstream_url: str):
+    global lambda_main
+    lambda_main = use_stand_in(upstream_url)
+
+def api_gateway_event(path: str, params: dict):
+    query_string = urllib.parse.urlencode(params)
+    now = time.time()
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": path,
+        "rawQueryString": query_string,
+        "queryStringParameters": params,
+        "headers": {"host": "localhost", "accept-encoding": "gzip", "user-agent": "load-test"},
+        "requestContext": {
+            "accountId": "000000000000",
+            "apiId": "local",
+            "domainName": "localhost",
+            "domainPrefix": "localhost",
+            "http": {"method": "GET", "path": path, "protocol": "HTTP/1.1", "sourceIp": "127.0.0.1", "userAgent": "load-test"},
+            "requestId": f"{now:.6f}",
+            "routeKey": "$default",
+            "stage": "$default",
+            "time": time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(now)),
+            "timeEpoch": int(now * 1000),
+        },
+        "isBase64Encoded": False,
+    }
+
+def invoke_lambda(q: str):
+    started = time.perf_counter()
+    try:
+        res = lambda_main.handler(api_gateway_event("/api/search", {"q": q}), None)
+        body = res.get("body") or ""
+        body = base64.b64decode(body) if res.get("isBase64Encoded") else body.encode()
+        headers = {k.lower(): v for k, v in (res.get("headers") or {}).items()}
+        if headers.get("content-encoding") == "gzip": body = gzip.decompress(body)
+        outcome = summarize_body(res["statusCode"], body)
+    except Exception as e:
+        print(f"  handler error: {e!r}")
+        outcome = (0, None, None)
+    return (time.perf_counter() - started, *outcome)
+
+# --- Report ---
+
+def percentile(ordered, q: float):
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)] if ordered else None
+
+def build_report(results, elapsed: float, concurrency: int, upstream_stats):
+    latencies = sorted(r[0] for r in results)
+    statuses = Counter(r[1] for r in results)
+    errors = sum(n for status, n in statuses.items() if status == 0 or status >= 500)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        "requests": len(results),
+        "concurrency": concurrency,
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else None,
+        "latency_ms": {"p50": ms(percentile(latencies, 0.5)), "p95": ms(percentile(latencies, 0.95)),
+                       "p99": ms(percentile(latencies, 0.99)), "max": ms(latencies[-1] if latencies else None)},
+        "error_rate": round(errors / len(results), 4) if results else 0.0,
+        "partial_rate": round(sum(1 for r in results if r[3]) / len(results), 4) if results else 0.0,
+        "status": {str(k): v for k, v in sorted(statuses.items())},
+        "cache": dict(Counter(r[2] for r in results if r[2] is not None)),
+        "upstream": upstream_stats,
+    }
+
+def print_report(report, baseline=None):
+    rows = [
+        ("throughput_rps", report["throughput_rps"], baseline and baseline["throughput_rps"]),
+        ("latency_p50_ms", report["latency_ms"]["p50"], baseline and baseline["latency_ms"]["p50"]),
+        ("latency_p95_ms", report["latency_ms"]["p95"], baseline and baseline["latency_ms"]["p95"]),
+        ("latency_p99_ms", report["latency_ms"]["p99"], baseline and baseline["latency_ms"]["p99"]),
+        ("error_rate", report["error_rate"], baseline and baseline["error_rate"]),
+        ("partial_rate", report["partial_rate"], baseline and baseline["partial_rate"]),
+    ]
+    print(f"{'metric':<20} {'value':>12}" + (f" {'base':>12} {'vs base':>10}" if baseline else ""))
+    for name, value, base in rows:
+        line = f"{name:<20} {value if value is not None else '-':>12}"
+        if baseline:
+            line += f" {base if base is not None else '-':>12}"
+            if value is not None and base: line += f" {(value - base) / base * 100:>+9.1f}%"
+        print(line)
+    print(f"status: {report['status']}  cache: {report['cache']}  upstream: {report['upstream']}")
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", choices=("uvicorn", "mangum", "url"), default="uvicorn")
+    parser.add_argument("--url", help="--target url のときの接続先 (例: http://localhost:8000)")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時接続数 (mangum ではインスタンス数)")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--hot-ratio", type=float, default=0.8, help="人気クエリ (キャッシュに載りやすい) の割合")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--p50-ms", type=float, default=150.0, help="上流の応答時間の中央値 (ミリ秒)")
+    parser.add_argument("--p95-ms", type=float, default=500.0, help="上流の応答時間の95パーセンタイル (ミリ秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="上流が 500 を返す割合")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="上流が 429 を返す割合")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="アプリ側の環境変数 (複数指定可)")
+    parser.add_argument("--output", help="結果を JSON で保存するパス")
+    parser.add_argument("--compare", help="比較対象の結果 JSON")
+    args = parser.parse_args()
+    if args.target == "url" and not args.url: parser.error("--target url requires --url")
+
+    for pair in args.env:
+        key, _, value = pair.partition("=")
+        os.environ[key] = value
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = []
+    queries = plan_queries(args.requests, args.hot_ratio, args.seed)
+    upstream_url = None
+    try:
+        if args.target != "url":
+            upstream_port = free_port()
+            profile_args = {"p50_ms": args.p50_ms, "p95_ms": args.p95_ms, "error_rate": args.error_rate,
+                            "throttle_rate": args.throttle_rate, "seed": args.seed}
+            processes.append(ctx.Process(target=run_upstream, args=(upstream_port, profile_args), daemon=True))
+            processes[-1].start()
+            upstream_url = f"http://127.0.0.1:{upstream_port}"
+            wait_until_ready(f"{upstream_url}/stats")
+
+        print(f"Target: {args.target} / concurrency={args.concurrency} / requests={args.requests} / hot={args.hot_ratio}")
+        if args.target == "mangum":
+            with ctx.Pool(args.concurrency, initializer=init_lambda_worker, initargs=(upstream_url,)) as pool:
+                # インスタンスの初期化 (import main) は計測に含めない
+                pool.map(time.sleep, [0.2] * args.concurrency)
+                started = time.perf_counter()
+                results = list(pool.imap_unordered(invoke_lambda, queries))
+                elapsed = time.perf_counter() - started
+        else:
+            import asyncio
+            base_url = args.url
+            if args.target == "uvicorn":
+                app_port = free_port()
+                processes.append(ctx.Process(target=run_app, args=(app_port, upstream_url), daemon=True))
+                processes[-1].start()
+                base_url = f"http://127.0.0.1:{app_port}"
+                wait_until_ready(f"{base_url}/api/metrics")
+            started = time.perf_counter()
+            results = asyncio.run(drive_http(base_url, queries, args.concurrency))
+            elapsed = time.perf_counter() - started
+
+        upstream_stats = None
+        if upstream_url:
+            with urllib.request.urlopen(f"{upstream_url}/stats", timeout=5) as res:
+                upstream_stats = json.loads(res.read())
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+    report = build_report(results, elapsed, args.concurrency, upstream_stats)
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))["report"]
+    print_report(report, baseline)
+
+    if args.output:
+        saved = {
+            "target": args.target,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "options": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "report": report,
+        }
+        Path(args.output).write_text(json.dumps(saved, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"Saved: {args.output}")
+
+if __name__ == "__main__":
+    main_cli()
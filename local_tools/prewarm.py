@@ -0,0 +1,89 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+# 検索キャッシュの事前取得 (prewarm)
+#
+#   python local_tools/prewarm.py                                  # backend/prewarm_queries.txt をこのプロセスで取得
+#   python local_tools/prewarm.py --top-file top.txt --budget 60   # 記録済みの上位クエリも対象にする
+#   python local_tools/prewarm.py --url http://localhost:8000      # 起動中のサーバー (または CloudFront) に問い合わせて温める
+#
+# プロセス内で実行する場合は、サーバーと同じ SEARCH_CACHE_DB / METADATA_STORE_DB / CATALOG_SNAPSHOT を
+# 指定しておくと、サーバー側のキャッシュ (SQLite) がそのまま埋まる。
+# 終了時に refreshed (取得した件数) / fresh (TTL内で省略) / failed / skipped (時間切れ) を表示する。
+
+current_dir = Path(__file__).resolve().parent
+project_root = current_dir.parent
+sys.path.append(str(project_root / "backend"))
+
+def read_queries(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+def prewarm_over_http(base_url: str, queries, concurrency: int, rate: float, budget: float):
+    # 通常の利用者と同じ GET /api/search を rate 件/秒・最大 concurrency 並列で送る
+    from concurrent.futures import ThreadPoolExecutor
+    report = {"queries": len(queries), "refreshed": 0, "fresh": 0, "failed": 0, "skipped": 0}
+    started = time.monotonic()
+
+    def fetch(q: str):
+        if time.monotonic() - started >= budget:
+            return "skipped"
+        url = f"{base_url.rstrip('/')}/api/search?{urllib.parse.urlencode({'q': q})}"
+        try:
+            with urllib.request.urlopen(url, timeout=max(budget - (time.monotonic() - started), 1)) as res:
+                body = json.loads(res.read())
+        except Exception as e:
+            print(f"  failed: {q} ({e})")
+            return "failed"
+        if body.get("partial"): return "failed"
+        return "fresh" if body.get("cache") == "hit" else "refreshed"
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        futures = []
+        for i, q in enumerate(queries):
+            if rate > 0 and i: time.sleep(1 / rate)
+            futures.append(pool.submit(fetch, q))
+        for future in futures:
+            report[future.result()] += 1
+    report["elapsed_sec"] = round(time.monotonic() - started, 3)
+    return report
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed-file", help="1行1クエリのファイル (既定: backend/prewarm_queries.txt)")
+    parser.add_argument("--top-file", action="append", default=[], help="記録済みの上位クエリ (同じ形式)。複数指定可")
+    parser.add_argument("--query", action="append", default=[], help="個別に追加するクエリ")
+    parser.add_argument("--url", help="指定した場合はこのサーバーに HTTP で問い合わせる")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=2.0, help="1秒あたりに開始するクエリ数 (0 で無制限)")
+    parser.add_argument("--budget", type=float, default=60.0, help="全体の制限時間 (秒)")
+    parser.add_argument("--all-stages", action="store_true", help="LOAD MORE 用の段階も取得する (プロセス内のみ)")
+    parser.add_argument("--force", action="store_true", help="TTL内のエントリも取り直す (プロセス内のみ)")
+    args = parser.parse_args()
+
+    queries = []
+    for path in args.top_file:
+        queries += read_queries(path)
+    queries += read_queries(args.seed_file or str(project_root / "backend" / "prewarm_queries.txt"))
+    queries += args.query
+    queries = list(dict.fromkeys(queries))
+    print(f"Prewarming {len(queries)} queries (concurrency={args.concurrency}, rate={args.rate}/s, budget={args.budget}s)")
+
+    if args.url:
+        report = prewarm_over_http(args.url, queries, args.concurrency, args.rate, args.budget)
+    else:
+        import main
+        stages = tuple(range(len(main.UPSTREAM_STAGES))) if args.all_stages else (0,)
+        report = asyncio.run(main.prewarm(queries, concurrency=args.concurrency, rate=args.rate,
+                                          time_budget=args.budget, stages=stages, force=args.force))
+        if main.catalog_index.snapshot_path: main.catalog_index.snapshot()
+    print(json.dumps(report, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,8 +1,19 @@
 import sys
 import os
+import argparse
+import tempfile
 from pathlib import Path
 import uvicorn
-from fastapi.staticfiles import StaticFiles
+
+# ローカル / オンプレミス用のサーバー
+#
+#   python local_tools/run_local.py                  # 開発用: 1プロセス、frontend はそのまま配信
+#   python local_tools/run_local.py --prod           # 本番用: CPU数のワーカー、事前圧縮した静的ファイル、キャッシュをワーカー間で共有
+#   python local_tools/run_local.py --prod --workers 4 --loop uvloop
+#
+# --prod (または --workers 2 以上) では、検索結果・メタデータ・ページングカーソル・歌詞のキャッシュを
+# --cache-dir の SQLite ファイル (WAL) に置き、全ワーカーで共有する。上流の呼び出し枠はワーカー数で等分する。
+# uvloop / httptools は任意 (pip install uvloop httptools)。入っていれば --loop auto で使われる。
 
 # --- パス解決のロジック ---
 # このファイル (run_local.py) のあるディレクトリ
@@ -15,23 +26,79 @@ project_root = current_dir.parent
 # (Lambda環境での動作に合わせるため、backend直下をルートに見立てるのがコツです)
 sys.path.append(str(project_root / "backend"))
 
-# backend/main.py から app をインポート
-from main import app
-
-# --- 静的ファイルの設定 ---
 # frontend フォルダの絶対パスを取得
 frontend_dir = project_root / "frontend"
 
-# マウント
-app.mount("/", StaticFiles(directory=str(frontend_dir), html=True), name="frontend")
+# ワーカープロセスごとに呼ばれる (uvicorn の factory)。設定は環境変数で受け取る
+def create_app():
+    # backend/main.py から app をインポート
+    from main import app
+
+    # --- 静的ファイルの設定 ---
+    static_max_age = os.environ.get("STATIC_MAX_AGE_SEC")
+    if static_max_age is not None:
+        from static_assets import PrecompressedStatic
+        app.mount("/", PrecompressedStatic(frontend_dir, max_age=int(static_max_age)), name="frontend")
+    else:
+        from fastapi.staticfiles import StaticFiles
+        app.mount("/", StaticFiles(directory=str(frontend_dir), html=True), name="frontend")
+    return app
+
+def share_caches(cache_dir: Path, workers: int):
+    # 明示的に指定されたパスはそのまま使う
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for env_name, file_name in (
+        ("SEARCH_CACHE_DB", "search_cache.sqlite3"),
+        ("METADATA_STORE_DB", "metadata.sqlite3"),
+        ("SEARCH_CURSOR_DB", "cursors.sqlite3"),
+        ("LYRICS_CACHE_DB", "lyrics.sqlite3"),
+        ("PLAYLIST_CACHE_DB", "playlists.sqlite3"),
+        ("CATALOG_SNAPSHOT", "catalog.json.gz"),
+    ):
+        os.environ.setdefault(env_name, str(cache_dir / file_name))
+    os.environ["SERVER_WORKERS"] = str(workers)
+
+def resolve_loop(name: str):
+    if name != "auto": return name
+    try:
+        import uvloop # noqa: F401
+        return "uvloop"
+    except ImportError:
+        return "asyncio"
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prod", action="store_true", help="本番用の構成で起動する")
+    parser.add_argument("--workers", type=int, help="ワーカープロセス数 (既定: --prod ならCPU数、それ以外は1)")
+    parser.add_argument("--loop", choices=("auto", "asyncio", "uvloop"), default="auto")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--cache-dir", default=str(Path(tempfile.gettempdir()) / "karaoke-cache"), help="ワーカー間で共有するキャッシュの置き場所")
+    parser.add_argument("--static-max-age", type=int, default=86400, help="--prod での静的ファイル (HTML 以外) の Cache-Control max-age (秒)")
+    args = parser.parse_args()
+
+    workers = args.workers or ((os.cpu_count() or 1) if args.prod else 1)
+    loop = resolve_loop(args.loop)
+    if loop == "uvloop":
+        try:
+            import uvloop # noqa: F401
+        except ImportError:
+            parser.error("uvloop is not installed (pip install uvloop)")
+
+    if args.prod:
+        os.environ["STATIC_MAX_AGE_SEC"] = str(args.static_max_age)
+    else:
+        # ローカル開発フラグをセット
+        os.environ["LOCAL_DEV"] = "true"
+    if workers > 1:
+        share_caches(Path(args.cache_dir), workers)
+
     print(f"Project Root: {project_root}")
     print(f"Frontend Dir: {frontend_dir}")
-    print("Starting Local Server...")
-    
-    # ローカル開発フラグをセット
-    os.environ["LOCAL_DEV"] = "true"
-    
-    # 起動
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    print(f"Starting {'Production' if args.prod else 'Local'} Server... (workers={workers}, loop={loop})")
+    if workers > 1: print(f"Shared Cache Dir: {args.cache_dir}")
+
+    # 起動 (複数ワーカーでは各プロセスが create_app を読み込む)
+    uvicorn.run("run_local:create_app", factory=True, app_dir=str(current_dir),
+                host=args.host, port=args.port, workers=workers, loop=loop,
+                access_log=not args.prod)
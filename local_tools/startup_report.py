@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+# コールドスタートの内訳を計測する
+#
+#   python local_tools/startup_report.py               # lazy / eager 両モードを計測
+#   python local_tools/startup_report.py --top 30      # import 時間の上位30件を表示
+#
+# モードごとに新しいプロセスを起動し、
+#   1. python -X importtime による import 時間 (self / cumulative)
+#   2. import main の所要時間
+#   3. Mangum handler に空クエリのイベントを1回通すまでの時間
+# を出力する。上流へのアクセスは発生しない。
+
+current_dir = Path(__file__).resolve().parent
+project_root = current_dir.parent
+backend_dir = project_root / "backend"
+
+# 子プロセスで実行するスクリプト
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+event = {
+    "version": "2.0", "routeKey": "$default", "rawPath": "/api/search", "rawQueryString": "q=",
+    "headers": {"host": "localhost"}, "isBase64Encoded": False,
+    "requestContext": {"http": {"method": "GET", "path": "/api/search", "sourceIp": "127.0.0.1", "protocol": "HTTP/1.1"},
+                       "stage": "$default", "requestId": "startup-report"},
+}
+response = main.handler(event, None)
+t2 = time.perf_counter()
+print(json.dumps({"import_main": t1 - t0, "first_request": t2 - t1, "status": response["statusCode"],
+                  "ytmusic_constructed": main.ytmusic is not None}))
+"""
+
+def parse_importtime(stderr: str):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line: continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue  # ヘッダ行
+    return rows
+
+def import_depth(name: str):
+    # -X importtime はネストの深さを名前の前の空白 (2つずつ) で表す
+    return (len(name) - len(name.lstrip()) - 1) // 2
+
+def run_mode(mode: str):
+    env = dict(os.environ, STARTUP_MODE=mode)
+    env.pop("SEARCH_CACHE_DB", None)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=backend_dir, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return json.loads(proc.stdout.strip().splitlines()[-1]), parse_importtime(proc.stderr)
+
+def print_report(mode: str, timings: dict, imports: list, top: int):
+    print(f"=== STARTUP_MODE={mode} ===")
+    print(f"import main    : {timings['import_main'] * 1000:8.1f} ms (with -X importtime overhead)")
+    print(f"first request  : {timings['first_request'] * 1000:8.1f} ms (status {timings['status']})")
+    print(f"YTMusic ready  : {timings['ytmusic_constructed']}")
+    # main が直接 import しているモジュールを、配下を含めた合計時間で表示する
+    direct = [(name.strip(), cum) for name, _, cum in imports if import_depth(name) == 1]
+    print(f"--- imports made by main, cumulative (top {top}) ---")
+    for name, cum in sorted(direct, key=lambda r: r[1], reverse=True)[:top]:
+        print(f"  {cum / 1000:8.1f} ms  {name}")
+    print(f"--- modules by self time (top {top}) ---")
+    for name, self_us, _ in sorted(imports, key=lambda r: r[1], reverse=True)[:top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name.strip()}")
+    print()
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["lazy", "eager"], action="append", help="計測するモード (既定: 両方)")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    for mode in args.mode or ["lazy", "eager"]:
+        timings, imports = run_mode(mode)
+        print_report(mode, timings, imports, args.top)
+
+if __name__ == "__main__":
+    main_cli()
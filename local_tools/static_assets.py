@@ -0,0 +1,80 @@
+import gzip
+import hashlib
+import mimetypes
+from pathlib import Path
+
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse, Response
+
+# 事前圧縮した静的ファイルを返す ASGI アプリ (run_local.py --prod 用)
+#
+# 起動時に directory 以下を読み込み、gzip (brotli が入っていれば br も) に圧縮してメモリに保持する。
+# リクエストごとの圧縮・ファイル読み込みはしない。ETag を付け、再検証 (If-None-Match) には 304 を返す。
+# HTML (index.html 等) は no-cache (毎回 ETag で再検証) にして、デプロイ後すぐに新しいフロントエンドが届くようにする。
+# 長めの max-age はそれ以外のファイルだけに付ける。フロントエンドを書き換えたらサーバーを再起動する。
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class Asset:
+    def __init__(self, path: Path):
+        self.body = path.read_bytes()
+        self.media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        if self.media_type.startswith("text/"): self.media_type += "; charset=utf-8"
+        self.etag = f'W/"{hashlib.blake2b(self.body, digest_size=12).hexdigest()}"'
+        self.encoded = {}
+        gz = gzip.compress(self.body, compresslevel=9, mtime=0)
+        if len(gz) < len(self.body): self.encoded["gzip"] = gz
+        if brotli is not None:
+            br = brotli.compress(self.body, quality=11)
+            if len(br) < len(self.body): self.encoded["br"] = br
+
+def accepted_encodings(accept_encoding: str):
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"): continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+class PrecompressedStatic:
+    def __init__(self, directory, max_age: int = 86400):
+        self.cache_control = f"public, max-age={max_age}" if max_age > 0 else "no-cache"
+        self.html_cache_control = "no-cache"
+        self.assets = {}
+        root = Path(directory)
+        for path in sorted(root.rglob("*")):
+            if path.is_file():
+                self.assets["/" + path.relative_to(root).as_posix()] = Asset(path)
+
+    def find(self, path: str):
+        if path.endswith("/"): path += "index.html"
+        return self.assets.get(path)
+
+    async def __call__(self, scope, receive, send):
+        if scope["method"] not in ("GET", "HEAD"):
+            response = PlainTextResponse("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+            return await response(scope, receive, send)
+        asset = self.find(scope["path"])
+        if asset is None:
+            return await PlainTextResponse("Not Found", status_code=404)(scope, receive, send)
+
+        request_headers = Headers(scope=scope)
+        cache_control = self.html_cache_control if asset.media_type.startswith("text/html") else self.cache_control
+        headers = {"ETag": asset.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if_none_match = request_headers.get("if-none-match", "")
+        if asset.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return await Response(status_code=304, headers=headers)(scope, receive, send)
+
+        body = asset.body
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in asset.encoded:
+                body = asset.encoded[encoding]
+                headers["Content-Encoding"] = encoding
+                break
+        response = Response(body if scope["method"] == "GET" else b"", media_type=asset.media_type, headers=headers)
+        if scope["method"] == "HEAD": response.headers["Content-Length"] = str(len(body))
+        await response(scope, receive, send)